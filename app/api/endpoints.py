@@ -1,119 +1,333 @@
 import asyncio
+from datetime import datetime, timedelta
 
-from fastapi import APIRouter, Query, HTTPException, Depends
+from fastapi import APIRouter, Query, HTTPException, Depends, Request, Response
 from typing import List, Optional
 
+from app.api.pagination import InvalidCursor, TrendingCursor, decode_cursor, encode_cursor
 from app.models.song import Song, Genre
 from app.services.database import get_db_service, DatabaseService
-from app.services.trending_algorithm import TrendingAlgorithm
 from app.services.data_generator import DataGenerator
+from app.services.trending_index import trending_index
+from app.services.trending_job import TrendingRecomputeJob
+from app.services.ingestion import IngestionOverloaded, get_event_sink, parse_events
+from app.cache.cache_warmer import cache_warmer
+from app.cache.leaderboard import trending_leaderboard
+from app.cache.local_cache import trending_cache
 from app.cache.redis_cache import redis_cache
-from pymongo import UpdateOne
+from app.cache.codecs import is_stale
+from app.cache.single_flight import SingleFlight
+from app.cache.response_cache import build_response, encode_response_body, songs_response, trending_cache_key
+from pydantic import ValidationError
+from pymongo.errors import OperationFailure
 import logging
-import json
 
-from app.constants import EXPIRY_TIME
-from app.tasks import refresh_trending_cache
+from app.constants import EXPIRY_TIME, SCORE_MODE_DECAY_INVARIANT
+from app.settings.config import settings
+from app.tasks import refresh_trending_cache, trending_scheduler
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# SnapshotTooOld and SnapshotUnavailable, the snapshot of a cursor pagination is gone
+SNAPSHOT_EXPIRED_ERROR_CODES = {239, 246}
+
+# Coalesces concurrent cache misses for the same page
+trending_single_flight = SingleFlight()
+
+# Keeps stale-while-revalidate refresh tasks referenced until they finish
+_background_refreshes = set()
+
 
 @router.get("/trending/songs", response_model=List[Song], tags=["Trending Songs"])
 async def get_top_trending_songs(
+        request: Request,
         limit: int = Query(default=100, le=500),
         offset: int = Query(default=0, ge=0),
         genre: Optional[Genre] = None,
+        region: Optional[str] = Query(
+            default=None,
+            description="Rank songs by their popularity in a region, one of TRENDING_REGIONS such as US or IN."
+        ),
+        cursor: Optional[str] = Query(
+            default=None,
+            description="Opaque token from the X-Next-Cursor header of the previous page. "
+                        "Pass an empty value to start cursor pagination instead of offset pagination."
+        ),
         db_service: DatabaseService = Depends(get_db_service)
 ):
     """
     Retrieve top trending songs with Redis caching
     """
+    if region is not None and region not in settings.TRENDING_REGIONS:
+        # Other regions have no indexes, ranking them would scan the collection
+        raise HTTPException(
+            status_code=400, detail=f"Unknown region {region}, expected one of {settings.TRENDING_REGIONS}"
+        )
+
+    if cursor is not None:
+        return await _get_trending_page_by_cursor(
+            cursor, limit, genre, db_service, request.headers.get("accept-encoding", ""), region
+        )
+
+    # Serve from the in-process index when it covers the requested page
+    if settings.TRENDING_INDEX_ENABLED and region is None:
+        indexed_songs = trending_index.get(limit, offset, genre)
+        if indexed_songs is not None:
+            return songs_response(indexed_songs)
+
+    # Serve any page within the Redis leaderboard
+    if settings.LEADERBOARD_ENABLED and region is None:
+        try:
+            leaderboard_songs = await trending_leaderboard.get_page(limit, offset, genre)
+            if leaderboard_songs is not None:
+                return songs_response(leaderboard_songs)
+        except Exception as e:
+            logger.warning(f"Redis error when reading the trending leaderboard: {str(e)}")
+
     # Create a unique cache key based on parameters
-    cache_key = f"trending_songs:{genre or 'all'}:{limit}:{offset}"
+    cache_key = trending_cache_key(genre, limit, offset, region)
+    if region is None:
+        # Pages requested most are warmed after every trending update
+        cache_warmer.record(genre, limit, offset)
+    accept_encoding = request.headers.get("accept-encoding", "")
+
+    def load_page(wait_for_other: bool = True):
+        return _load_trending_page(db_service, cache_key, limit, offset, genre, wait_for_other, region)
 
-    # Try to get cached result with error handling
+    # Try to get the cached response body with error handling
     try:
-        cached_result = await redis_cache.get(cache_key)
-        if cached_result:
-            cached_result = json.loads(cached_result)  # Convert back from JSON
-            return [Song(**song) for song in cached_result]
+        cached_body = await trending_cache.get_raw(cache_key)
+        if cached_body:
+            if not is_stale(cached_body):
+                return build_response(cached_body, accept_encoding, cache_status="HIT")
+
+            # Serve the stale page right away and refresh it in the background
+            refresh = asyncio.create_task(
+                trending_single_flight.do(f"refresh:{cache_key}", lambda: load_page(wait_for_other=False))
+            )
+            _background_refreshes.add(refresh)
+            refresh.add_done_callback(_background_refreshes.discard)
+            return build_response(cached_body, accept_encoding, cache_status="STALE")
     except Exception as e:
         # Redis error, log and continue to database query
         logger.warning(f"Redis error when fetching {cache_key}: {str(e)}")
 
+    try:
+        # Only one request per key and process goes to the database at a time
+        body = await trending_single_flight.do(cache_key, load_page)
+        return build_response(body, accept_encoding, cache_status="MISS")
+
+    except Exception as e:
+        logger.error(f"Database error in get_top_trending_songs: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve trending songs")
+
+
+async def _get_trending_page_by_cursor(
+        token: str,
+        limit: int,
+        genre: Optional[Genre],
+        db_service: DatabaseService,
+        accept_encoding: str,
+        region: Optional[str] = None
+) -> Response:
+    """
+    Serve a page of keyset pagination, continuing after the position encoded in token.
+    """
+    genre_value = genre.value if genre else None
+    position, cluster_time = None, None
+    if token:
+        try:
+            cursor = decode_cursor(token)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if cursor.genre != genre_value:
+            raise HTTPException(status_code=400, detail="Cursor belongs to a different genre filter")
+        if cursor.region != region:
+            raise HTTPException(status_code=400, detail="Cursor belongs to a different region filter")
+        position, cluster_time = (cursor.score, cursor.song_id), cursor.cluster_time
+
+    try:
+        songs, last_position, cluster_time = await db_service.get_trending_songs_after(
+            limit, genre, position, cluster_time, region
+        )
+    except OperationFailure as e:
+        if e.code in SNAPSHOT_EXPIRED_ERROR_CODES:
+            raise HTTPException(status_code=409, detail="Pagination snapshot expired, restart from the first page")
+        logger.error(f"Database error in get_top_trending_songs: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve trending songs")
+    except Exception as e:
+        logger.error(f"Database error in get_top_trending_songs: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve trending songs")
+
+    response = build_response(encode_response_body(songs), accept_encoding)
+    if len(songs) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            TrendingCursor(*last_position, genre=genre_value, cluster_time=cluster_time, region=region)
+        )
+    return response
+
+
+async def _load_trending_page(
+        db_service: DatabaseService,
+        cache_key: str,
+        limit: int,
+        offset: int,
+        genre: Optional[Genre],
+        wait_for_other: bool = True,
+        region: Optional[str] = None
+) -> Optional[bytes]:
+    """
+    Fetch a trending page from the database and cache it.
+
+    A Redis lock ensures only one instance repopulates the key, the others wait
+    briefly for its result before querying the database themselves. Background
+    refreshes (wait_for_other=False) leave the key to the lock holder and return None.
+    """
+    try:
+        lock_token = await trending_cache.acquire_lock(cache_key)
+    except Exception as e:
+        logger.warning(f"Redis error when locking {cache_key}: {str(e)}")
+        lock_token = ""  # Redis is unavailable, nobody else can be repopulating the key
+
+    if lock_token is None:
+        if not wait_for_other:
+            return None
+        body = await _wait_for_cached_page(cache_key)
+        if body:
+            return body
+
     try:
         # Fetch songs from database
-        songs = await db_service.get_top_trending_songs(limit, offset, genre)
+        songs = await db_service.get_top_trending_documents(limit, offset, genre, region, serving=True)
+        body = encode_response_body(songs)
 
         # Only cache if we have results
         if songs:
             try:
-                serialized_songs = json.dumps(
-                    [song.model_dump() for song in songs],
-                    default=str
-                )
-                # Cache the result with expiry
-                await redis_cache.set(
+                # Cache the response body with expiry
+                await trending_cache.set_raw(
                     cache_key,
-                    serialized_songs,
-                    expiration=EXPIRY_TIME
+                    body,
+                    expiration=EXPIRY_TIME + settings.CACHE_STALE_TTL,
+                    soft_expiration=EXPIRY_TIME
                 )
             except Exception as e:
                 # Log caching error but don't fail the request
                 logger.error(f"Failed to cache results for {cache_key}: {str(e)}")
 
-        return songs
+        return body
 
-    except Exception as e:
-        logger.error(f"Database error in get_top_trending_songs: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to retrieve trending songs")
+    finally:
+        if lock_token:
+            try:
+                await trending_cache.release_lock(cache_key, lock_token)
+            except Exception as e:
+                logger.warning(f"Redis error when unlocking {cache_key}: {str(e)}")
+
+
+async def _wait_for_cached_page(cache_key: str) -> Optional[bytes]:
+    """
+    Poll the cache for a page another instance is repopulating.
+    """
+    deadline = asyncio.get_running_loop().time() + settings.CACHE_LOCK_WAIT_SECONDS
+    while asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(settings.CACHE_LOCK_POLL_INTERVAL)
+        try:
+            body = await trending_cache.get_raw(cache_key)
+        except Exception as e:
+            logger.warning(f"Redis error when fetching {cache_key}: {str(e)}")
+            return None
+        if body and not is_stale(body):
+            return body
+
+    return None
 
 
 @router.post("/trending/update", response_model=dict, tags=["Trending Songs"])
 async def update_trending_data(
-    db_service: DatabaseService = Depends(get_db_service)
+    db_service: DatabaseService = Depends(get_db_service),
+    incremental: Optional[bool] = None
 ):
     """
     Update trending data and invalidate cache
 
+    In incremental mode only songs whose stats changed since the last run are rescored.
+    They are scored against the anchor time of the last full run, so every stored score
+    shares one reference time and songs are ranked as of that anchor. In the classic
+    score mode this is an approximation: recency is added to the engagement, not applied
+    as a factor, so it can't be decayed analytically without rewriting every song. A
+    full run at the current time would shrink the recency terms by 2 ** (-hours since
+    the anchor / 24), until then recency weighs up to 2 ** (TRENDING_FULL_RECOMPUTE_HOURS
+    / 24) times more against engagement (2x by default). A full run re-anchors all scores
+    once TRENDING_FULL_RECOMPUTE_HOURS have passed. In the decay_invariant score mode the
+    decay is applied analytically when serving, stored scores never go stale and no full
+    run is needed.
+
     NOTE: This doesn't have to be an endpoint as we have a cron setup to run every 60 mins.
     Creating it so that validating results will be easier from /docs for assignment validation POV
     """
+    return await run_trending_update(db_service, incremental)
+
+
+async def run_trending_update(
+        db_service: DatabaseService,
+        incremental: Optional[bool] = None,
+        fencing_token: Optional[int] = None
+):
+    """
+    Update trending scores, then rebuild the trending index and leaderboard and refresh the cache
+
+    Args:
+        db_service: Database service
+        incremental: Rescore only songs changed since the last run, defaults to the settings value
+        fencing_token: Token of the scheduler leader running the update, the update is skipped
+            and not recorded once a newer leader claimed it
+    """
     logger.info("Starting trending score update process")
 
+    if incremental is None:
+        incremental = settings.TRENDING_INCREMENTAL_UPDATES
+
     try:
-        # Update trending scores
-        # Fetch only required fields for all songs
-        songs_cursor = db_service.songs_collection.find({}, {
-            "song_id": 1, "last_played_timestamp": 1, "play_count": 1,
-            "user_rating": 1, "social_media_shares": 1, "geographic_popularity": 1
-        })
-
-        bulk_operations = []
-        batch_size = 1000  # Process in batches
-
-        # Iterate through cursor asynchronously
-        async for song in songs_cursor:
-            trending_score = TrendingAlgorithm.calculate_trending_score(song)  # Compute score
-            bulk_operations.append(
-                UpdateOne({"song_id": song["song_id"]}, {"$set": {"trending_score": trending_score}})
-            )
+        if fencing_token is not None and not await db_service.claim_trending_run(fencing_token):
+            return None
+
+        started_at = datetime.utcnow()
+        query = {}
+        current_time = started_at  # Score every batch against the same reference time
+
+        if incremental:
+            last_run = await db_service.get_trending_run()
+            if last_run and settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+                # Stored log scores never go stale, unchanged songs need no rescoring at all
+                query = {"stats_updated_at": {"$gte": last_run["started_at"]}}
+            elif last_run and started_at - last_run["anchor_time"] < timedelta(
+                    hours=settings.TRENDING_FULL_RECOMPUTE_HOURS):
+                query = {"stats_updated_at": {"$gte": last_run["started_at"]}}
+                current_time = last_run["anchor_time"]
+            else:
+                incremental = False
+                logger.info("No recent full trending update found, running a full update")
+
+        # Update trending scores in a sharded pipeline, scoring off the event loop
+        await TrendingRecomputeJob(db_service).run(query, current_time)
+
+        if not await db_service.record_trending_run(started_at, current_time, incremental, fencing_token):
+            # A newer leader runs the update, leave the index, leaderboard and cache to it
+            return None
 
-            # Execute batch update when batch_size is reached
-            if len(bulk_operations) >= batch_size:
-                await db_service.songs_collection.bulk_write(bulk_operations)
-                bulk_operations = []  # Reset for next batch
+        logger.info("Trending score update completed")
 
-        # Process any remaining operations
-        if bulk_operations:
-            await db_service.songs_collection.bulk_write(bulk_operations)
+        if settings.TRENDING_INDEX_ENABLED:
+            await trending_index.build(db_service)
 
-        logger.info("Trending score update completed")
+        if settings.LEADERBOARD_ENABLED:
+            await trending_leaderboard.build(db_service)
 
         # Refresh cache with the pre-existing refresh function
-        background_task = asyncio.create_task(refresh_trending_cache(db_service, redis_cache))
+        background_task = asyncio.create_task(refresh_trending_cache(db_service, trending_cache))
 
         logger.info(f"Cache refresh task started in background with task {background_task}")
 
@@ -130,15 +344,84 @@ async def update_trending_data(
         logger.error(f"Error in trending update process: {str(e)}")
 
 
+@router.get("/trending/update/status", response_model=dict, tags=["Trending Songs"])
+async def get_trending_update_status():
+    """
+    Progress of the running or last trending score update of this instance
+    """
+    job = TrendingRecomputeJob.latest
+    return job.progress if job else {"status": "idle"}
+
+
+@router.get("/scheduler/status", response_model=dict, tags=["Monitoring"])
+async def get_scheduler_status():
+    """
+    Whether this instance is the scheduler leader, the current lease holder with its
+    fencing token and last heartbeat, and the next run of every scheduled job
+    """
+    return await trending_scheduler.status()
+
+
+@router.get("/metrics/pools", response_model=dict, tags=["Monitoring"])
+async def get_pool_metrics(db_service: DatabaseService = Depends(get_db_service)):
+    """
+    Connection pool usage of MongoDB (summed over servers) and Redis: connections in
+    use, callers waiting for one, checkout wait times and failed checkouts
+    """
+    return {
+        "mongodb": db_service.pool_stats.snapshot(),
+        "redis": redis_cache.pool_stats.snapshot(),
+    }
+
+
+@router.post("/events", response_model=dict, status_code=202, tags=["Events"])
+async def ingest_song_events(request: Request):
+    """
+    Ingest a batch of song events (plays, shares, ratings).
+
+    The body is either a JSON array of events or newline delimited JSON
+    (Content-Type: application/x-ndjson). Events are aggregated in memory or in
+    Redis, depending on INGESTION_BACKEND, and applied to the songs in bulk, they
+    show up in trending scores after the next flush and trending update.
+    """
+    body = await request.body()
+    ndjson = request.headers.get("content-type", "").startswith("application/x-ndjson")
+    try:
+        events = parse_events(body, ndjson=ndjson)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+    if len(events) > settings.INGESTION_MAX_BATCH_EVENTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.INGESTION_MAX_BATCH_EVENTS} events per request"
+        )
+
+    try:
+        accepted = await get_event_sink().add(events)
+    except IngestionOverloaded as e:
+        logger.warning(f"Song event ingestion overloaded: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Too many pending events, retry later",
+            headers={"Retry-After": str(settings.INGESTION_RETRY_AFTER_SECONDS)}
+        )
+
+    return {"accepted": accepted}
+
+
 @router.get("/simulation/generate_data", response_model=dict, tags=["Simulation"])
-async def generate_seed_data(num: int, db_service: DatabaseService = Depends(get_db_service)):
+async def generate_seed_data(
+        num: int,
+        seed: Optional[int] = None,
+        db_service: DatabaseService = Depends(get_db_service)
+):
     """
-    Retrieve top trending songs with Redis caching
+    Generate num synthetic songs, streamed into the database in chunks.
+    Pass a seed for a reproducible dataset, larger datasets are better built with `python -m app.cli generate`.
     """
     try:
-        songs = DataGenerator.generate_songs(num)
-        # Fetch songs from database
-        await db_service.insert_songs(songs)
+        await DataGenerator.generate_dataset(db_service, num, seed=seed)
 
         await update_trending_data(db_service)
 
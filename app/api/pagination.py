@@ -0,0 +1,48 @@
+import base64
+import binascii
+import json
+from typing import NamedTuple, Optional
+
+from bson import Timestamp
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+class TrendingCursor(NamedTuple):
+    """
+    Position after the last song of a page, plus the snapshot the pagination reads from
+    """
+    score: float
+    song_id: str
+    genre: Optional[str] = None
+    cluster_time: Optional[Timestamp] = None
+    region: Optional[str] = None
+
+
+def encode_cursor(cursor: TrendingCursor) -> str:
+    """
+    Encode a cursor into an opaque URL-safe token
+    """
+    payload = {"s": cursor.score, "id": cursor.song_id, "g": cursor.genre}
+    if cursor.cluster_time is not None:
+        payload["t"] = [cursor.cluster_time.time, cursor.cluster_time.inc]
+    if cursor.region is not None:
+        payload["r"] = cursor.region
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> TrendingCursor:
+    """
+    Decode a token produced by encode_cursor
+
+    Raises:
+        InvalidCursor: If the token is malformed
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        cluster_time = Timestamp(*payload["t"]) if "t" in payload else None
+        return TrendingCursor(float(payload["s"]), str(payload["id"]), payload.get("g"), cluster_time, payload.get("r"))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        raise InvalidCursor(f"Invalid pagination cursor: {e}") from e
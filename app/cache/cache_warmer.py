@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from app.cache.redis_cache import redis_cache
+from app.cache.response_cache import encode_response_body, trending_cache_key
+from app.constants import EXPIRY_TIME
+from app.models.song import Genre
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Request counts of trending pages, members are "<genre|all>|<limit>|<offset>"
+DEMAND_KEY = "cache:demand"
+
+Page = Tuple[Optional[Genre], int, int]
+
+
+class CacheWarmer:
+    """
+    Warms the cached trending pages that are requested most.
+
+    Every instance counts the pages it had to look up in the response cache and adds
+    the counts to a Redis sorted set at an interval, so a request only costs a local
+    increment. Both only keep the counts of the max_pages most requested pages. Warming
+    picks the most requested pages, queries them with bounded concurrency and writes all
+    of them in one MULTI transaction. Past counts are then decayed, the ranking follows
+    shifts in demand.
+    """
+
+    def __init__(self, cache, pages: int = None, concurrency: int = None, max_pages: int = None):
+        self.cache = cache
+        self.pages = pages or settings.CACHE_WARM_PAGES
+        self.concurrency = concurrency or settings.CACHE_WARM_CONCURRENCY
+        self.max_pages = max_pages or settings.CACHE_DEMAND_MAX_PAGES
+        self._demand: Counter = Counter()
+
+    def record(self, genre: Optional[Genre], limit: int, offset: int) -> None:
+        """
+        Count a request of a trending page
+        """
+        self._demand[f"{genre.value if genre else 'all'}|{limit}|{offset}"] += 1
+        if len(self._demand) > 2 * self.max_pages:
+            # Requests crawling distinct offsets, drop the least requested pages between flushes
+            self._demand = Counter(dict(self._demand.most_common(self.max_pages)))
+
+    async def flush_demand(self) -> None:
+        """
+        Add the request counts of this instance to the shared counts in Redis
+        """
+        demand, self._demand = self._demand, Counter()
+        if not demand:
+            return
+
+        try:
+            async with self.cache.client.pipeline(transaction=False) as pipe:
+                for member, count in demand.items():
+                    pipe.zincrby(DEMAND_KEY, count, member)
+                pipe.zremrangebyrank(DEMAND_KEY, 0, -self.max_pages - 1)
+                await pipe.execute()
+        except Exception:
+            # Keep the counts for the next flush
+            self._demand.update(demand)
+            raise
+
+    async def hot_pages(self) -> List[Page]:
+        """
+        The most requested pages, the first page of every genre while nothing was counted yet
+        """
+        pages = []
+        for member in await self.cache.client.zrevrange(DEMAND_KEY, 0, self.pages - 1):
+            genre, limit, offset = member.decode().split("|")
+            try:
+                pages.append((None if genre == "all" else Genre(genre), int(limit), int(offset)))
+            except ValueError:
+                logger.warning(f"Ignoring request count of unknown page {member}")
+
+        return pages or [(genre, 100, 0) for genre in [None, *Genre]]
+
+    async def warm(self, db_service, page_cache=None) -> int:
+        """
+        Cache the most requested pages
+
+        Args:
+            db_service: Database service the pages are read from
+            page_cache: Cache the pages are written to, defaults to the cache of the counts
+        Returns:
+            Number of pages cached
+        """
+        page_cache = page_cache or self.cache
+        await self.flush_demand()
+        pages = await self.hot_pages()
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def load(page: Page):
+            async with slots:
+                return await db_service.get_top_trending_documents(page[1], page[2], page[0])
+
+        results = await asyncio.gather(*(load(page) for page in pages), return_exceptions=True)
+
+        entries = {}
+        for (genre, limit, offset), songs in zip(pages, results):
+            if isinstance(songs, Exception):
+                logger.error(f"Failed to warm {genre or 'all'}, limit={limit}, offset={offset}: {songs}")
+            elif songs:
+                entries[trending_cache_key(genre, limit, offset)] = encode_response_body(songs)
+
+        if entries:
+            await page_cache.set_many_raw(
+                entries, expiration=EXPIRY_TIME + settings.CACHE_STALE_TTL, soft_expiration=EXPIRY_TIME
+            )
+        await self._decay()
+        return len(entries)
+
+    async def _decay(self) -> None:
+        async with self.cache.client.pipeline(transaction=True) as pipe:
+            pipe.zunionstore(DEMAND_KEY, {DEMAND_KEY: settings.CACHE_DEMAND_DECAY})
+            pipe.zremrangebyrank(DEMAND_KEY, 0, -self.max_pages - 1)
+            await pipe.execute()
+
+
+# Singleton instance counting requests in this process
+cache_warmer = CacheWarmer(redis_cache)
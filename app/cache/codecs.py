@@ -0,0 +1,220 @@
+"""
+Versioned cache entry format.
+
+Every entry written by RedisCache starts with a small header: a 2-byte magic, the
+format version, the codec id, the compression id and, since version 2, the soft
+expiry of the entry in epoch milliseconds (0 if none). Entries without the magic were
+written before the header existed and are read as plain JSON, so codecs and
+compression can be rolled out without flushing the cache.
+"""
+
+import gzip
+import json
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:  # Optional, only needed for the msgpack codec
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # Optional, only needed for zstd compression
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:  # Optional, only needed for lz4 compression
+    lz4 = None
+
+from app.settings.config import settings
+
+MAGIC = b"\xfeT"
+FORMAT_VERSION = 2
+HEADER_SIZES = {1: len(MAGIC) + 3, 2: len(MAGIC) + 11}
+
+# Codec ids
+CODEC_RAW = 0
+CODEC_JSON = 1
+CODEC_MSGPACK = 2
+
+# Compression ids
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+COMPRESSION_LZ4 = 3
+COMPRESSION_GZIP = 4
+
+CODECS: Dict[str, int] = {"raw": CODEC_RAW, "json": CODEC_JSON, "msgpack": CODEC_MSGPACK}
+COMPRESSIONS: Dict[str, int] = {
+    "none": COMPRESSION_NONE,
+    "zlib": COMPRESSION_ZLIB,
+    "zstd": COMPRESSION_ZSTD,
+    "lz4": COMPRESSION_LZ4,
+    "gzip": COMPRESSION_GZIP,
+}
+
+# msgpack extension type for naive UTC datetimes, stored as epoch microseconds
+_DATETIME_EXT = 1
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class CodecError(ValueError):
+    """Raised when a cache entry cannot be encoded or decoded"""
+
+
+def _msgpack_default(value: Any):
+    if isinstance(value, datetime):
+        micros = (value.replace(tzinfo=None) - _EPOCH) // _MICROSECOND
+        return msgpack.ExtType(_DATETIME_EXT, micros.to_bytes(8, "big", signed=True))
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code == _DATETIME_EXT:
+        return _EPOCH + int.from_bytes(data, "big", signed=True) * _MICROSECOND
+    return msgpack.ExtType(code, data)
+
+
+def _serialize(value: Any, codec: int) -> bytes:
+    if codec == CODEC_RAW:
+        return value
+    if codec == CODEC_JSON:
+        return json.dumps(value).encode("utf-8")
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise CodecError("msgpack codec requires the msgpack package")
+        return msgpack.packb(value, default=_msgpack_default, use_bin_type=True)
+    raise CodecError(f"Unknown codec id {codec}")
+
+
+def _deserialize(payload: bytes, codec: int) -> Any:
+    if codec == CODEC_RAW:
+        return payload
+    if codec == CODEC_JSON:
+        return json.loads(payload)
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise CodecError("msgpack codec requires the msgpack package")
+        return msgpack.unpackb(payload, ext_hook=_msgpack_ext_hook, raw=False)
+    raise CodecError(f"Unknown codec id {codec}")
+
+
+def compress(payload: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_NONE:
+        return payload
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(payload)
+    if compression == COMPRESSION_GZIP:
+        return gzip.compress(payload, compresslevel=settings.RESPONSE_COMPRESSION_LEVEL)
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise CodecError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().compress(payload)
+    if compression == COMPRESSION_LZ4:
+        if lz4 is None:
+            raise CodecError("lz4 compression requires the lz4 package")
+        return lz4.frame.compress(payload)
+    raise CodecError(f"Unknown compression id {compression}")
+
+
+def decompress(payload: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_NONE:
+        return payload
+    if compression in (COMPRESSION_ZLIB, COMPRESSION_GZIP):
+        # wbits=47 accepts both zlib and gzip streams
+        return zlib.decompress(payload, wbits=47)
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise CodecError("zstd compression requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if compression == COMPRESSION_LZ4:
+        if lz4 is None:
+            raise CodecError("lz4 compression requires the lz4 package")
+        return lz4.frame.decompress(payload)
+    raise CodecError(f"Unknown compression id {compression}")
+
+
+def encode_entry(
+        value: Any,
+        codec: str = None,
+        compression: str = None,
+        min_compress_bytes: Optional[int] = None,
+        soft_expiration: Optional[float] = None
+) -> bytes:
+    """
+    Encode a value into a versioned cache entry
+
+    Args:
+        value (Any): Value to encode, bytes for the raw codec
+        codec (str, optional): Codec name. Defaults to settings value.
+        compression (str, optional): Compression name. Defaults to settings value.
+        min_compress_bytes (int, optional): Payloads smaller than this are stored
+            uncompressed. Defaults to settings value.
+        soft_expiration (float, optional): Seconds after which the entry is stale
+
+    Returns:
+        bytes: Header followed by the (possibly compressed) payload
+    """
+    codec_id = CODECS[codec or settings.CACHE_CODEC]
+    compression_id = COMPRESSIONS[compression or settings.CACHE_COMPRESSION]
+    if min_compress_bytes is None:
+        min_compress_bytes = settings.CACHE_COMPRESSION_MIN_BYTES
+
+    payload = _serialize(value, codec_id)
+    if len(payload) < min_compress_bytes:
+        compression_id = COMPRESSION_NONE
+
+    return _header(codec_id, compression_id, soft_expiration) + compress(payload, compression_id)
+
+
+def _header(codec_id: int, compression_id: int, soft_expiration: Optional[float]) -> bytes:
+    soft_expires_at = int((time.time() + soft_expiration) * 1000) if soft_expiration is not None else 0
+    return MAGIC + bytes([FORMAT_VERSION, codec_id, compression_id]) + soft_expires_at.to_bytes(8, "big")
+
+
+def with_soft_expiration(data: bytes, soft_expiration: Optional[float]) -> bytes:
+    """
+    Return a copy of an encoded entry that goes stale after soft_expiration seconds
+    """
+    payload, codec_id, compression_id = read_entry(data)
+    return _header(codec_id, compression_id, soft_expiration) + payload
+
+
+def read_entry(data: bytes) -> Tuple[bytes, int, int]:
+    """
+    Split a cache entry into its still compressed payload, codec id and compression id.
+
+    Entries without a header are treated as uncompressed JSON.
+    """
+    if not data.startswith(MAGIC):
+        return data, CODEC_JSON, COMPRESSION_NONE
+
+    version, codec_id, compression_id = data[len(MAGIC):len(MAGIC) + 3]
+    if version not in HEADER_SIZES:
+        raise CodecError(f"Unsupported cache entry version {version}")
+    return data[HEADER_SIZES[version]:], codec_id, compression_id
+
+
+def is_stale(data: bytes, now: Optional[float] = None) -> bool:
+    """
+    Whether an entry is past its soft expiry. Entries without one never go stale.
+    """
+    if not data.startswith(MAGIC) or data[len(MAGIC)] < 2:
+        return False
+
+    offset = len(MAGIC) + 3
+    soft_expires_at = int.from_bytes(data[offset:offset + 8], "big")
+    return soft_expires_at != 0 and soft_expires_at <= (now or time.time()) * 1000
+
+
+def decode_entry(data: bytes) -> Any:
+    """
+    Decode a cache entry written by encode_entry, or a legacy JSON value
+    """
+    payload, codec_id, compression_id = read_entry(data)
+    return _deserialize(decompress(payload, compression_id), codec_id)
@@ -0,0 +1,207 @@
+import json
+import logging
+import uuid
+from datetime import datetime
+from typing import List, Optional, Set
+
+from redis.exceptions import WatchError
+
+from app.cache.redis_cache import redis_cache
+from app.constants import SCORE_MODE_DECAY_INVARIANT
+from app.models.song import Song, Genre
+from app.services.trending_algorithm import TrendingAlgorithm
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Keys share a hash tag so that the swap transaction works on a Redis cluster
+KEY_PREFIX = "{leaderboard}"
+SONGS_KEY = f"{KEY_PREFIX}:songs"
+BUILT_KEY = f"{KEY_PREFIX}:built_at"
+
+# Songs written per HSET/ZADD command while building
+WRITE_CHUNK_SIZE = 500
+
+
+def leaderboard_key(genre: Optional[Genre]) -> str:
+    return f"{KEY_PREFIX}:{genre.value if genre else 'all'}"
+
+
+class TrendingLeaderboard:
+    """
+    Trending rankings kept in Redis sorted sets, one per genre plus a global one.
+
+    Members are song ids scored by their ranking score, song payloads are stored once in
+    a hash shared by all sets. Any page within the top `size` songs is served with one
+    ZREVRANGE and one HMGET, whatever its limit and offset. Builds write new keys and
+    rename them over the live ones in one transaction, readers never see a partial build.
+    """
+
+    def __init__(self, cache=None, size: int = None):
+        self.cache = cache or redis_cache
+        self.size = size or settings.LEADERBOARD_SIZE
+
+    @staticmethod
+    def ranking_score(song: Song) -> float:
+        """
+        Score of a song in the sorted sets, ordered like the configured ranking field.
+        """
+        if settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+            return TrendingAlgorithm.calculate_decay_invariant_score(song)
+        return song.trending_score
+
+    async def build(self, db_service) -> None:
+        """
+        Rebuild every sorted set and the payload hash from the database.
+
+        Args:
+            db_service (DatabaseService): Connected database service
+        """
+        build_id = uuid.uuid4().hex[:12]
+        client = self.cache.client
+        renames = {}
+        payloads = {}
+
+        for genre in [None] + list(Genre):
+            songs = await db_service.get_top_trending_songs(self.size, 0, genre)
+            key = leaderboard_key(genre)
+            renames[f"{key}:build:{build_id}"] = key
+
+            async with client.pipeline(transaction=False) as pipe:
+                # An empty placeholder member keeps empty genres from reading as not built
+                pipe.zadd(f"{key}:build:{build_id}", {"": float("-inf")})
+                for start in range(0, len(songs), WRITE_CHUNK_SIZE):
+                    chunk = songs[start:start + WRITE_CHUNK_SIZE]
+                    pipe.zadd(f"{key}:build:{build_id}", {song.song_id: self.ranking_score(song) for song in chunk})
+                # Left behind by a build that dies before the swap, expired like the live keys
+                pipe.expire(f"{key}:build:{build_id}", settings.LEADERBOARD_TTL)
+                await pipe.execute()
+
+            for song in songs:
+                payloads[song.song_id] = song
+
+        songs_build_key = f"{SONGS_KEY}:build:{build_id}"
+        renames[songs_build_key] = SONGS_KEY
+        items = list(payloads.values())
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.hset(songs_build_key, mapping={"": b""})
+            for start in range(0, len(items), WRITE_CHUNK_SIZE):
+                pipe.hset(songs_build_key, mapping={
+                    song.song_id: song.model_dump_json() for song in items[start:start + WRITE_CHUNK_SIZE]
+                })
+            pipe.expire(songs_build_key, settings.LEADERBOARD_TTL)
+            await pipe.execute()
+
+        async with client.pipeline(transaction=True) as pipe:
+            for build_key, key in renames.items():
+                pipe.rename(build_key, key)
+                pipe.expire(key, settings.LEADERBOARD_TTL)
+            pipe.set(BUILT_KEY, datetime.utcnow().isoformat(), ex=settings.LEADERBOARD_TTL)
+            await pipe.execute()
+
+        logger.info(f"Trending leaderboard built with {len(payloads)} songs")
+
+    async def update_songs(self, songs: List[Song]) -> bool:
+        """
+        Move songs whose ranking score changed to their new position without a rebuild.
+
+        Each song is added to its genre set and the global set, which are then trimmed
+        back to `size` songs, so songs climbing into the top enter and the lowest ones
+        leave along with their payloads. A song falling below the lowest one stays last
+        until the next rebuild. Songs leaving a set otherwise (delisted, deleted, genre
+        changed) need a rebuild.
+
+        Returns:
+            Whether the leaderboard was built and has been updated
+        """
+        if not songs or not await self.is_built():
+            return False
+
+        keys = set()
+        async with self.cache.client.pipeline(transaction=True) as pipe:
+            for song in songs:
+                for key in (leaderboard_key(song.genre), leaderboard_key(None)):
+                    pipe.zadd(key, {song.song_id: self.ranking_score(song)})
+                    keys.add(key)
+                pipe.hset(SONGS_KEY, mapping={song.song_id: song.model_dump_json()})
+            for key in keys:
+                # Keep the placeholder at rank 0 and the top size songs, reading what is trimmed
+                pipe.zrange(key, 1, -self.size - 1)
+                pipe.zremrangebyrank(key, 1, -self.size - 1)
+            results = await pipe.execute()
+
+        trimmed = {member.decode() for members in results[-2 * len(keys)::2] for member in members}
+        if trimmed:
+            await self._drop_payloads(trimmed)
+        return True
+
+    async def _drop_payloads(self, song_ids: Set[str]) -> None:
+        """
+        Delete the payloads of songs trimmed from a set that no other set holds
+        """
+        song_ids = sorted(song_ids)
+        keys = [leaderboard_key(genre) for genre in [None] + list(Genre)]
+        try:
+            async with self.cache.client.pipeline(transaction=True) as pipe:
+                # A rebuild swapping the sets meanwhile aborts the deletion
+                await pipe.watch(*keys)
+                ranked = set()
+                for key in keys:
+                    scores = await pipe.zmscore(key, song_ids)
+                    ranked.update(song_id for song_id, score in zip(song_ids, scores) if score is not None)
+
+                pipe.multi()
+                orphans = [song_id for song_id in song_ids if song_id not in ranked]
+                if orphans:
+                    pipe.hdel(SONGS_KEY, *orphans)
+                await pipe.execute()
+        except WatchError:
+            # Left for the next rebuild, which replaces the payloads
+            logger.debug(f"Leaderboard changed while dropping {len(song_ids)} payloads, leaving them")
+
+    async def is_built(self) -> bool:
+        return bool(await self.cache.client.exists(BUILT_KEY))
+
+    async def get_page(self, limit: int, offset: int = 0, genre: Optional[Genre] = None) -> Optional[List[dict]]:
+        """
+        Retrieve a page of trending songs from the leaderboard.
+
+        Returns:
+            Optional list of song documents in their JSON form, None if the page is not
+            covered by the leaderboard
+        """
+        client = self.cache.client
+        key = leaderboard_key(genre)
+
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.zcard(key)
+            pipe.zrevrange(key, offset, offset + limit - 1, withscores=True)
+            members, ranked = await pipe.execute()
+
+        if not members:
+            return None
+
+        # members counts the placeholder, a set holding fewer songs than size is complete
+        if offset + limit > self.size and members - 1 >= self.size:
+            return None
+
+        ranked = [(song_id, score) for song_id, score in ranked if song_id]
+        if not ranked:
+            return []
+
+        payloads = await client.hmget(SONGS_KEY, [song_id for song_id, _ in ranked])
+        if any(payload is None for payload in payloads):
+            # Rebuilt between both reads
+            return None
+
+        # Payloads were dumped from validated songs
+        songs = [json.loads(payload) for payload in payloads]
+        if settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+            now = datetime.utcnow()
+            for song, (_, score) in zip(songs, ranked):
+                song["trending_score"] = TrendingAlgorithm.decayed_score(score, now)
+        return songs
+
+
+# Create a singleton leaderboard instance
+trending_leaderboard = TrendingLeaderboard()
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Any, Dict, List, Tuple
+
+from app.cache.codecs import with_soft_expiration
+from app.cache.redis_cache import RedisCache, redis_cache
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Invalidation message clearing every local cache entry
+INVALIDATE_ALL = "*"
+
+
+class LocalCache:
+    """
+    Process-local LRU cache with per-entry TTL and hit/miss counters
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None):
+        self.max_entries = max_entries or settings.LOCAL_CACHE_MAX_ENTRIES
+        self.ttl = ttl or settings.LOCAL_CACHE_TTL
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Tuple[bool, Optional[Any]]:
+        """
+        Retrieve a cached value
+
+        Returns:
+            Tuple of whether the key was found and its value
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Cache a value, evicting the least recently used entries above max_entries
+
+        Args:
+            key (str): Cache key
+            value (Any): Value to cache
+            ttl (float, optional): Time to live in seconds, capped by the cache TTL
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class TieredCache:
+    """
+    Process-local LRU (L1) in front of RedisCache (L2), sharing its get/set/delete/clear interface.
+
+    Local caches of all instances are kept coherent through a Redis pub/sub channel:
+    delete, clear and invalidate_local broadcast the keys to drop on every instance.
+    """
+
+    def __init__(self, backend: RedisCache, local: LocalCache = None, enabled: bool = None):
+        self.backend = backend
+        self.local = local or LocalCache()
+        self.enabled = settings.LOCAL_CACHE_ENABLED if enabled is None else enabled
+        self.channel = settings.LOCAL_CACHE_INVALIDATION_CHANNEL
+        self._listener: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        """Establish the Redis connection and start listening for invalidations"""
+        await self.backend.connect()
+        if self.enabled and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        """Stop listening for invalidations and close the Redis connection"""
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        await self.backend.close()
+
+    async def _listen(self):
+        while True:
+            pubsub = self.backend.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # Messages may have been missed while (re)subscribing
+                self.local.clear()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._apply_invalidation(message["data"].decode("utf-8"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Local cache invalidation listener failed, resubscribing: {e}")
+            finally:
+                # Gives the connection back to the blocking pool, which would run dry otherwise
+                await pubsub.reset()
+            await asyncio.sleep(1)
+
+    def _apply_invalidation(self, key: str):
+        if key == INVALIDATE_ALL:
+            self.local.clear()
+        else:
+            self.local.delete(key)
+
+    async def set(
+            self,
+            key: str,
+            value: Any,
+            expiration: Optional[int] = None,
+            soft_expiration: Optional[int] = None
+    ) -> None:
+        await self.backend.set(key, value, expiration=expiration, soft_expiration=soft_expiration)
+        if self.enabled:
+            self.local.set(key, value, expiration or settings.CACHE_EXPIRATION)
+
+    async def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return await self.backend.get(key)
+
+        found, value = self.local.get(key)
+        if found:
+            return value
+
+        value, ttl = await self.backend.get_with_ttl(key)
+        if value is not None:
+            self.local.set(key, value, ttl)
+        return value
+
+    async def set_raw(
+            self,
+            key: str,
+            value: bytes,
+            expiration: Optional[int] = None,
+            soft_expiration: Optional[int] = None
+    ) -> None:
+        if soft_expiration is not None:
+            value = with_soft_expiration(value, soft_expiration)
+        await self.backend.set_raw(key, value, expiration=expiration)
+        if self.enabled:
+            self.local.set(key, value, expiration or settings.CACHE_EXPIRATION)
+
+    async def set_many_raw(
+            self,
+            entries: Dict[str, bytes],
+            expiration: Optional[int] = None,
+            soft_expiration: Optional[int] = None
+    ) -> None:
+        if soft_expiration is not None:
+            entries = {key: with_soft_expiration(value, soft_expiration) for key, value in entries.items()}
+        await self.backend.set_many_raw(entries, expiration=expiration)
+        if self.enabled:
+            for key, value in entries.items():
+                self.local.set(key, value, expiration or settings.CACHE_EXPIRATION)
+
+    async def get_raw(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return await self.backend.get_raw(key)
+
+        found, value = self.local.get(key)
+        if found:
+            return value
+
+        value, ttl = await self.backend.get_raw_with_ttl(key)
+        if value is not None:
+            self.local.set(key, value, ttl)
+        return value
+
+    async def acquire_lock(self, name: str, timeout_ms: Optional[int] = None) -> Optional[str]:
+        return await self.backend.acquire_lock(name, timeout_ms)
+
+    async def release_lock(self, name: str, token: str) -> None:
+        await self.backend.release_lock(name, token)
+
+    async def delete(self, key: str) -> None:
+        await self.backend.delete(key)
+        await self.invalidate_local(key)
+
+    async def delete_matching(self, *patterns: str) -> List[str]:
+        keys = await self.backend.delete_matching(*patterns)
+        for key in keys:
+            await self.invalidate_local(key)
+        return keys
+
+    async def clear(self) -> None:
+        await self.backend.clear()
+        await self.invalidate_local()
+
+    async def invalidate_local(self, key: str = INVALIDATE_ALL) -> None:
+        """
+        Drop a key (or every key) from the local caches of all instances
+
+        Args:
+            key (str, optional): Cache key to drop. Defaults to every key.
+        """
+        self._apply_invalidation(key)
+        if self.enabled:
+            await self.backend.publish(self.channel, key)
+
+
+# Create a singleton tiered cache instance
+trending_cache = TieredCache(redis_cache)
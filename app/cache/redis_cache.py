@@ -1,20 +1,78 @@
+import fnmatch
 import json
+import os
+import re
+import time
+import uuid
 import redis.asyncio as redis
-from typing import Optional, Any
+from redis.asyncio.connection import BlockingConnectionPool
+from typing import Optional, Any, Dict, List, Tuple
+from app.cache.codecs import encode_entry, decode_entry, is_stale, with_soft_expiration
+from app.services.pool_metrics import PoolStats
 from app.settings.config import settings
 
 
+class MeteredConnectionPool(BlockingConnectionPool):
+    """
+    Blocking connection pool recording checkout statistics.
+
+    Bursts beyond max_connections wait up to the pool timeout for a free connection
+    instead of failing with "Too many connections".
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats(self.max_connections)
+
+    async def get_connection(self, command_name, *keys, **options):
+        started = time.monotonic()
+        self.stats.checkout_started()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except BaseException:
+            self.stats.checkout_failed()
+            raise
+        self.stats.checked_out(time.monotonic() - started)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        self.stats.checked_in()
+
+
 class RedisCache:
     """
-    Async Redis Caching Service with JSON serialization
+    Async Redis Caching Service with pluggable serialization
+
+    Values are encoded by the configured codec (JSON or msgpack) into versioned entries,
+    compressed above a size threshold, see app.cache.codecs. Responses are not decoded
+    by the client so that raw bytes, such as pre-serialized HTTP response bodies, can be
+    cached next to JSON values.
+    """
+
+    # Deletes the lock only if it still holds the caller's token
+    _RELEASE_LOCK_SCRIPT = """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("del", KEYS[1])
+    end
+    return 0
     """
 
     def __init__(self):
-        self._redis = redis.from_url(
+        self._pool = MeteredConnectionPool.from_url(
             settings.REDIS_URL,
-            encoding="utf-8",
-            decode_responses=True
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            decode_responses=False
         )
+        self._redis = redis.Redis(connection_pool=self._pool)
+
+    @property
+    def client(self) -> redis.Redis:
+        """Underlying Redis client, for data structures other than cache entries"""
+        return self._redis
 
     async def connect(self):
         """Establish Redis connection"""
@@ -23,27 +81,37 @@ class RedisCache:
     async def close(self):
         """Close Redis connection"""
         await self._redis.close()
+        # A pool passed to the client is not closed by it
+        await self._pool.disconnect()
+
+    @property
+    def pool_stats(self) -> PoolStats:
+        """Checkout statistics of the connection pool"""
+        return self._pool.stats
 
     async def set(
             self,
             key: str,
             value: Any,
-            expiration: Optional[int] = None
+            expiration: Optional[int] = None,
+            soft_expiration: Optional[int] = None
     ) -> None:
         """
         Cache a value with optional expiration
 
         Args:
             key (str): Cache key
-            value (Any): Value to cache (will be JSON serialized)
-            expiration (int, optional): Expiration in seconds. Defaults to settings value.
+            value (Any): Value to cache (will be serialized by the configured codec)
+            expiration (int, optional): Hard expiration in seconds. Defaults to settings value.
+            soft_expiration (int, optional): Seconds after which the value is reported stale
+                while still being served until the hard expiration
         """
         # Use default expiration if not provided
         if expiration is None:
             expiration = settings.CACHE_EXPIRATION
 
-        # Serialize complex objects to JSON
-        serialized_value = json.dumps(value)
+        # Serialize complex objects with the configured codec
+        serialized_value = encode_entry(value, soft_expiration=soft_expiration)
 
         await self._redis.setex(key, expiration, serialized_value)
 
@@ -60,13 +128,163 @@ class RedisCache:
         cached_value = await self._redis.get(key)
 
         if cached_value:
-            try:
-                return json.loads(cached_value)
-            except json.JSONDecodeError:
-                return cached_value
+            return self._deserialize(cached_value)
 
         return None
 
+    async def get_with_staleness(self, key: str) -> Tuple[Optional[Any], bool]:
+        """
+        Retrieve a cached value and whether it is past its soft expiration
+
+        Args:
+            key (str): Cache key to retrieve
+
+        Returns:
+            Tuple of the optional deserialized value and its staleness
+        """
+        cached_value = await self._redis.get(key)
+
+        if not cached_value:
+            return None, False
+
+        return self._deserialize(cached_value), is_stale(cached_value)
+
+    @staticmethod
+    def _deserialize(cached_value: bytes) -> Any:
+        try:
+            return decode_entry(cached_value)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            # Legacy value that was never JSON encoded
+            return cached_value.decode("utf-8", errors="replace")
+
+    async def set_raw(
+            self,
+            key: str,
+            value: bytes,
+            expiration: Optional[int] = None,
+            soft_expiration: Optional[int] = None
+    ) -> None:
+        """
+        Cache raw bytes as-is with optional expiration
+
+        Args:
+            key (str): Cache key
+            value (bytes): Bytes to cache
+            expiration (int, optional): Hard expiration in seconds. Defaults to settings value.
+            soft_expiration (int, optional): Seconds after which the value is reported stale,
+                value must then be an entry encoded by app.cache.codecs
+        """
+        if expiration is None:
+            expiration = settings.CACHE_EXPIRATION
+
+        if soft_expiration is not None:
+            value = with_soft_expiration(value, soft_expiration)
+
+        await self._redis.setex(key, expiration, value)
+
+    async def set_many_raw(
+            self,
+            entries: Dict[str, bytes],
+            expiration: Optional[int] = None,
+            soft_expiration: Optional[int] = None
+    ) -> None:
+        """
+        Cache several raw values in one MULTI transaction, see set_raw
+
+        Args:
+            entries (Dict[str, bytes]): Bytes to cache by key
+            expiration (int, optional): Hard expiration in seconds. Defaults to settings value.
+            soft_expiration (int, optional): Seconds after which the values are reported stale
+        """
+        if expiration is None:
+            expiration = settings.CACHE_EXPIRATION
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for key, value in entries.items():
+                if soft_expiration is not None:
+                    value = with_soft_expiration(value, soft_expiration)
+                pipe.setex(key, expiration, value)
+            await pipe.execute()
+
+    async def get_raw(self, key: str) -> Optional[bytes]:
+        """
+        Retrieve cached raw bytes without deserialization
+
+        Args:
+            key (str): Cache key to retrieve
+
+        Returns:
+            Optional cached bytes
+        """
+        return await self._redis.get(key)
+
+    async def get_raw_with_ttl(self, key: str) -> Tuple[Optional[bytes], Optional[float]]:
+        """
+        Retrieve cached raw bytes together with their remaining time to live in seconds
+        """
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.pttl(key)
+            cached_value, ttl_ms = await pipe.execute()
+
+        if cached_value is None:
+            return None, None
+
+        return cached_value, (ttl_ms / 1000 if ttl_ms >= 0 else None)
+
+    async def get_with_ttl(self, key: str) -> Tuple[Optional[Any], Optional[float]]:
+        """
+        Retrieve a cached value together with its remaining time to live
+
+        Args:
+            key (str): Cache key to retrieve
+
+        Returns:
+            Tuple of the optional deserialized value and its remaining TTL in seconds
+            (None if the key has no expiry)
+        """
+        cached_value, ttl = await self.get_raw_with_ttl(key)
+
+        if not cached_value:
+            return None, None
+
+        return self._deserialize(cached_value), ttl
+
+    async def acquire_lock(self, name: str, timeout_ms: Optional[int] = None) -> Optional[str]:
+        """
+        Try to acquire a distributed lock
+
+        Args:
+            name (str): Lock name
+            timeout_ms (int, optional): Lock expiry in milliseconds. Defaults to settings value.
+
+        Returns:
+            Optional token identifying the owner, None if the lock is held elsewhere
+        """
+        token = uuid.uuid4().hex
+        acquired = await self._redis.set(
+            f"lock:{name}", token, nx=True, px=timeout_ms or settings.CACHE_LOCK_TIMEOUT_MS
+        )
+        return token if acquired else None
+
+    async def release_lock(self, name: str, token: str) -> None:
+        """
+        Release a distributed lock if it is still owned by token
+        """
+        await self._redis.eval(self._RELEASE_LOCK_SCRIPT, 1, f"lock:{name}", token)
+
+    async def publish(self, channel: str, message: str) -> None:
+        """
+        Publish a message on a Redis pub/sub channel
+        """
+        await self._redis.publish(channel, message)
+
+    def pubsub(self):
+        """
+        Create a Redis pub/sub object on the cache connection pool
+        """
+        return self._redis.pubsub()
+
     async def delete(self, key: str) -> None:
         """
         Delete a specific cache key
@@ -76,6 +294,29 @@ class RedisCache:
         """
         await self._redis.delete(key)
 
+    async def delete_matching(self, *patterns: str) -> List[str]:
+        """
+        Delete the keys matching any of the glob-style patterns, scanning the keyspace
+        incrementally and only once
+
+        Args:
+            patterns (str): Patterns of the keys to delete
+        Returns:
+            The deleted keys
+        """
+        if len(patterns) == 1:
+            keys = [key.decode() async for key in self._redis.scan_iter(match=patterns[0], count=1000)]
+        else:
+            # Scan the prefix shared by the patterns up to their first wildcard, then match each key
+            prefix = os.path.commonprefix([re.split(r"[*?\[\\]", pattern, maxsplit=1)[0] for pattern in patterns])
+            keys = [
+                key.decode() async for key in self._redis.scan_iter(match=f"{prefix}*", count=1000)
+                if any(fnmatch.fnmatchcase(key.decode(), pattern) for pattern in patterns)
+            ]
+        for start in range(0, len(keys), 1000):
+            await self._redis.unlink(*keys[start:start + 1000])
+        return keys
+
     async def clear(self) -> None:
         """
         Clear entire Redis cache
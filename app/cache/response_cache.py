@@ -0,0 +1,135 @@
+import json
+from datetime import datetime
+from typing import List, Optional, Union
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+try:
+    import orjson
+except ImportError:  # Optional, speeds up serializing song documents
+    orjson = None
+
+from app.cache.codecs import COMPRESSION_GZIP, COMPRESSION_NONE, decompress, encode_entry, read_entry
+from app.models.song import Song, Genre
+from app.settings.config import settings
+
+# Serializes song lists exactly like FastAPI does for response_model=List[Song]
+SONG_LIST_ADAPTER = TypeAdapter(List[Song])
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Pages used to be cached as JSON encoded twice under trending_songs:<genre>:<limit>:<offset>,
+# a new prefix keeps those entries from being served as response bodies until they expire
+KEY_PREFIX = "trending_pages"
+
+
+def trending_cache_key(genre: Optional[Genre], limit: int, offset: int, region: Optional[str] = None) -> str:
+    """
+    Cache key of a cached trending songs page, pages of a region end with the region.
+    """
+    key = f"{KEY_PREFIX}:{genre.value if genre else 'all'}:{limit}:{offset}"
+    return f"{key}:{region}" if region else key
+
+
+def trending_cache_pattern(genre: Optional[Genre]) -> str:
+    """
+    Pattern matching the cache keys of every cached page of a genre ("all" for no genre),
+    in every region.
+    """
+    return f"{KEY_PREFIX}:{genre.value if genre else 'all'}:*"
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def dump_songs(songs: Union[List[Song], List[dict]]) -> bytes:
+    """
+    Serialize songs into a JSON array, Song models or song documents holding
+    exactly the Song fields (see DatabaseService.get_top_trending_documents).
+
+    Documents are trusted and dumped as-is with orjson when installed.
+    """
+    if not songs or not isinstance(songs[0], dict):
+        return SONG_LIST_ADAPTER.dump_json(songs)
+    if orjson is not None:
+        return orjson.dumps(songs)
+    return json.dumps(songs, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+
+def songs_response(songs: Union[List[Song], List[dict]]) -> Response:
+    """
+    Build an uncompressed JSON response of songs, bypassing response_model validation.
+    """
+    return Response(content=dump_songs(songs), media_type="application/json")
+
+
+def encode_response_body(songs: Union[List[Song], List[dict]]) -> bytes:
+    """
+    Serialize songs into the final HTTP response body, stored as a raw cache entry
+    that is gzip compressed above RESPONSE_COMPRESSION_MIN_BYTES.
+
+    Args:
+        songs (list): Song models or song documents to serialize, see dump_songs
+
+    Returns:
+        bytes: Cache entry holding the JSON response body
+    """
+    return encode_entry(
+        dump_songs(songs),
+        codec="raw",
+        compression="gzip",
+        min_compress_bytes=settings.RESPONSE_COMPRESSION_MIN_BYTES
+    )
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Whether an Accept-Encoding header accepts gzip, with a non-zero q-value for gzip or
+    else for "*"
+    """
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, *params = [part.strip() for part in coding.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name.lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def build_response(entry: bytes, accept_encoding: str = "", cache_status: Optional[str] = None) -> Response:
+    """
+    Build a raw JSON response from a cached response body without any validation.
+
+    Compressed bodies are sent as-is to clients accepting gzip and decompressed otherwise,
+    every response varies on Accept-Encoding for shared caches.
+
+    Args:
+        entry (bytes): Cache entry produced by encode_response_body
+        accept_encoding (str): Accept-Encoding header of the request
+        cache_status (str, optional): Reported in the X-Cache header (HIT, STALE or MISS)
+    """
+    body, _, compression = read_entry(entry)
+    if compression == COMPRESSION_NONE and body.startswith(GZIP_MAGIC):
+        # Written before cache entries carried a header
+        compression = COMPRESSION_GZIP
+
+    # The body depends on Accept-Encoding whether or not this one is compressed
+    headers = {"Vary": "Accept-Encoding"}
+    if cache_status:
+        headers["X-Cache"] = cache_status
+    if compression == COMPRESSION_GZIP and accepts_gzip(accept_encoding):
+        headers["Content-Encoding"] = "gzip"
+    else:
+        body = decompress(body, compression)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,37 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into a single in-flight call per process
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run fn for key unless a call for key is already in flight, in which case
+        wait for and share its result (or exception).
+
+        Args:
+            key (str): Key identifying identical calls
+            fn (Callable): Coroutine function performing the call
+
+        Returns:
+            Result of the shared call
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # A cancelled caller must not cancel the call other callers are waiting for
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
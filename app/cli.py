@@ -0,0 +1,97 @@
+"""
+Command line tools, run with `python -m app.cli <command>`.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import asdict
+
+from app.services.data_generator import DataGenerator
+from app.services.database import db_service, index_drift, song_indexes
+from app.services.trending_job import TrendingRecomputeJob
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+async def generate(args: argparse.Namespace) -> None:
+    """
+    Generate a synthetic dataset, optionally scoring it afterwards.
+    """
+    await db_service.connect()
+    try:
+        if args.drop:
+            await db_service.songs_collection.drop()
+        await db_service.ensure_indexes()
+
+        started = time.monotonic()
+        inserted = await DataGenerator.generate_dataset(
+            db_service, args.songs, seed=args.seed, chunk_size=args.chunk_size, workers=args.workers
+        )
+        logger.info(f"Inserted {inserted} songs in {time.monotonic() - started:.1f}s")
+
+        if args.score:
+            started = time.monotonic()
+            await TrendingRecomputeJob(db_service).run()
+            logger.info(f"Scored {inserted} songs in {time.monotonic() - started:.1f}s")
+    finally:
+        await db_service.close()
+
+
+async def indexes(args: argparse.Namespace) -> int:
+    """
+    Create the declared indexes of the songs collection and report the remaining drift.
+
+    Returns:
+        Exit status 1 if the indexes differ from their declaration
+    """
+    await db_service.connect()
+    try:
+        if args.check:
+            drift = await index_drift(db_service.songs_collection, song_indexes())
+        else:
+            drift = await db_service.ensure_indexes(prune=args.prune)
+    finally:
+        await db_service.close()
+
+    print(json.dumps(asdict(drift), indent=2))
+    return 0 if drift.in_sync else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=settings.APP_NAME)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser("generate", help="Generate a synthetic dataset for load tests")
+    generate_parser.add_argument("--songs", type=int, default=100000, help="Number of songs")
+    generate_parser.add_argument("--seed", type=int, default=None, help="Seed for a reproducible dataset")
+    generate_parser.add_argument("--chunk-size", type=int, default=10000, help="Songs per insert_many")
+    generate_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Generating processes")
+    generate_parser.add_argument("--drop", action="store_true", help="Drop the songs collection first")
+    generate_parser.add_argument("--score", action="store_true", help="Compute trending scores afterwards")
+    generate_parser.set_defaults(handler=generate)
+
+    indexes_parser = commands.add_parser("indexes", help="Create the declared indexes and report drift")
+    indexes_mode = indexes_parser.add_mutually_exclusive_group()
+    indexes_mode.add_argument("--check", action="store_true", help="Only report drift, exit 1 if there is any")
+    indexes_mode.add_argument("--prune", action="store_true", help="Rebuild changed and drop undeclared indexes")
+    indexes_parser.set_defaults(handler=indexes)
+
+    return parser
+
+
+def main(argv=None) -> None:
+    logging.basicConfig(
+        level=getattr(logging, settings.LOG_LEVEL.upper()),
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    args = build_parser().parse_args(argv)
+    raise SystemExit(asyncio.run(args.handler(args)))
+
+
+if __name__ == "__main__":
+    main()
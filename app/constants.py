@@ -1 +1,10 @@
+from datetime import datetime
+
 EXPIRY_TIME = 3600  # 1 hour
+
+# Trending score modes
+SCORE_MODE_CLASSIC = "classic"
+SCORE_MODE_DECAY_INVARIANT = "decay_invariant"
+
+# Fixed epoch decay-invariant trending scores are anchored to
+TRENDING_EPOCH = datetime(2025, 1, 1)
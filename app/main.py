@@ -6,8 +6,11 @@ from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from contextlib import asynccontextmanager
 
 from app.settings.config import settings
-from app.services.database import db_service, create_indexes
-from app.cache.redis_cache import redis_cache
+from app.services.database import db_service
+from app.cache.leaderboard import trending_leaderboard
+from app.cache.local_cache import trending_cache
+from app.services.trending_index import trending_index
+from app.services.ingestion import get_event_sink
 from app.api.endpoints import router as api_router
 from app.tasks import trending_scheduler
 
@@ -26,20 +29,37 @@ async def lifespan(app: FastAPI):
 
         # Connect to database and cache
         await db_service.connect()
-        await create_indexes(db_service)
-        await redis_cache.connect()
+        await db_service.ensure_indexes()
+        await trending_cache.connect()
+
+        # Serve trending pages from memory from the first request on
+        if settings.TRENDING_INDEX_ENABLED:
+            await trending_index.build(db_service)
+
+        # Another instance may already have built the shared leaderboard
+        if settings.LEADERBOARD_ENABLED and not await trending_leaderboard.is_built():
+            await trending_leaderboard.build(db_service)
 
         # Start the trending songs scheduler
         await trending_scheduler.start()
 
+        # Aggregate ingested song events and flush them periodically
+        await get_event_sink().start()
+
         yield  # Allows FastAPI to run
 
     finally:
         logger.info("🛑 Shutting down application...")
 
+        # Let another instance take over the scheduled jobs right away
+        await trending_scheduler.stop()
+
+        # Write the events still pending before the database goes away
+        await get_event_sink().stop()
+
         # Close connections gracefully
         await db_service.close()
-        await redis_cache.close()
+        await trending_cache.close()
 
 
 # Initialize FastAPI with lifespan
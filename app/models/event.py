@@ -0,0 +1,30 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import datetime
+from enum import Enum
+
+
+class EventType(str, Enum):
+    PLAY = "play"
+    SHARE = "share"
+    RATING = "rating"
+
+
+class SongEvent(BaseModel):
+    song_id: str
+    type: EventType = EventType.PLAY
+    count: int = Field(default=1, ge=1, le=1_000_000)
+    # Country of the listener, used as a geographic_popularity key
+    country: Optional[str] = Field(default=None, pattern=r"^[A-Za-z]{1,16}$")
+    rating: Optional[float] = Field(default=None, ge=0.0, le=5.0)
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "song_id": "5f0c6a52-3c4e-4a4e-9a53-1f0b7e0c2f61",
+                "type": "play",
+                "count": 1,
+                "country": "IN"
+            }
+        }
@@ -0,0 +1,190 @@
+import logging
+import time
+from typing import Callable, List, Optional, Set
+
+from pydantic import ValidationError
+from pymongo.errors import OperationFailure
+
+from app.cache.leaderboard import trending_leaderboard
+from app.cache.local_cache import trending_cache
+from app.cache.response_cache import trending_cache_pattern
+from app.models.song import Genre, Song
+from app.services.database import SONG_FIELDS, db_service
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Name the resume token of the consumer is stored under
+STREAM_NAME = "songs"
+
+# ChangeStreamFatalError and ChangeStreamHistoryLost, the stored token can't be resumed from
+UNRESUMABLE_ERROR_CODES = {280, 286}
+
+
+class SongChangeConsumer:
+    """
+    Keeps the leaderboard and the cached trending pages in step with the songs collection.
+
+    Consumes a change stream of the song changes that can move a song in the rankings
+    between two trending updates: a genre change, delisting, inserts, replaces and
+    deletes. Counter updates are left out, rankings only change once songs are rescored.
+    So are the score updates of the trending job, run_trending_update rebuilds the
+    leaderboard and refreshes the cache after it. Changes are debounced, every change
+    arriving within debounce_seconds of the first one is applied together:
+
+    - New and replaced songs are moved into the leaderboard sorted sets. Changes that
+      remove songs from a ranking (deletes, delisting, genre changes) rebuild the
+      leaderboard instead.
+    - Cached pages of the affected genres and of the overall ranking are deleted, the
+      next request repopulates them.
+
+    Batches of at least a leaderboard worth of songs, such as bulk imports, are not
+    applied one by one: everything is rebuilt once the stream goes idle.
+
+    The resume token is stored after every batch, a restarted consumer continues where
+    it stopped. If the token is no longer in the oplog, everything is rebuilt once.
+    """
+
+    def __init__(self, db_service, leaderboard, cache, debounce_seconds: float = None, max_batch: int = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.db_service = db_service
+        self.leaderboard = leaderboard
+        self.cache = cache
+        self.debounce_seconds = debounce_seconds or settings.CHANGE_STREAM_DEBOUNCE_SECONDS
+        self.max_batch = max_batch or settings.CHANGE_STREAM_MAX_BATCH
+        self.clock = clock
+        self.applied = 0
+        self.rebuild_pending = False
+
+    @staticmethod
+    def pipeline() -> List[dict]:
+        """
+        Change stream pipeline selecting the changes that can move songs in the rankings,
+        other than rescoring
+        """
+        watched = {"genre", "is_active"}
+        return [
+            {"$match": {"$or": [
+                {"operationType": {"$in": ["insert", "replace", "delete"]}},
+                *({f"updateDescription.updatedFields.{field}": {"$exists": True}} for field in sorted(watched)),
+            ]}},
+            # Only what is cached is looked up, not the whole song document
+            {"$project": {
+                "operationType": 1,
+                "documentKey": 1,
+                "updateDescription.updatedFields.genre": 1,
+                **{f"fullDocument.{field}": 1 for field in SONG_FIELDS},
+            }},
+        ]
+
+    async def run(self, fencing_token: Optional[int] = None) -> None:
+        """
+        Consume changes until cancelled
+
+        Args:
+            fencing_token (int, optional): Token of the scheduler leader running the consumer
+        """
+        if fencing_token is not None:
+            logger.info(f"Starting song change consumer with fencing token {fencing_token}")
+        resume_token = await self.db_service.get_resume_token(STREAM_NAME)
+
+        while True:
+            try:
+                async with self.db_service.songs_collection.watch(
+                        self.pipeline(),
+                        full_document="updateLookup",
+                        resume_after=resume_token,
+                        max_await_time_ms=int(self.debounce_seconds * 1000)
+                ) as stream:
+                    logger.info(f"Consuming song changes {'from the stored token' if resume_token else 'from now'}")
+                    while True:
+                        changes = await self._next_batch(stream)
+                        if changes:
+                            await self.apply(changes)
+                        elif self.rebuild_pending:
+                            await self._refresh(set(Genre), rebuild=True)
+
+                        # Replayed by a restarted consumer until the pending rebuild is done
+                        if self.rebuild_pending:
+                            continue
+                        if stream.resume_token is not None and stream.resume_token != resume_token:
+                            resume_token = stream.resume_token
+                            await self.db_service.save_resume_token(STREAM_NAME, resume_token)
+            except OperationFailure as e:
+                if e.code not in UNRESUMABLE_ERROR_CODES or resume_token is None:
+                    raise
+                logger.warning(f"Song changes can't be resumed from the stored token, rebuilding: {e}")
+                resume_token = None
+                await self.db_service.save_resume_token(STREAM_NAME, None)
+                # Changes were missed, whatever they affected is rebuilt
+                await self._refresh(set(Genre), rebuild=True)
+
+    async def _next_batch(self, stream) -> List[dict]:
+        """
+        Collect the changes arriving within debounce_seconds of the first one
+        """
+        changes = []
+        deadline = None
+        while len(changes) < self.max_batch:
+            change = await stream.try_next()
+            if change is not None:
+                changes.append(change)
+                if deadline is None:
+                    deadline = self.clock() + self.debounce_seconds
+            elif deadline is None:
+                # Nothing changed during max_await_time_ms
+                break
+            if deadline is not None and self.clock() >= deadline:
+                break
+        return changes
+
+    async def apply(self, changes: List[dict]) -> None:
+        """
+        Apply a batch of song changes to the leaderboard and the cached pages
+        """
+        songs = {}
+        rebuild = False
+        for change in changes:
+            document = change.get("fullDocument")
+            if change["operationType"] == "delete" or document is None:
+                # Deleted since, only its _id is known
+                rebuild = True
+                continue
+            if "genre" in change.get("updateDescription", {}).get("updatedFields", {}):
+                rebuild = True
+
+            try:
+                song = Song.model_validate({field: document[field] for field in SONG_FIELDS if field in document})
+            except ValidationError as e:
+                logger.warning(f"Ignoring change of invalid song {change['documentKey']}: {e}")
+                continue
+            if not song.is_active:
+                rebuild = True
+            songs[song.song_id] = song
+
+        self.applied += len(changes)
+        if self.rebuild_pending or len(songs) >= self.leaderboard.size:
+            # A bulk import, moving songs one by one would cost more than the rebuild
+            self.rebuild_pending = True
+            logger.debug(f"Deferred {len(changes)} song changes to the next rebuild")
+            return
+
+        genres = set(Genre) if rebuild else {song.genre for song in songs.values()}
+        await self._refresh(genres, rebuild, list(songs.values()))
+        logger.debug(f"Applied {len(changes)} song changes to {len(genres)} genres")
+
+    async def _refresh(self, genres: Set[Genre], rebuild: bool, songs: Optional[List[Song]] = None) -> None:
+        if settings.LEADERBOARD_ENABLED:
+            if rebuild:
+                await self.leaderboard.build(self.db_service)
+            else:
+                await self.leaderboard.update_songs(songs)
+        if rebuild:
+            self.rebuild_pending = False
+
+        # One scan of the keyspace for every affected ranking
+        await self.cache.delete_matching(*(trending_cache_pattern(genre) for genre in [None, *genres]))
+
+
+# Singleton instance, run by the scheduler leader
+song_change_consumer = SongChangeConsumer(db_service, trending_leaderboard, trending_cache)
@@ -1,11 +1,51 @@
+import asyncio
+import logging
+import multiprocessing
 import random
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import List
+from typing import Iterator, List, Optional
+
+import numpy as np
 
 from app.models.song import Song, Genre
 from fastapi import Query
 
+logger = logging.getLogger(__name__)
+
+# Share of songs per genre
+GENRE_WEIGHTS = {
+    Genre.POP: 0.32, Genre.HIP_HOP: 0.24, Genre.ROCK: 0.16,
+    Genre.ELECTRONIC: 0.14, Genre.JAZZ: 0.07, Genre.CLASSICAL: 0.07,
+}
+
+# Share of plays per region, each song deviates from it
+REGION_WEIGHTS = {
+    "US": 0.30, "IN": 0.20, "UK": 0.08, "BR": 0.08, "DE": 0.06,
+    "MX": 0.05, "JP": 0.05, "FR": 0.04, "Others": 0.14,
+}
+
+# Play counts follow max_plays / rank^ZIPF_EXPONENT over the catalogue
+ZIPF_EXPONENT = 1.0
+MAX_PLAY_COUNT = 500_000_000
+
+# Artists per song in the catalogue, and the skew of songs per artist
+ARTISTS_PER_SONG = 0.2
+ARTIST_ZIPF_EXPONENT = 0.9
+
+MAX_DAYS_SINCE_PLAYED = 30
+
+
+def _bounded_zipf(rng: np.random.Generator, n: int, exponent: float, size: int) -> np.ndarray:
+    """
+    Sample ranks 1..n with probability proportional to rank^-exponent (exponent != 1),
+    by inverting the CDF of the continuous approximation.
+    """
+    power = 1 - exponent
+    ranks = ((n ** power - 1) * rng.random(size) + 1) ** (1 / power)
+    return np.clip(ranks.astype(np.int64), 1, n)
+
 
 class DataGenerator:
 
@@ -45,6 +85,154 @@ class DataGenerator:
 
         return songs
 
+    @staticmethod
+    def generate_song_chunk(
+            chunk_index: int,
+            chunk_size: int,
+            num_songs: int,
+            seed: int,
+            current_time: datetime
+    ) -> List[dict]:
+        """
+        Generate one chunk of song documents ready for insert_many.
+
+        Every chunk draws from its own generator seeded by (seed, chunk_index), so a
+        dataset is identical whichever process generates which chunk.
+
+        Args:
+            chunk_index (int): Position of the chunk in the dataset
+            chunk_size (int): Songs per chunk, the last chunk may be shorter
+            num_songs (int): Size of the whole dataset, sets the popularity ranks and artist catalogue
+            seed (int): Seed of the dataset
+            current_time (datetime): Reference time of last_played_timestamp
+
+        Returns:
+            list: Song documents
+        """
+        start = chunk_index * chunk_size
+        size = max(min(chunk_size, num_songs - start), 0)
+        rng = np.random.default_rng([seed, chunk_index])
+
+        # Zipfian popularity: a song of popularity rank r gets max_plays / r^s plays
+        ranks = rng.integers(1, num_songs + 1, size)
+        play_counts = np.maximum(MAX_PLAY_COUNT / ranks ** ZIPF_EXPONENT * rng.lognormal(0, 0.25, size), 1)
+        play_counts = play_counts.astype(np.int64)
+        shares = (play_counts * rng.lognormal(np.log(0.01), 0.8, size)).astype(np.int64)
+        ratings = np.round(1 + 4 * rng.beta(5, 2, size), 1)
+
+        # Long tail of artists, a few have many songs and most have one or two
+        artist_count = max(int(num_songs * ARTISTS_PER_SONG), 1)
+        artists = _bounded_zipf(rng, artist_count, ARTIST_ZIPF_EXPONENT, size)
+        albums = rng.integers(1, 6, size)
+
+        genres = list(GENRE_WEIGHTS)
+        genre_indexes = rng.choice(len(genres), size, p=list(GENRE_WEIGHTS.values()))
+
+        # Plays split over regions around the skewed global shares
+        regions = list(REGION_WEIGHTS)
+        region_shares = rng.dirichlet(np.array(list(REGION_WEIGHTS.values())) * 20, size)
+        region_plays = np.round(region_shares * play_counts[:, None]).astype(np.int64)
+
+        # Most songs were played recently
+        minutes_since_played = np.minimum(
+            rng.exponential(3 * 24 * 60, size), MAX_DAYS_SINCE_PLAYED * 24 * 60
+        ).astype(np.int64)
+        id_bytes = rng.bytes(16 * size)
+
+        return [
+            {
+                "song_id": str(uuid.UUID(bytes=id_bytes[16 * i:16 * i + 16], version=4)),
+                "title": f"Song {start + i}",
+                "artist": f"Artist {artists[i]}",
+                "album": f"Album {artists[i]}-{albums[i]}",
+                "genre": genres[genre_indexes[i]].value,
+                "play_count": int(play_counts[i]),
+                "user_rating": float(ratings[i]),
+                "social_media_shares": int(shares[i]),
+                "geographic_popularity": dict(zip(regions, region_plays[i].tolist())),
+                "last_played_timestamp": current_time - timedelta(minutes=int(minutes_since_played[i])),
+                "trending_score": 0.0,
+                "is_active": True,
+            }
+            for i in range(size)
+        ]
+
+    @staticmethod
+    def generate_song_documents(
+            num_songs: int,
+            seed: Optional[int] = None,
+            chunk_size: int = 10000,
+            current_time: datetime = None
+    ) -> Iterator[List[dict]]:
+        """
+        Stream a reproducible synthetic dataset as chunks of song documents, see
+        generate_song_chunk. Memory use is bounded by the chunk size.
+        """
+        seed = random.randrange(2 ** 32) if seed is None else seed
+        current_time = current_time or datetime.utcnow()
+        for chunk_index in range(-(-num_songs // chunk_size)):
+            yield DataGenerator.generate_song_chunk(chunk_index, chunk_size, num_songs, seed, current_time)
+
+    @staticmethod
+    async def generate_dataset(
+            db_service,
+            num_songs: int,
+            seed: Optional[int] = None,
+            chunk_size: int = 10000,
+            workers: int = 0,
+            current_time: datetime = None
+    ) -> int:
+        """
+        Generate a synthetic dataset into the songs collection.
+
+        Chunks are generated by a pool of worker processes (in the event loop when
+        workers is 0) and inserted as they come, at most two chunks per worker are
+        held in memory.
+
+        Args:
+            db_service (DatabaseService): Connected database service
+            num_songs (int): Number of songs to generate
+            seed (int, optional): Seed of the dataset, random if not given
+            chunk_size (int): Songs per insert_many
+            workers (int): Generating processes
+            current_time (datetime, optional): Reference time of last_played_timestamp
+
+        Returns:
+            int: Number of songs inserted
+        """
+        seed = random.randrange(2 ** 32) if seed is None else seed
+        current_time = current_time or datetime.utcnow()
+        chunks = -(-num_songs // chunk_size)
+        logger.info(f"Generating {num_songs} songs in {chunks} chunks with seed {seed}")
+
+        if workers <= 0:
+            inserted = 0
+            for chunk in DataGenerator.generate_song_documents(num_songs, seed, chunk_size, current_time):
+                inserted += await db_service.insert_song_documents(chunk)
+            return inserted
+
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(workers * 2)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+        async def generate_and_insert(chunk_index: int) -> int:
+            try:
+                chunk = await loop.run_in_executor(
+                    pool, DataGenerator.generate_song_chunk, chunk_index, chunk_size, num_songs, seed, current_time
+                )
+                return await db_service.insert_song_documents(chunk)
+            finally:
+                slots.release()
+
+        try:
+            tasks = []
+            for chunk_index in range(chunks):
+                await slots.acquire()
+                tasks.append(asyncio.create_task(generate_and_insert(chunk_index)))
+            return sum(await asyncio.gather(*tasks))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
     @staticmethod
     def simulate_streaming_data(songs: List[Song]) -> List[Song]:
         """
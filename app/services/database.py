@@ -1,15 +1,332 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import DESCENDING, UpdateOne
-from typing import List, Optional
+from pymongo import DESCENDING, IndexModel, UpdateOne
+from pymongo.read_preferences import read_pref_mode_from_name, make_read_preference
+from pymongo.errors import (
+    AutoReconnect, BulkWriteError, DuplicateKeyError, ExecutionTimeout, NetworkTimeout, OperationFailure
+)
+from bson import BSON, SON, Timestamp
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+from datetime import datetime
+import asyncio
 import logging
+import time
 
 from app.settings.config import settings
 from app.models.song import Song, Genre
+from app.services.pool_metrics import MongoPoolListener, PoolStats
+from app.services.trending_algorithm import TrendingAlgorithm
+from app.constants import SCORE_MODE_DECAY_INVARIANT
 from fastapi import FastAPI
 
 app = FastAPI()
 logger = logging.getLogger(__name__)
 
+# Fields of the Song response model, what trending reads fetch
+SONG_FIELDS = tuple(Song.model_fields)
+
+# Filter of the songs that are ranked, delisted songs are neither served nor rescored.
+# Queries must contain it as is to use the partial indexes limited to active songs.
+ACTIVE_SONGS = {"is_active": True}
+
+
+def ranked_songs(region: Optional[str] = None) -> dict:
+    """
+    Filter of the songs ranked overall, or within a region: the active songs holding a
+    score for the region. Queries must contain it as is to use the partial indexes.
+    """
+    if region is None:
+        return dict(ACTIVE_SONGS)
+    return {**ACTIVE_SONGS, TrendingAlgorithm.ranking_field(region): {"$exists": True}}
+
+
+class BulkWriterError(Exception):
+    """ Raised when bulk write operations still fail after all retries. """
+
+    def __init__(self, message: str, failed_operations: list):
+        super().__init__(message)
+        self.failed_operations = failed_operations
+
+
+class BulkWriter:
+    """
+    Unordered, pipelined bulk writer with adaptive batch sizing.
+
+    Several batches are kept in flight at once, adding operations waits while
+    max_in_flight batches are pending. The batch size shrinks when a batch takes longer
+    than target_latency and grows otherwise, and is capped so a batch stays within
+    max_batch_bytes. Operations failing with transient errors are retried with backoff;
+    whole batches interrupted by network errors are only resent when idempotent is set,
+    which non-idempotent operations such as $inc must turn off.
+    """
+
+    # Write error codes worth retrying: network, primary step-down, write conflicts and timeouts
+    RETRYABLE_ERROR_CODES = {6, 7, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+    def __init__(
+            self,
+            collection,
+            max_in_flight: int = None,
+            batch_size: int = None,
+            min_batch_size: int = None,
+            max_batch_size: int = None,
+            target_latency: float = None,
+            max_batch_bytes: int = None,
+            max_retries: int = None,
+            idempotent: bool = True,
+            on_written: Optional[Callable[[int], None]] = None
+    ):
+        self.collection = collection
+        self.max_in_flight = max_in_flight or settings.BULK_WRITE_MAX_IN_FLIGHT
+        self.batch_size = batch_size or settings.BULK_WRITE_BATCH_SIZE
+        self.min_batch_size = min_batch_size or settings.BULK_WRITE_MIN_BATCH_SIZE
+        self.max_batch_size = max_batch_size or settings.BULK_WRITE_MAX_BATCH_SIZE
+        self.target_latency = target_latency or settings.BULK_WRITE_TARGET_LATENCY
+        self.max_batch_bytes = max_batch_bytes or settings.BULK_WRITE_MAX_BATCH_BYTES
+        self.max_retries = settings.BULK_WRITE_MAX_RETRIES if max_retries is None else max_retries
+        self.idempotent = idempotent
+        self.on_written = on_written
+
+        self._buffer: list = []
+        self._in_flight: Set[asyncio.Task] = set()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._failed: list = []
+        self._errors: List[str] = []
+        self.written = 0
+        self.retried = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.flush()
+        else:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def add(self, operation) -> None:
+        """ Queue a write operation, dispatching a batch once enough are queued. """
+        self._buffer.append(operation)
+        if len(self._buffer) >= self.batch_size:
+            await self._dispatch()
+
+    async def add_many(self, operations: Iterable) -> None:
+        """ Queue several write operations. """
+        for operation in operations:
+            await self.add(operation)
+
+    async def flush(self) -> None:
+        """
+        Write all queued operations and wait for every batch in flight.
+
+        Raises:
+            BulkWriterError: If some operations could not be written
+        """
+        while self._buffer:
+            await self._dispatch()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight)
+
+        if self._failed:
+            failed, errors = self._failed, self._errors
+            self._failed, self._errors = [], []
+            raise BulkWriterError(f"{len(failed)} bulk write operations failed: {errors[:5]}", failed)
+
+    async def _dispatch(self) -> None:
+        batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+        await self._slots.acquire()
+        task = asyncio.create_task(self._write(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _write(self, batch: list) -> None:
+        try:
+            attempt = 0
+            while batch:
+                started, attempted = time.monotonic(), batch
+                try:
+                    await self.collection.bulk_write(batch, ordered=False)
+                    succeeded, batch = len(batch), []
+                except BulkWriteError as e:
+                    write_errors = e.details.get("writeErrors", [])
+                    retryable = [error for error in write_errors if error.get("code") in self.RETRYABLE_ERROR_CODES]
+                    fatal = [error for error in write_errors if error.get("code") not in self.RETRYABLE_ERROR_CODES]
+                    succeeded = len(batch) - len(write_errors)
+                    self._fail([batch[error["index"]] for error in fatal], [error.get("errmsg") for error in fatal])
+                    batch = [batch[error["index"]] for error in retryable]
+                except (AutoReconnect, NetworkTimeout, ExecutionTimeout) as e:
+                    # Unknown which operations were applied, only idempotent ones can be resent
+                    succeeded = 0
+                    if attempt >= self.max_retries or not self.idempotent:
+                        self._fail(batch, [str(e)])
+                        batch = []
+                except Exception as e:
+                    # Such as OperationFailure, not retried but raised by flush like the other failures
+                    succeeded = 0
+                    self._fail(batch, [str(e)])
+                    batch = []
+
+                self._adapt(time.monotonic() - started, attempted)
+                self.written += succeeded
+                if succeeded and self.on_written:
+                    self.on_written(succeeded)
+
+                if batch:
+                    if attempt >= self.max_retries:
+                        self._fail(batch, ["retries exhausted"])
+                        break
+                    attempt += 1
+                    self.retried += len(batch)
+                    await asyncio.sleep(settings.BULK_WRITE_RETRY_BACKOFF * 2 ** (attempt - 1))
+        finally:
+            self._slots.release()
+
+    def _fail(self, operations: list, errors: List[str]) -> None:
+        if operations:
+            self._failed.extend(operations)
+            self._errors.extend(errors)
+
+    def _adapt(self, latency: float, batch: list) -> None:
+        """ Adjust the batch size to the observed latency and document size. """
+        if latency > self.target_latency:
+            batch_size = self.batch_size // 2
+        else:
+            batch_size = self.batch_size + max(self.batch_size // 4, 1)
+
+        # Estimate the size of an operation from the first one of the batch
+        document_bytes = len(BSON.encode({"u": getattr(batch[0], "_doc", None) or {}})) + 64
+        batch_size = min(batch_size, self.max_batch_bytes // document_bytes)
+
+        self.batch_size = max(self.min_batch_size, min(self.max_batch_size, batch_size))
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """ Declaration of an index: name, key pattern and options. """
+    name: str
+    keys: Tuple[Tuple[str, int], ...]
+    unique: bool = False
+    partial_filter: Optional[dict] = None
+
+    def model(self) -> IndexModel:
+        options = {"name": self.name, "unique": self.unique}
+        if self.partial_filter is not None:
+            options["partialFilterExpression"] = self.partial_filter
+        return IndexModel(list(self.keys), **options)
+
+    def matches(self, index: dict) -> bool:
+        """ Whether an index as listed by the server has this key pattern and these options. """
+        return (
+                tuple((key, int(direction)) for key, direction in index["key"].items()) == self.keys
+                and bool(index.get("unique", False)) == self.unique
+                and index.get("partialFilterExpression") == self.partial_filter
+        )
+
+
+@dataclass
+class IndexDrift:
+    """ Differences between the declared indexes and those of a collection. """
+    missing: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    unexpected: List[str] = field(default_factory=list)
+
+    @property
+    def in_sync(self) -> bool:
+        return not (self.missing or self.changed or self.unexpected)
+
+
+def song_indexes() -> List[IndexSpec]:
+    """
+    Indexes of the songs collection, each one serving a hot query:
+
+    - Updates of a song by song_id (simulation, event ingestion), unique as in the design doc
+    - Top-K and keyset pages overall and by genre, sorted by the ranking score of the score mode.
+      The trailing song_id makes the sort of keyset pages unique, and the genre index also
+      covers the design doc's {genre, trending_score} index as its prefix.
+    - Incremental rescoring of songs whose stats changed since the last run
+    - Top-K and keyset pages of every region in TRENDING_REGIONS, overall and by genre,
+      sorted by the region score
+
+    The song_id index spans all songs to keep ids unique, the others are partial indexes
+    holding active songs only, those of a region only the songs ranked in it.
+    """
+    ranking_field = TrendingAlgorithm.ranking_field()
+    region_indexes = []
+    for region in settings.TRENDING_REGIONS:
+        region_field = TrendingAlgorithm.ranking_field(region)
+        name = region_field.replace(".", "_")
+        region_indexes += [
+            IndexSpec(f"active_{name}_keyset_index", ((region_field, -1), ("song_id", -1)),
+                      partial_filter=ranked_songs(region)),
+            IndexSpec(f"active_genre_{name}_keyset_index", (("genre", 1), (region_field, -1), ("song_id", -1)),
+                      partial_filter=ranked_songs(region)),
+        ]
+
+    return [
+        IndexSpec("song_id_unique_index", (("song_id", 1),), unique=True),
+        IndexSpec(f"active_{ranking_field}_keyset_index", ((ranking_field, -1), ("song_id", -1)),
+                  partial_filter=dict(ACTIVE_SONGS)),
+        IndexSpec(f"active_genre_{ranking_field}_keyset_index", (("genre", 1), (ranking_field, -1), ("song_id", -1)),
+                  partial_filter=dict(ACTIVE_SONGS)),
+        IndexSpec("active_stats_updated_index", (("stats_updated_at", 1),), partial_filter=dict(ACTIVE_SONGS)),
+        *region_indexes,
+    ]
+
+
+async def index_drift(collection, specs: List[IndexSpec]) -> IndexDrift:
+    """
+    Compare the indexes of a collection to the declared ones, ignoring the _id index
+    """
+    existing = {index["name"]: index async for index in collection.list_indexes() if index["name"] != "_id_"}
+    declared = {spec.name: spec for spec in specs}
+
+    return IndexDrift(
+        missing=[name for name in declared if name not in existing],
+        changed=[name for name, spec in declared.items() if name in existing and not spec.matches(existing[name])],
+        unexpected=[name for name in existing if name not in declared],
+    )
+
+
+async def ensure_indexes(collection, specs: List[IndexSpec], prune: bool = False) -> IndexDrift:
+    """
+    Create the declared indexes a collection is missing, safe to run on every startup.
+
+    Indexes declared differently than they exist and indexes no longer declared are only
+    rebuilt and dropped with prune, as dropping an index in use may slow down queries
+    until its replacement is built.
+
+    Args:
+        collection: Collection to index
+        specs (List[IndexSpec]): Declared indexes
+        prune (bool): Rebuild changed indexes and drop undeclared ones
+    Returns:
+        The drift left after the run
+    """
+    drift = await index_drift(collection, specs)
+    declared = {spec.name: spec for spec in specs}
+
+    if prune:
+        for name in drift.changed + drift.unexpected:
+            logger.info(f"Dropping index {name} of {collection.name}")
+            await collection.drop_index(name)
+        to_create = drift.missing + drift.changed
+    else:
+        to_create = drift.missing
+        for name in drift.changed:
+            logger.warning(f"Index {name} of {collection.name} differs from its declaration, rebuild it with prune")
+        for name in drift.unexpected:
+            logger.warning(f"Index {name} of {collection.name} is not declared, drop it with prune")
+
+    for name in to_create:
+        try:
+            await collection.create_indexes([declared[name].model()])
+            logger.info(f"Created index {name} of {collection.name}")
+        except OperationFailure as e:
+            # Such as duplicate song ids preventing a unique index, the application still works without it
+            logger.error(f"Failed to create index {name} of {collection.name}: {e}")
+
+    return await index_drift(collection, specs)
+
 
 class DatabaseService:
     _instance = None  # Singleton instance
@@ -20,23 +337,60 @@ class DatabaseService:
             cls._instance.client = None
             cls._instance.db = None
             cls._instance.songs_collection = None
+            cls._instance.trending_songs_collection = None
+            cls._instance.trending_meta_collection = None
+            cls._instance.pool_stats = PoolStats(settings.MAX_CONNECTIONS_COUNT)
+            cls._instance._connect_lock = asyncio.Lock()
         return cls._instance
 
     async def connect(self):
         """ Establish a connection to the MongoDB database (only once). """
-        if self.client is None:  # Prevent unnecessary reconnections
+        if self.client is not None:
+            return
+
+        # Concurrent first callers must not create several clients
+        async with self._connect_lock:
+            if self.client is not None:  # Prevent unnecessary reconnections
+                return
+            client = None
             try:
-                self.client = AsyncIOMotorClient(settings.MONGODB_URL)
-                self.db = self.client[settings.MONGODB_DB]
+                client = AsyncIOMotorClient(
+                    settings.MONGODB_URL,
+                    maxPoolSize=settings.MAX_CONNECTIONS_COUNT,
+                    minPoolSize=settings.MIN_CONNECTIONS_COUNT,
+                    maxIdleTimeMS=settings.MONGODB_MAX_IDLE_TIME_MS,
+                    waitQueueTimeoutMS=settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                    connectTimeoutMS=settings.MONGODB_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=settings.MONGODB_SOCKET_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                    event_listeners=[MongoPoolListener(self.pool_stats)],
+                )
+                self.db = client[settings.MONGODB_DB]
                 self.songs_collection = self.db.get_collection("songs")
+                # Trending reads may be served by secondaries, writes and the scoring job use the primary
+                self.trending_songs_collection = self.songs_collection.with_options(
+                    read_preference=self.trending_read_preference()
+                )
+                self.trending_meta_collection = self.db.get_collection("trending_meta")
 
                 # Verify connection by pinging the database
                 await self.db.command('ping')
+                self.client = client
                 logger.info(f"Connected to MongoDB: {settings.MONGODB_DB}")
             except Exception as e:
                 logger.error(f"Failed to connect to MongoDB: {e}")
+                if client is not None:
+                    client.close()
                 raise
 
+    async def ensure_indexes(self, prune: bool = False) -> IndexDrift:
+        """ Create the declared indexes of the songs collection, see ensure_indexes. """
+        return await ensure_indexes(self.songs_collection, song_indexes(), prune=prune)
+
+    @staticmethod
+    def trending_read_preference():
+        return make_read_preference(read_pref_mode_from_name(settings.TRENDING_READ_PREFERENCE), None)
+
     async def close(self):
         """ Close the MongoDB connection. """
         if self.client:
@@ -49,26 +403,156 @@ class DatabaseService:
         if self.songs_collection is None:
             raise RuntimeError("Database not connected. Call connect() first.")
 
-        song_documents = [song.model_dump() for song in songs]
+        now = datetime.utcnow()
+        song_documents = [{**song.model_dump(), "stats_updated_at": now} for song in songs]
         await self.songs_collection.insert_many(song_documents)
 
+    async def insert_song_documents(self, documents: List[dict]) -> int:
+        """
+        Insert raw song documents, trusted to match the Song model, without building models.
+
+        Returns:
+            int: Number of documents inserted
+        """
+        if self.songs_collection is None:
+            raise RuntimeError("Database not connected. Call connect() first.")
+        if not documents:
+            return 0
+
+        now = datetime.utcnow()
+        for document in documents:
+            document.setdefault("stats_updated_at", now)
+        result = await self.songs_collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids)
+
     async def get_top_trending_songs(self, limit: int = 100, offset: int = 0, genre: Optional[Genre] = None) -> List[Song]:
         """
         Retrieve top trending songs from database with optimized query performance.
         """
+        documents = await self.get_top_trending_documents(limit, offset, genre)
+        return [self._construct_song(document) for document in documents]
+
+    async def get_top_trending_documents(
+            self,
+            limit: int = 100,
+            offset: int = 0,
+            genre: Optional[Genre] = None,
+            region: Optional[str] = None,
+            serving: bool = False
+    ) -> List[dict]:
+        """
+        Retrieve top trending songs as plain documents holding exactly the Song fields.
+
+        Only the response fields are fetched and no model is built, the documents can be
+        serialized straight into a response body. They are validated in DEBUG mode only.
+
+        Args:
+            limit (int): Number of songs
+            offset (int): Songs to skip
+            genre (Genre, optional): Genre filter
+            region (str, optional): Rank by the region scores of a region in TRENDING_REGIONS,
+                only songs popular in the region are returned
+            serving (bool): Read with TRENDING_READ_PREFERENCE, possibly from a lagging
+                secondary. Reads that must see the latest scores leave it off.
+        """
         # Build query with genre filter if provided
-        query = {"genre": genre} if genre else {}
+        query = {**ranked_songs(region), "genre": genre} if genre else ranked_songs(region)
+        collection = self.trending_songs_collection if serving else self.songs_collection
 
         # Execute optimized query with pagination
-        cursor = self.songs_collection.find(
-            query
+        cursor = collection.find(
+            query, self._response_projection()
         ).sort(
-            "trending_score", DESCENDING
+            TrendingAlgorithm.ranking_field(region), DESCENDING
         ).skip(offset).limit(limit)
 
-        # Convert cursor to list of Song objects
-        songs = await cursor.to_list(length=limit)
-        return [Song(**song) for song in songs]
+        documents = await cursor.to_list(length=limit)
+        return self._to_documents(documents)
+
+    async def get_trending_songs_after(
+            self,
+            limit: int = 100,
+            genre: Optional[Genre] = None,
+            after: Optional[Tuple[float, str]] = None,
+            at_cluster_time: Optional[Timestamp] = None,
+            region: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[Tuple[float, str]], Optional[Timestamp]]:
+        """
+        Retrieve a page of trending song documents, see get_top_trending_documents, ranked
+        after a (ranking score, song_id) position.
+
+        Uses range predicates on the keyset index instead of skipping documents, so deep
+        pages cost the same as the first one. With TRENDING_SNAPSHOT_READS every page of
+        a pagination is read from the snapshot of its first page. Reads use
+        TRENDING_READ_PREFERENCE. With a region songs are ranked by their region score.
+
+        Returns:
+            Tuple of the songs, the (ranking score, song_id) position of the last song
+            and the cluster time of the snapshot they were read from
+        """
+        field = TrendingAlgorithm.ranking_field(region)
+        query = {**ranked_songs(region), "genre": genre.value} if genre else ranked_songs(region)
+        projection = self._response_projection()
+        if region:
+            projection[field] = 1
+        if after:
+            score, song_id = after
+            query[field] = {"$lte": score}
+            query["$or"] = [{field: {"$lt": score}}, {"song_id": {"$lt": song_id}}]
+
+        command = SON([
+            ("find", self.songs_collection.name),
+            ("filter", query),
+            ("projection", projection),
+            ("sort", SON([(field, DESCENDING), ("song_id", DESCENDING)])),
+            ("limit", limit),
+            ("batchSize", limit),
+            ("singleBatch", True),
+        ])
+        if settings.TRENDING_SNAPSHOT_READS:
+            command["readConcern"] = {"level": "snapshot"}
+            if at_cluster_time:
+                command["readConcern"]["atClusterTime"] = at_cluster_time
+
+        result = await self.db.command(command, read_preference=self.trending_read_preference())
+        songs = result["cursor"]["firstBatch"]
+        if region:
+            # Region scores are only read for the position, they are not part of the response
+            scores = [song.pop(field.split(".")[0])[region] for song in songs]
+        else:
+            scores = [song[field] for song in songs]
+        last_position = (scores[-1], songs[-1]["song_id"]) if songs else None
+
+        return self._to_documents(songs), last_position, result["cursor"].get("atClusterTime")
+
+    @staticmethod
+    def _response_projection() -> dict:
+        projection = dict.fromkeys(SONG_FIELDS, 1)
+        projection["_id"] = 0
+        if settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+            projection["trending_log_score"] = 1
+        return projection
+
+    @staticmethod
+    def _to_documents(documents: List[dict]) -> List[dict]:
+        if settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+            # Report the score decayed up to now rather than as of the last update
+            now = datetime.utcnow()
+            for document in documents:
+                log_score = document.pop("trending_log_score", None)
+                if log_score is not None:
+                    document["trending_score"] = TrendingAlgorithm.decayed_score(log_score, now)
+
+        if settings.DEBUG:
+            for document in documents:
+                Song.model_validate(document)
+
+        return documents
+
+    @staticmethod
+    def _construct_song(document: dict) -> Song:
+        # Stored songs were validated when written, only the enum needs converting
+        return Song.model_construct(**{**document, "genre": Genre(document["genre"])})
 
     async def update_simulation_data(self, songs: List[Song]):
         """ Bulk update simulation data for songs. """
@@ -79,14 +563,81 @@ class DatabaseService:
             UpdateOne({"song_id": song.song_id}, {"$set": {
                                                            "last_played_timestamp": song.last_played_timestamp,
                                                            "play_count": song.play_count,
-                                                           "social_media_shares": song.play_count
+                                                           "social_media_shares": song.play_count,
+                                                           "stats_updated_at": datetime.utcnow()
                                                     }
                                                   })
             for song in songs
         ]
 
-        if bulk_operations:
-            await self.songs_collection.bulk_write(bulk_operations)
+        async with BulkWriter(self.songs_collection) as writer:
+            await writer.add_many(bulk_operations)
+
+    async def get_trending_run(self) -> Optional[dict]:
+        """ Fetch metadata of the last completed trending score update. """
+        return await self.trending_meta_collection.find_one(
+            {"_id": "trending_update", "completed_at": {"$exists": True}}
+        )
+
+    async def claim_trending_run(self, fencing_token: int) -> bool:
+        """
+        Claim the trending score update for the scheduler leader holding fencing_token.
+
+        Fails once a leader with a newer token has claimed it, so a former leader that
+        still believes it leads doesn't start a run next to its successor.
+        """
+        return await self._fenced_update({"$set": {"fencing_token": fencing_token}}, fencing_token)
+
+    async def record_trending_run(self, started_at: datetime, anchor_time: datetime, incremental: bool,
+                                  fencing_token: Optional[int] = None) -> bool:
+        """
+        Record a completed trending score update.
+
+        started_at is used to find songs changed since this run, anchor_time is the
+        reference time every stored trending_score has been computed against.
+        A run of the scheduler leader is only recorded while no newer leader claimed a run.
+
+        Returns:
+            Whether the run was recorded
+        """
+        update = {"$set": {
+            "started_at": started_at,
+            "anchor_time": anchor_time,
+            "incremental": incremental,
+            "completed_at": datetime.utcnow()
+        }}
+        if fencing_token is None:
+            await self.trending_meta_collection.update_one({"_id": "trending_update"}, update, upsert=True)
+            return True
+
+        update["$set"]["fencing_token"] = fencing_token
+        return await self._fenced_update(update, fencing_token)
+
+    async def get_resume_token(self, stream: str) -> Optional[dict]:
+        """ Fetch the stored resume token of a change stream consumer. """
+        document = await self.trending_meta_collection.find_one({"_id": f"change_stream:{stream}"})
+        return document["resume_token"] if document else None
+
+    async def save_resume_token(self, stream: str, resume_token: Optional[dict]) -> None:
+        """ Store the resume token of a change stream consumer, None to start over. """
+        await self.trending_meta_collection.update_one(
+            {"_id": f"change_stream:{stream}"},
+            {"$set": {"resume_token": resume_token, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def _fenced_update(self, update: dict, fencing_token: int) -> bool:
+        try:
+            # Matches unless a newer token is stored, the upsert then collides with the existing document
+            await self.trending_meta_collection.update_one(
+                {"_id": "trending_update", "fencing_token": {"$not": {"$gt": fencing_token}}},
+                update,
+                upsert=True
+            )
+        except DuplicateKeyError:
+            logger.warning(f"Fencing token {fencing_token} is stale, a newer scheduler leader took over")
+            return False
+        return True
 
 
 # Singleton instance
@@ -96,13 +647,7 @@ db_service = DatabaseService()
 # Dependency function for FastAPI
 async def get_db_service():
     """ Ensure a single DB connection is used in all FastAPI routes. """
-    await db_service.connect()
+    # Connected at startup, only connect lazily when used outside the application lifespan
+    if db_service.client is None:
+        await db_service.connect()
     return db_service
-
-
-async def create_indexes(db):
-    await db.songs_collection.create_index(
-        [("genre", 1), ("trending_score", -1)],
-        name="genre_trending_index"
-    )
-
@@ -0,0 +1,402 @@
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pydantic import TypeAdapter
+from pymongo import UpdateOne
+
+from app.cache.redis_cache import redis_cache
+from app.models.event import EventType, SongEvent
+from app.services.database import BulkWriter, BulkWriterError, db_service
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis keys of the counter buffer, hash tagged so that they live in one cluster slot
+PENDING_COUNTERS_KEY = "{counters}:pending"
+PENDING_LAST_PLAYED_KEY = "{counters}:pending_last_played"
+DRAINS_KEY = "{counters}:drains"
+
+_EPOCH = datetime(1970, 1, 1)
+
+SONG_EVENTS_ADAPTER = TypeAdapter(List[SongEvent])
+SONG_EVENT_ADAPTER = TypeAdapter(SongEvent)
+
+
+class IngestionOverloaded(Exception):
+    """ Raised when events arrive faster than they can be flushed. """
+
+
+def parse_events(body: bytes, ndjson: bool = False) -> List[SongEvent]:
+    """
+    Parse a batch of events, either a JSON array or newline delimited JSON objects.
+
+    Raises:
+        pydantic.ValidationError: If an event is invalid
+    """
+    if ndjson:
+        return [SONG_EVENT_ADAPTER.validate_json(line) for line in body.splitlines() if line.strip()]
+    return SONG_EVENTS_ADAPTER.validate_json(body)
+
+
+@dataclass
+class SongCounters:
+    """ Increments accumulated for one song during a flush window. """
+    plays: int = 0
+    shares: int = 0
+    rating_sum: float = 0.0
+    rating_count: int = 0
+    countries: Dict[str, int] = field(default_factory=dict)
+    last_played: Optional[datetime] = None
+
+    def add(self, event: SongEvent) -> None:
+        if event.type == EventType.PLAY:
+            self.plays += event.count
+            if event.country:
+                self.countries[event.country] = self.countries.get(event.country, 0) + event.count
+            if self.last_played is None or event.timestamp > self.last_played:
+                self.last_played = event.timestamp
+        elif event.type == EventType.SHARE:
+            self.shares += event.count
+        elif event.type == EventType.RATING and event.rating is not None:
+            self.rating_sum += event.rating * event.count
+            self.rating_count += event.count
+
+
+def _added(path: str, increment) -> dict:
+    return {"$add": [{"$ifNull": [f"${path}", 0]}, increment]}
+
+
+def build_update(song_id: str, counters: SongCounters, now: datetime, drain_id: Optional[str] = None) -> UpdateOne:
+    """
+    Build the update applying the accumulated counters of a song.
+
+    Ratings need a pipeline update so that user_rating can be recomputed from the running
+    rating sum and count, the rating a song had before its first rating event counts as a
+    single prior rating. Other counters are plain $inc updates.
+
+    Args:
+        song_id (str): Song to update
+        counters (SongCounters): Increments to apply
+        now (datetime): Value of stats_updated_at
+        drain_id (str, optional): Makes the update idempotent, it is skipped for songs
+            that already recorded this id in applied_drains
+
+    Returns:
+        UpdateOne: Update operation
+    """
+    increments = {}
+    if counters.plays:
+        increments["play_count"] = counters.plays
+    if counters.shares:
+        increments["social_media_shares"] = counters.shares
+    for country, plays in counters.countries.items():
+        increments[f"geographic_popularity.{country}"] = plays
+
+    query = {"song_id": song_id}
+    if drain_id is not None:
+        query["applied_drains"] = {"$ne": drain_id}
+
+    if not counters.rating_count:
+        update = {"$set": {"stats_updated_at": now}}
+        if increments:
+            update["$inc"] = increments
+        if counters.last_played:
+            update["$max"] = {"last_played_timestamp": counters.last_played}
+        if drain_id is not None:
+            update["$push"] = {"applied_drains": {"$each": [drain_id], "$slice": -settings.COUNTER_DRAIN_HISTORY}}
+        return UpdateOne(query, update)
+
+    fields = {path: _added(path, increment) for path, increment in increments.items()}
+    fields["stats_updated_at"] = now
+    if counters.last_played:
+        fields["last_played_timestamp"] = {"$max": ["$last_played_timestamp", counters.last_played]}
+    fields["rating_sum"] = {"$add": [
+        {"$ifNull": ["$rating_sum", {"$ifNull": ["$user_rating", 0]}]}, counters.rating_sum
+    ]}
+    fields["rating_count"] = {"$add": [
+        {"$ifNull": ["$rating_count", {"$cond": [{"$gt": ["$user_rating", 0]}, 1, 0]}]}, counters.rating_count
+    ]}
+    if drain_id is not None:
+        fields["applied_drains"] = {"$slice": [
+            {"$concatArrays": [{"$ifNull": ["$applied_drains", []]}, [drain_id]]}, -settings.COUNTER_DRAIN_HISTORY
+        ]}
+
+    return UpdateOne(query, [
+        {"$set": fields},
+        {"$set": {"user_rating": {"$divide": ["$rating_sum", "$rating_count"]}}},
+    ])
+
+
+class EventAggregator:
+    """
+    Aggregates song events in memory per song_id and flushes them periodically as
+    bulk increments, so that a flush window costs one write per song instead of one
+    per event.
+
+    Memory is bounded by max_pending_songs: a batch that would exceed it triggers an
+    early flush, or is rejected with IngestionOverloaded while a flush is already running
+    or failed to make room.
+
+    Every flush is tagged with an id recorded in the songs it updates, like the drains of
+    RedisCounterBuffer. Updates that fail are kept with their flush id and resent by the
+    next flush, songs that were updated nonetheless skip them.
+    """
+
+    def __init__(self, db_service, flush_interval: float = None, max_pending_songs: int = None):
+        self.db_service = db_service
+        self.flush_interval = flush_interval or settings.INGESTION_FLUSH_INTERVAL
+        self.max_pending_songs = max_pending_songs or settings.INGESTION_MAX_PENDING_SONGS
+        self._pending: Dict[str, SongCounters] = {}
+        # Counters of failed updates by flush id, resent with it by the next flush
+        self._failed: Dict[str, Dict[str, SongCounters]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.events_received = 0
+        self.songs_flushed = 0
+
+    async def start(self):
+        """ Start flushing every flush_interval seconds. """
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """ Stop the periodic flush and flush what is still pending. """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush song events: {e}")
+
+    async def add(self, events: Iterable[SongEvent]) -> int:
+        """
+        Aggregate events into the pending counters.
+
+        Returns:
+            int: Number of events accepted
+
+        Raises:
+            IngestionOverloaded: If the pending counters are full while a flush is running,
+                none of the events are accepted then
+        """
+        events = list(events)
+        new_songs = {event.song_id for event in events} - self._pending.keys()
+        if new_songs and self._pending_songs() + len(new_songs) > self.max_pending_songs:
+            # Reject the whole batch rather than part of it, so that it can simply be retried
+            if self._flush_lock.locked():
+                raise IngestionOverloaded(f"{len(self._pending)} songs pending, flush in progress")
+            try:
+                await self.flush()
+            except BulkWriterError as e:
+                logger.error(f"Failed to flush song events: {e}")
+            if self._pending_songs() + len(new_songs) > self.max_pending_songs:
+                raise IngestionOverloaded(f"{self._pending_songs()} songs pending, flush failed")
+
+        for event in events:
+            counters = self._pending.get(event.song_id)
+            if counters is None:
+                counters = self._pending[event.song_id] = SongCounters()
+            counters.add(event)
+
+        self.events_received += len(events)
+        return len(events)
+
+    def _pending_songs(self) -> int:
+        return len(self._pending) + sum(len(songs) for songs in self._failed.values())
+
+    async def flush(self) -> int:
+        """
+        Write the pending counters, and those of updates that failed before, to the database.
+
+        Returns:
+            int: Number of songs updated
+
+        Raises:
+            BulkWriterError: If some updates failed, they are kept for the next flush
+        """
+        async with self._flush_lock:
+            batches, self._failed = self._failed, {}
+            if self._pending:
+                batches[uuid.uuid4().hex[:12]], self._pending = self._pending, {}
+            if not batches:
+                return 0
+
+            now = datetime.utcnow()
+            operations = {
+                (flush_id, song_id): build_update(song_id, counters, now, drain_id=flush_id)
+                for flush_id, songs in batches.items() for song_id, counters in songs.items()
+            }
+            try:
+                # Guarded by the flush id, resending a batch cannot count it twice
+                async with BulkWriter(self.db_service.songs_collection, idempotent=True) as writer:
+                    await writer.add_many(operations.values())
+            except BulkWriterError as e:
+                failed = {id(operation) for operation in e.failed_operations}
+                for (flush_id, song_id), operation in operations.items():
+                    if id(operation) in failed:
+                        self._failed.setdefault(flush_id, {})[song_id] = batches[flush_id][song_id]
+                self.songs_flushed += len(operations) - len(failed)
+                raise
+
+            self.songs_flushed += len(operations)
+            logger.debug(f"Flushed song events for {len(operations)} songs")
+            return len(operations)
+
+    def stats(self) -> dict:
+        return {
+            "pending_songs": len(self._pending),
+            "failed_songs": self._pending_songs() - len(self._pending),
+            "events_received": self.events_received,
+            "songs_flushed": self.songs_flushed,
+        }
+
+
+def _draining_keys(drain_id: str) -> Tuple[str, str]:
+    return f"{{counters}}:draining:{drain_id}", f"{{counters}}:draining_last_played:{drain_id}"
+
+
+class RedisCounterBuffer:
+    """
+    Buffers song counters in Redis, where increments are cheap, and drains them into
+    MongoDB in bulk.
+
+    Counters of all instances accumulate in one hash with fields like "p|<song_id>"
+    (plays), "s|<song_id>" (shares) or "g|<country>|<song_id>" (plays per country), and
+    last played timestamps in a sorted set. A drain renames both keys in one transaction
+    to keys of a new drain id, so increments arriving meanwhile start a fresh buffer,
+    then applies them with updates guarded by the drain id. Drains that crashed midway
+    are found in the drains set and replayed, the guard skips songs they already updated.
+    """
+
+    def __init__(self, db_service, cache=None):
+        self.db_service = db_service
+        self.cache = cache or redis_cache
+
+    async def start(self):
+        """ Counters are drained by the scheduler, nothing runs in the background. """
+
+    async def stop(self):
+        pass
+
+    async def add(self, events: Iterable[SongEvent]) -> int:
+        """
+        Add events to the Redis counters, folded per song and written in one pipeline.
+
+        Returns:
+            int: Number of events accepted
+        """
+        events = list(events)
+        songs: Dict[str, SongCounters] = {}
+        for event in events:
+            songs.setdefault(event.song_id, SongCounters()).add(event)
+
+        async with self.cache.client.pipeline(transaction=False) as pipe:
+            for song_id, counters in songs.items():
+                if counters.plays:
+                    pipe.hincrby(PENDING_COUNTERS_KEY, f"p|{song_id}", counters.plays)
+                if counters.shares:
+                    pipe.hincrby(PENDING_COUNTERS_KEY, f"s|{song_id}", counters.shares)
+                for country, plays in counters.countries.items():
+                    pipe.hincrby(PENDING_COUNTERS_KEY, f"g|{country}|{song_id}", plays)
+                if counters.rating_count:
+                    pipe.hincrbyfloat(PENDING_COUNTERS_KEY, f"rs|{song_id}", counters.rating_sum)
+                    pipe.hincrby(PENDING_COUNTERS_KEY, f"rc|{song_id}", counters.rating_count)
+                if counters.last_played:
+                    seconds = (counters.last_played - _EPOCH).total_seconds()
+                    pipe.zadd(PENDING_LAST_PLAYED_KEY, {song_id: seconds}, gt=True)
+            await pipe.execute()
+
+        return len(events)
+
+    async def flush(self) -> int:
+        return await self.drain()
+
+    async def drain(self) -> int:
+        """
+        Move the pending counters to a new drain and apply every unfinished drain.
+
+        Returns:
+            int: Number of song updates written
+        """
+        # Time prefixed so that leftover drains are replayed in order
+        drain_id = f"{int(time.time() * 1000):015d}-{uuid.uuid4().hex[:8]}"
+        counters_key, last_played_key = _draining_keys(drain_id)
+
+        async with self.cache.client.pipeline(transaction=True) as pipe:
+            pipe.sadd(DRAINS_KEY, drain_id)
+            # RENAME fails on a missing key without aborting the transaction
+            pipe.rename(PENDING_COUNTERS_KEY, counters_key)
+            pipe.rename(PENDING_LAST_PLAYED_KEY, last_played_key)
+            await pipe.execute(raise_on_error=False)
+
+        drains = sorted(member.decode() for member in await self.cache.client.smembers(DRAINS_KEY))
+        written = 0
+        for pending_id in drains:
+            written += await self._apply_drain(pending_id)
+        return written
+
+    async def _apply_drain(self, drain_id: str) -> int:
+        counters_key, last_played_key = _draining_keys(drain_id)
+        client = self.cache.client
+
+        songs: Dict[str, SongCounters] = {}
+        for field_name, value in (await client.hgetall(counters_key)).items():
+            kind, _, song_id = field_name.decode().partition("|")
+            if kind == "g":
+                country, _, song_id = song_id.partition("|")
+                songs.setdefault(song_id, SongCounters()).countries[country] = int(value)
+                continue
+
+            counters = songs.setdefault(song_id, SongCounters())
+            if kind == "p":
+                counters.plays = int(value)
+            elif kind == "s":
+                counters.shares = int(value)
+            elif kind == "rs":
+                counters.rating_sum = float(value)
+            elif kind == "rc":
+                counters.rating_count = int(value)
+
+        for song_id, seconds in await client.zrange(last_played_key, 0, -1, withscores=True):
+            songs.setdefault(song_id.decode(), SongCounters()).last_played = _EPOCH + timedelta(seconds=seconds)
+
+        if songs:
+            now = datetime.utcnow()
+            # Guarded by the drain id, resending a batch cannot count it twice
+            async with BulkWriter(self.db_service.songs_collection, idempotent=True) as writer:
+                await writer.add_many(
+                    build_update(song_id, counters, now, drain_id=drain_id) for song_id, counters in songs.items()
+                )
+
+        # Only reached once every update was written, the writer raises otherwise and the
+        # drain is replayed by the next one
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.delete(counters_key, last_played_key)
+            pipe.srem(DRAINS_KEY, drain_id)
+            await pipe.execute()
+
+        logger.debug(f"Drained counters of {len(songs)} songs ({drain_id})")
+        return len(songs)
+
+
+# Singleton instances, writing into the application database
+event_aggregator = EventAggregator(db_service)
+counter_buffer = RedisCounterBuffer(db_service)
+
+
+def get_event_sink():
+    """
+    Ingestion backend selected by settings.INGESTION_BACKEND
+    """
+    return counter_buffer if settings.INGESTION_BACKEND == "redis" else event_aggregator
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.cache.redis_cache import redis_cache
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    """
+    Lease on a named role, held in a Redis hash that expires unless its owner renews it.
+
+    Every new owner draws a fencing token from a counter that never decreases, so writes
+    guarded by the token reject an owner whose lease has already passed to another one.
+    """
+
+    # Acquires the lease if it is free or renews it if the caller holds it, returns the fencing token
+    _HEARTBEAT_SCRIPT = """
+    local owner = redis.call("hget", KEYS[1], "owner")
+    if owner == false then
+        local token = redis.call("incr", KEYS[2])
+        redis.call("hset", KEYS[1], "owner", ARGV[1], "token", token, "acquired_at", ARGV[3], "heartbeat_at", ARGV[3])
+        redis.call("pexpire", KEYS[1], ARGV[2])
+        return token
+    elseif owner == ARGV[1] then
+        redis.call("hset", KEYS[1], "heartbeat_at", ARGV[3])
+        redis.call("pexpire", KEYS[1], ARGV[2])
+        return tonumber(redis.call("hget", KEYS[1], "token"))
+    end
+    return false
+    """
+
+    # Deletes the lease only if the caller still holds it
+    _RELEASE_SCRIPT = """
+    if redis.call("hget", KEYS[1], "owner") == ARGV[1] then
+        return redis.call("del", KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, cache, name: str, ttl_ms: int):
+        self.cache = cache
+        self.ttl_ms = ttl_ms
+        self.key = f"leader:{name}"
+        self.fence_key = f"leader:{name}:fence"
+
+    async def heartbeat(self, owner: str) -> Optional[int]:
+        """
+        Acquire or renew the lease for owner
+
+        Args:
+            owner (str): Identifier of the instance
+        Returns:
+            The fencing token of the lease, None if another owner holds it
+        """
+        token = await self.cache.client.eval(
+            self._HEARTBEAT_SCRIPT, 2, self.key, self.fence_key, owner, self.ttl_ms, datetime.utcnow().isoformat()
+        )
+        return int(token) if token is not None else None
+
+    async def release(self, owner: str) -> None:
+        """
+        Give up the lease if owner still holds it, so another instance can take over right away
+        """
+        await self.cache.client.eval(self._RELEASE_SCRIPT, 1, self.key, owner)
+
+    async def holder(self) -> Optional[Dict[str, Any]]:
+        """
+        Current owner of the lease with its fencing token, heartbeat and remaining lifetime
+        """
+        async with self.cache.client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self.key)
+            pipe.pttl(self.key)
+            lease, ttl_ms = await pipe.execute()
+
+        if not lease:
+            return None
+
+        lease = {field.decode(): value.decode() for field, value in lease.items()}
+        lease["token"] = int(lease["token"])
+        lease["expires_in_ms"] = ttl_ms
+        return lease
+
+
+class LeaderElection:
+    """
+    Elects one instance as leader by holding a LeaderLease.
+
+    Every instance calls heartbeat() at an interval well below the lease TTL: the leader
+    renews its lease, the others take over once it expired after the leader stopped or
+    lost Redis. A leader that can't renew steps down on its own once the lease may have
+    expired, and cancels the work it started as leader, since another instance may
+    already run it.
+    """
+
+    def __init__(self, lease: LeaderLease, instance_id: Optional[str] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.lease = lease
+        self.instance_id = instance_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.clock = clock
+        self.fencing_token: Optional[int] = None
+        self.last_heartbeat: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self._renewed_at: Optional[float] = None
+        self._leader_tasks = set()
+
+    @property
+    def is_leader(self) -> bool:
+        """Whether this instance holds a lease that can't have expired yet"""
+        return (
+                self.fencing_token is not None
+                and self.clock() - self._renewed_at < self.lease.ttl_ms / 1000
+        )
+
+    async def heartbeat(self) -> bool:
+        """
+        Acquire or renew the lease
+
+        Returns:
+            Whether this instance is the leader afterwards
+        """
+        # Taken before the round trip, the lease may expire that much earlier than measured from its reply
+        started = self.clock()
+
+        try:
+            token = await self.lease.heartbeat(self.instance_id)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Leader heartbeat of {self.instance_id} failed: {e}")
+            if self.fencing_token is not None and not self.is_leader:
+                self._step_down()
+            return self.is_leader
+
+        self.last_error = None
+        self.last_heartbeat = datetime.utcnow()
+
+        if token is None:
+            if self.fencing_token is not None:
+                self._step_down()
+            return False
+
+        if token != self.fencing_token:
+            if self.fencing_token is not None:
+                # The lease expired in between and was acquired again, the old token is void
+                self._step_down()
+            logger.info(f"Instance {self.instance_id} elected leader with fencing token {token}")
+
+        self.fencing_token = token
+        self._renewed_at = started
+        return True
+
+    async def run_as_leader(self, work: Callable[[int], Awaitable[Any]]) -> Any:
+        """
+        Run work with the fencing token if this instance is the leader
+
+        The work is cancelled when this instance loses the lease while it runs.
+
+        Args:
+            work: Coroutine function called with the fencing token
+        Returns:
+            Result of the work, None if this instance isn't the leader
+        """
+        if not self.is_leader:
+            logger.debug(f"Instance {self.instance_id} is not the leader, skipping")
+            return None
+
+        task = asyncio.create_task(work(self.fencing_token))
+        self._leader_tasks.add(task)
+        try:
+            return await task
+        finally:
+            self._leader_tasks.discard(task)
+
+    async def resign(self) -> None:
+        """
+        Release the lease on shutdown
+        """
+        if self.fencing_token is None:
+            return
+        self._step_down()
+        try:
+            await self.lease.release(self.instance_id)
+        except Exception as e:
+            logger.error(f"Failed to release leader lease of {self.instance_id}: {e}")
+
+    async def status(self) -> Dict[str, Any]:
+        """
+        Leadership of this instance and the current lease holder
+        """
+        try:
+            leader = await self.lease.holder()
+        except Exception as e:
+            leader = {"error": str(e)}
+
+        return {
+            "instance_id": self.instance_id,
+            "is_leader": self.is_leader,
+            "fencing_token": self.fencing_token if self.is_leader else None,
+            "last_heartbeat": self.last_heartbeat.isoformat() if self.last_heartbeat else None,
+            "last_error": self.last_error,
+            "leader": leader,
+        }
+
+    def _step_down(self) -> None:
+        logger.warning(f"Instance {self.instance_id} lost leadership (fencing token {self.fencing_token})")
+        self.fencing_token = None
+        self._renewed_at = None
+        for task in self._leader_tasks:
+            task.cancel()
+
+
+# Singleton instance electing the instance that runs the scheduled jobs
+scheduler_election = LeaderElection(
+    LeaderLease(redis_cache, "trending_scheduler", settings.LEADER_LEASE_TTL_MS)
+)
@@ -0,0 +1,117 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from pymongo import monitoring
+
+
+class PoolStats:
+    """
+    Thread-safe checkout statistics of a connection pool.
+
+    Records connections in use and callers waiting for one, with their peaks, and how
+    long checkouts wait. Saturation shows as in_use reaching max_size, waiting callers
+    and checkout timeouts.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.in_use = 0
+            self.max_in_use = 0
+            self.waiting = 0
+            self.max_waiting = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def checkout_started(self) -> None:
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def checked_out(self, wait_seconds: float) -> None:
+        with self._lock:
+            self.waiting = max(self.waiting - 1, 0)
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+    def checkout_failed(self) -> None:
+        with self._lock:
+            self.waiting = max(self.waiting - 1, 0)
+            self.checkout_failures += 1
+
+    def checked_in(self) -> None:
+        with self._lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "saturation": self.in_use / self.max_size if self.max_size else None,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "wait_seconds_avg": self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """
+    Feeds PoolStats from the connection pool events of the MongoDB driver.
+
+    A checkout starts and completes on the same driver thread, so its wait time is
+    measured with a thread-local start time.
+    """
+
+    def __init__(self, stats: PoolStats):
+        self.stats = stats
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.monotonic()
+        self.stats.checkout_started()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        self.stats.checked_out(time.monotonic() - started if started is not None else 0.0)
+
+    def connection_check_out_failed(self, event):
+        self.stats.checkout_failed()
+
+    def connection_checked_in(self, event):
+        self.stats.checked_in()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
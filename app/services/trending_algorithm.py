@@ -1,9 +1,14 @@
 import math
 from datetime import datetime
 
-from typing import List, Optional, Dict
+from typing import Any, List, Optional, Dict, Iterable, Sequence
+
+import numpy as np
+from pydantic import BaseModel
 
 from app.models.song import Song, Genre
+from app.constants import SCORE_MODE_DECAY_INVARIANT, TRENDING_EPOCH
+from app.settings.config import settings
 
 
 class TrendingAlgorithm:
@@ -17,6 +22,12 @@ class TrendingAlgorithm:
         'geographic_popularity': 0.1
     }
 
+    # Hours after which the recency of a song halves
+    HALF_LIFE_HOURS: float = 24
+
+    # Floor for the engagement score, keeping log-domain scores finite
+    MIN_ENGAGEMENT_SCORE: float = 1e-6
+
     @staticmethod
     def calculate_trending_score(song: Song, current_time: datetime = None) -> float:
         """
@@ -34,12 +45,26 @@ class TrendingAlgorithm:
 
         current_time = current_time or datetime.utcnow()
 
+        if isinstance(song, BaseModel):
+            song = song.model_dump()
+
         # Recency Score
         time_since_play = (current_time - song["last_played_timestamp"]).total_seconds() / 3600  # hours
 
         # Half-life decay calculation with exponential amplification
         recency_score = (2 ** (-time_since_play / 24)) * 100 * weights['recency']
 
+        # Combine scores with normalization
+        trending_score = recency_score + TrendingAlgorithm._engagement_score(song)
+        return trending_score
+
+    @staticmethod
+    def _engagement_score(song: dict) -> float:
+        """
+        Calculate the time-independent part of the trending score of a song document.
+        """
+        weights = TrendingAlgorithm.WEIGHTS
+
         # Play Count Score (logarithmic scaling with reduced impact)
         play_count_score = math.log(song["play_count"] + 1) * weights['play_count'] * 100
 
@@ -55,15 +80,400 @@ class TrendingAlgorithm:
             for popularity in song["geographic_popularity"].values()
         ) / max(len(song["geographic_popularity"]), 1)
 
-        # Combine scores with normalization
-        trending_score = (
-                recency_score +
+        return (
                 play_count_score +
                 rating_score +
                 social_score +
                 geo_score
         )
-        return trending_score
+
+    @staticmethod
+    def calculate_decay_invariant_score(song: Song) -> float:
+        """
+        Calculate a time-independent, log-domain trending score of the song.
+
+        The decayed score of a song at time t is its engagement score halved every
+        HALF_LIFE_HOURS since it was last played. Taking log2 of it and dropping the
+        term shared by every song leaves log2(engagement) plus the half-lives elapsed
+        between TRENDING_EPOCH and the last play, so sorting by this value equals
+        sorting by the decayed score at any query time.
+
+        Args:
+            song (Song): The song to calculate the score for
+
+        Returns:
+            float: Log-domain trending score anchored to TRENDING_EPOCH
+        """
+        if isinstance(song, BaseModel):
+            song = song.model_dump()
+
+        engagement_score = max(TrendingAlgorithm._engagement_score(song), TrendingAlgorithm.MIN_ENGAGEMENT_SCORE)
+        epoch_hours = (song["last_played_timestamp"] - TRENDING_EPOCH).total_seconds() / 3600
+
+        return math.log2(engagement_score) + epoch_hours / TrendingAlgorithm.HALF_LIFE_HOURS
+
+    @staticmethod
+    def decayed_score(log_score: float, current_time: datetime = None) -> float:
+        """
+        Convert a decay-invariant log score into the decayed score at current_time.
+        """
+        current_time = current_time or datetime.utcnow()
+        epoch_hours = (current_time - TRENDING_EPOCH).total_seconds() / 3600
+
+        return 2 ** (log_score - epoch_hours / TrendingAlgorithm.HALF_LIFE_HOURS)
+
+    @staticmethod
+    def ranking_field(region: Optional[str] = None) -> str:
+        """
+        Name of the stored field songs are ranked by in the configured score mode,
+        overall or within a region.
+        """
+        if settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+            return f"region_log_scores.{region}" if region else "trending_log_score"
+        return f"region_scores.{region}" if region else "trending_score"
+
+    @staticmethod
+    def region_scores(song: Song, ranking_score: float) -> Dict[str, float]:
+        """
+        Calculate the ranking scores of a song within each region it is popular in.
+
+        A region score is the ranking score of the song scaled by its popularity in the
+        region relative to its most popular region. Decay-invariant log scores are
+        shifted by log2 of that ratio instead, so they decay like the score they scale.
+        Regions without a positive popularity get no score, the song isn't ranked there.
+
+        Args:
+            song (Song): The song to calculate the region scores for
+            ranking_score (float): Its score in the ranking field of the score mode
+
+        Returns:
+            dict: Region score per region
+        """
+        if isinstance(song, BaseModel):
+            song = song.model_dump()
+
+        popularity = {region: value for region, value in song["geographic_popularity"].items() if value > 0}
+        if not popularity:
+            return {}
+
+        max_value = max(popularity.values())
+        if settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+            return {region: ranking_score + math.log2(value / max_value) for region, value in popularity.items()}
+        return {region: ranking_score * value / max_value for region, value in popularity.items()}
+
+    @staticmethod
+    def calculate_trending_scores(
+            last_played_timestamps: Sequence,
+            play_counts: Sequence,
+            user_ratings: Sequence,
+            social_media_shares: Sequence,
+            geographic_popularity: np.ndarray,
+            current_time: datetime = None
+    ) -> np.ndarray:
+        """
+        Calculate trending scores for many songs in a single vectorized pass.
+
+        Produces the same values as calculate_trending_score, which remains the
+        reference implementation.
+
+        Args:
+            last_played_timestamps: Last played times (datetime or datetime64), one per song
+            play_counts: Play counts, one per song
+            user_ratings: User ratings, one per song
+            social_media_shares: Social media shares, one per song
+            geographic_popularity (np.ndarray): 2D matrix of shape (songs, regions),
+                NaN where a song has no value for a region
+            current_time (datetime, optional): Reference time for calculations
+
+        Returns:
+            np.ndarray: Calculated trending scores
+        """
+        weights = TrendingAlgorithm.WEIGHTS
+
+        current_time = np.datetime64(current_time or datetime.utcnow(), "us")
+
+        # Recency Score
+        timestamps = np.asarray(last_played_timestamps, dtype="datetime64[us]")
+        time_since_play = (current_time - timestamps) / np.timedelta64(1, "h")
+        recency_score = np.exp2(-time_since_play / 24) * 100 * weights['recency']
+
+        engagement_score = TrendingAlgorithm._engagement_scores(
+            play_counts, user_ratings, social_media_shares, geographic_popularity
+        )
+
+        return recency_score + engagement_score
+
+    @staticmethod
+    def calculate_decay_invariant_scores(
+            last_played_timestamps: Sequence,
+            play_counts: Sequence,
+            user_ratings: Sequence,
+            social_media_shares: Sequence,
+            geographic_popularity: np.ndarray
+    ) -> np.ndarray:
+        """
+        Vectorized calculate_decay_invariant_score over columnar arrays, see
+        calculate_trending_scores for the expected columns.
+        """
+        engagement_score = np.maximum(
+            TrendingAlgorithm._engagement_scores(play_counts, user_ratings, social_media_shares, geographic_popularity),
+            TrendingAlgorithm.MIN_ENGAGEMENT_SCORE
+        )
+        timestamps = np.asarray(last_played_timestamps, dtype="datetime64[us]")
+        epoch_hours = (timestamps - np.datetime64(TRENDING_EPOCH, "us")) / np.timedelta64(1, "h")
+
+        return np.log2(engagement_score) + epoch_hours / TrendingAlgorithm.HALF_LIFE_HOURS
+
+    @staticmethod
+    def _engagement_scores(
+            play_counts: Sequence,
+            user_ratings: Sequence,
+            social_media_shares: Sequence,
+            geographic_popularity: np.ndarray
+    ) -> np.ndarray:
+        """
+        Vectorized _engagement_score over columnar arrays.
+        """
+        weights = TrendingAlgorithm.WEIGHTS
+
+        # Play Count, User Rating and Social Media Shares Scores
+        play_counts = np.asarray(play_counts, dtype=np.float64)
+        play_count_score = np.log(play_counts + 1) * weights['play_count'] * 100
+        rating_score = np.asarray(user_ratings, dtype=np.float64) * weights['user_rating'] * 100
+        social_score = (
+                np.log(np.asarray(social_media_shares, dtype=np.float64) + 1)
+                * weights['social_media_shares'] * 100
+        )
+
+        # Geographic Score, ignoring regions a song has no value for
+        geo = np.asarray(geographic_popularity, dtype=np.float64).reshape(len(play_counts), -1)
+        present = ~np.isnan(geo)
+        region_count = present.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            max_geo_value = np.max(np.where(present, geo, -np.inf), axis=1, initial=-np.inf)
+            geo_ratio_sum = np.where(present, geo / max_geo_value[:, None], 0.0).sum(axis=1)
+            geo_score = np.where(
+                (region_count > 0) & (max_geo_value > 0),
+                geo_ratio_sum * weights['geographic_popularity'] * 100 / np.maximum(region_count, 1),
+                0.0
+            )
+
+        return play_count_score + rating_score + social_score + geo_score
+
+    @staticmethod
+    def _region_scores(
+            ranking_scores: np.ndarray,
+            geographic_popularity: np.ndarray,
+            regions: List[str]
+    ) -> List[Dict[str, float]]:
+        """
+        Vectorized region_scores over the columns of geographic_popularity named by regions.
+        """
+        geo = np.asarray(geographic_popularity, dtype=np.float64).reshape(len(ranking_scores), -1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            present = np.nan_to_num(geo, nan=0.0) > 0
+            max_geo_value = np.max(np.where(present, geo, 0.0), axis=1, initial=0.0)
+            ratios = np.where(present, geo / max_geo_value[:, None], np.nan)
+            if settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+                scores = ranking_scores[:, None] + np.log2(ratios)
+            else:
+                scores = ranking_scores[:, None] * ratios
+
+        return [
+            {region: score for region, score, has_score in zip(regions, row, row_present) if has_score}
+            for row, row_present in zip(scores.tolist(), present.tolist())
+        ]
+
+    @staticmethod
+    def score_pipeline(current_time: datetime = None) -> List[dict]:
+        """
+        Aggregation pipeline stages computing the score fields of score_fields_for_songs
+        inside MongoDB, for scoring without transferring the songs.
+
+        Args:
+            current_time (datetime, optional): Reference time for calculations
+
+        Returns:
+            list: $set stages adding the score fields to each song
+        """
+        weights = TrendingAlgorithm.WEIGHTS
+        current_time = current_time or datetime.utcnow()
+        half_life_ms = TrendingAlgorithm.HALF_LIFE_HOURS * 3600 * 1000
+        engagement_score = TrendingAlgorithm._engagement_expression()
+
+        if settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+            # Date subtraction gives milliseconds
+            epoch_half_lives = {"$divide": [{"$subtract": ["$last_played_timestamp", TRENDING_EPOCH]}, half_life_ms]}
+            current_half_lives = (current_time - TRENDING_EPOCH).total_seconds() * 1000 / half_life_ms
+            return [
+                {"$set": {"trending_log_score": {"$add": [
+                    {"$log": [{"$max": [engagement_score, TrendingAlgorithm.MIN_ENGAGEMENT_SCORE]}, 2]},
+                    epoch_half_lives
+                ]}}},
+                {"$set": {
+                    "trending_score": {"$pow": [2, {"$subtract": ["$trending_log_score", current_half_lives]}]},
+                    "region_log_scores": TrendingAlgorithm._region_scores_expression("$trending_log_score"),
+                }},
+            ]
+
+        half_lives_since_play = {"$divide": [{"$subtract": [current_time, "$last_played_timestamp"]}, half_life_ms]}
+        recency_score = {"$multiply": [
+            {"$pow": [2, {"$multiply": [-1, half_lives_since_play]}]}, 100 * weights['recency']
+        ]}
+        return [
+            {"$set": {"trending_score": {"$add": [recency_score, engagement_score]}}},
+            {"$set": {"region_scores": TrendingAlgorithm._region_scores_expression("$trending_score")}},
+        ]
+
+    @staticmethod
+    def _region_scores_expression(ranking_score: str) -> dict:
+        """
+        Aggregation expression of region_scores, scaling the ranking_score field path.
+        """
+        if settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+            region_score = {"$add": [ranking_score, {"$log": [{"$divide": ["$$this.v", "$$max_value"]}, 2]}]}
+        else:
+            region_score = {"$multiply": [ranking_score, {"$divide": ["$$this.v", "$$max_value"]}]}
+
+        return {"$let": {
+            "vars": {"popular": {"$filter": {
+                "input": {"$objectToArray": {"$ifNull": ["$geographic_popularity", {}]}},
+                "cond": {"$gt": ["$$this.v", 0]}
+            }}},
+            "in": {"$let": {
+                "vars": {"max_value": {"$max": {"$map": {"input": "$$popular", "in": "$$this.v"}}}},
+                "in": {"$arrayToObject": {"$map": {
+                    "input": "$$popular",
+                    "in": {"k": "$$this.k", "v": region_score}
+                }}}
+            }}
+        }}
+
+    @staticmethod
+    def _engagement_expression() -> dict:
+        """
+        Aggregation expression of _engagement_scores, regions without a value are ignored.
+        """
+        weights = TrendingAlgorithm.WEIGHTS
+
+        geo_score = {"$let": {
+            "vars": {"values": {"$map": {
+                "input": {"$objectToArray": {"$ifNull": ["$geographic_popularity", {}]}},
+                "in": "$$this.v"
+            }}},
+            "in": {"$let": {
+                "vars": {"max_value": {"$max": "$$values"}, "regions": {"$size": "$$values"}},
+                "in": {"$cond": [
+                    {"$and": [{"$gt": ["$$regions", 0]}, {"$gt": ["$$max_value", 0]}]},
+                    {"$divide": [
+                        {"$multiply": [
+                            {"$sum": {"$map": {"input": "$$values", "in": {"$divide": ["$$this", "$$max_value"]}}}},
+                            weights['geographic_popularity'] * 100
+                        ]},
+                        "$$regions"
+                    ]},
+                    0
+                ]}
+            }}
+        }}
+
+        return {"$add": [
+            {"$multiply": [{"$ln": {"$add": ["$play_count", 1]}}, weights['play_count'] * 100]},
+            {"$multiply": ["$user_rating", weights['user_rating'] * 100]},
+            {"$multiply": [{"$ln": {"$add": ["$social_media_shares", 1]}}, weights['social_media_shares'] * 100]},
+            geo_score,
+        ]}
+
+    @staticmethod
+    def songs_to_columns(songs: Iterable, regions: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Convert songs (documents or Song models) into the columnar arrays
+        expected by calculate_trending_scores.
+
+        Args:
+            songs: Songs to convert
+            regions (list, optional): Region columns of the geographic matrix.
+                Defaults to every region seen in the batch.
+
+        Returns:
+            dict: Keyword arguments for calculate_trending_scores
+        """
+        songs = [song.model_dump() if isinstance(song, BaseModel) else song for song in songs]
+
+        if regions is None:
+            regions = sorted({region for song in songs for region in song["geographic_popularity"]})
+        region_index = {region: i for i, region in enumerate(regions)}
+
+        geographic_popularity = np.full((len(songs), len(regions)), np.nan)
+        for row, song in enumerate(songs):
+            for region, popularity in song["geographic_popularity"].items():
+                geographic_popularity[row, region_index[region]] = popularity
+
+        return {
+            "last_played_timestamps": np.array(
+                [song["last_played_timestamp"] for song in songs], dtype="datetime64[us]"
+            ),
+            "play_counts": np.array([song["play_count"] for song in songs], dtype=np.float64),
+            "user_ratings": np.array([song["user_rating"] for song in songs], dtype=np.float64),
+            "social_media_shares": np.array([song["social_media_shares"] for song in songs], dtype=np.float64),
+            "geographic_popularity": geographic_popularity,
+        }
+
+    @staticmethod
+    def calculate_trending_scores_for_songs(songs: Sequence, current_time: datetime = None) -> List[float]:
+        """
+        Calculate trending scores for a batch of songs (documents or Song models).
+        """
+        if not songs:
+            return []
+        columns = TrendingAlgorithm.songs_to_columns(songs)
+        return TrendingAlgorithm.calculate_trending_scores(**columns, current_time=current_time).tolist()
+
+    @staticmethod
+    def calculate_decay_invariant_scores_for_songs(songs: Sequence) -> List[float]:
+        """
+        Calculate decay-invariant scores for a batch of songs (documents or Song models).
+        """
+        if not songs:
+            return []
+        columns = TrendingAlgorithm.songs_to_columns(songs)
+        return TrendingAlgorithm.calculate_decay_invariant_scores(**columns).tolist()
+
+    @staticmethod
+    def score_fields_for_songs(songs: Sequence, current_time: datetime = None) -> List[Dict[str, Any]]:
+        """
+        Calculate the score fields to store for a batch of songs in the configured score mode,
+        the ranking score and the region scores (see region_scores).
+
+        Returns:
+            list: One dict of field values to $set per song
+        """
+        if not songs:
+            return []
+
+        songs = [song.model_dump() if isinstance(song, BaseModel) else song for song in songs]
+        regions = sorted({region for song in songs for region in song["geographic_popularity"]})
+        columns = TrendingAlgorithm.songs_to_columns(songs, regions)
+
+        if settings.TRENDING_SCORE_MODE == SCORE_MODE_DECAY_INVARIANT:
+            current_time = current_time or datetime.utcnow()
+            log_scores = TrendingAlgorithm.calculate_decay_invariant_scores(**columns)
+            region_scores = TrendingAlgorithm._region_scores(log_scores, columns["geographic_popularity"], regions)
+            return [
+                {
+                    "trending_log_score": log_score,
+                    "trending_score": TrendingAlgorithm.decayed_score(log_score, current_time),
+                    "region_log_scores": song_region_scores
+                }
+                for log_score, song_region_scores in zip(log_scores.tolist(), region_scores)
+            ]
+
+        trending_scores = TrendingAlgorithm.calculate_trending_scores(**columns, current_time=current_time)
+        region_scores = TrendingAlgorithm._region_scores(trending_scores, columns["geographic_popularity"], regions)
+        return [
+            {"trending_score": trending_score, "region_scores": song_region_scores}
+            for trending_score, song_region_scores in zip(trending_scores.tolist(), region_scores)
+        ]
 
     @staticmethod
     def get_top_trending_songs(
@@ -81,8 +491,9 @@ class TrendingAlgorithm:
         ]
 
         # Calculate trending scores
-        for song in filtered_songs:
-            song.trending_score = TrendingAlgorithm.calculate_trending_score(song)
+        scores = TrendingAlgorithm.calculate_trending_scores_for_songs(filtered_songs)
+        for song, score in zip(filtered_songs, scores):
+            song.trending_score = score
 
         # Sort and return top songs
         return sorted(
@@ -0,0 +1,87 @@
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.models.song import Song, Genre
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TrendingIndex:
+    """
+    In-process top-K trending songs per genre plus an "all" list.
+
+    Each list is a sorted array of the top songs as ranked by the database, so pages
+    within the first K songs are served without any Mongo or Redis round trip.
+    """
+
+    def __init__(self, size: int = None, max_bytes: int = None):
+        self.size = size or settings.TRENDING_INDEX_SIZE
+        self.max_bytes = max_bytes or settings.TRENDING_INDEX_MAX_BYTES
+        self._lists: Dict[str, List[Song]] = {}
+        self._complete: Dict[str, bool] = {}
+        self.updated_at: Optional[datetime] = None
+
+    @staticmethod
+    def _key(genre: Optional[Genre]) -> str:
+        return genre.value if genre else "all"
+
+    async def build(self, db_service) -> None:
+        """
+        (Re)build every list from the database and swap it in atomically.
+
+        Args:
+            db_service (DatabaseService): Connected database service
+        """
+        lists = {}
+        for genre in [None] + list(Genre):
+            lists[self._key(genre)] = await db_service.get_top_trending_songs(self.size, 0, genre)
+
+        self.replace(lists)
+        logger.info(f"Trending index built with {sum(len(songs) for songs in lists.values())} songs")
+
+    def replace(self, lists: Dict[str, List[Song]]) -> None:
+        """
+        Replace the indexed lists, truncating them to stay within max_bytes.
+
+        Args:
+            lists (dict): Songs sorted by trending rank, keyed by genre value or "all"
+        """
+        songs = [song for genre_songs in lists.values() for song in genre_songs]
+        capacity = self.size
+        if songs:
+            # Approximate memory use from the serialized size of a sample of songs
+            sample = songs[:100]
+            song_bytes = sum(len(song.model_dump_json()) for song in sample) / len(sample)
+            capacity = min(capacity, int(self.max_bytes // (song_bytes * len(lists))))
+
+        indexed, complete = {}, {}
+        for key, genre_songs in lists.items():
+            indexed[key] = genre_songs[:capacity]
+            # A list shorter than the number of songs requested holds every song of its genre
+            complete[key] = len(genre_songs) < self.size and len(genre_songs) <= capacity
+
+        self._lists, self._complete = indexed, complete
+        self.updated_at = datetime.utcnow()
+
+    def get(self, limit: int, offset: int = 0, genre: Optional[Genre] = None) -> Optional[List[Song]]:
+        """
+        Retrieve a page of trending songs from the index.
+
+        Returns:
+            Optional list of songs, None if the page is not covered by the index
+        """
+        key = self._key(genre)
+        songs = self._lists.get(key)
+        if songs is None:
+            return None
+
+        if offset + limit > len(songs) and not self._complete[key]:
+            return None
+
+        return songs[offset:offset + limit]
+
+
+# Create a singleton trending index instance
+trending_index = TrendingIndex()
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from app.services.database import ACTIVE_SONGS, BulkWriter
+from app.services.trending_algorithm import TrendingAlgorithm
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Fields needed to compute trending scores
+SCORING_PROJECTION = {
+    "song_id": 1, "last_played_timestamp": 1, "play_count": 1,
+    "user_rating": 1, "social_media_shares": 1, "geographic_popularity": 1
+}
+
+# Documents sampled per shard to pick _id range boundaries
+SAMPLES_PER_SHARD = 100
+
+
+def score_batch(songs: List[dict], current_time: datetime) -> List[Dict[str, Any]]:
+    """
+    Score a batch of song documents, run in the worker processes of the job.
+    """
+    return TrendingAlgorithm.score_fields_for_songs(songs, current_time)
+
+
+class TrendingRecomputeJob:
+    """
+    Recomputes trending scores as a pipeline over _id ranges of the songs collection.
+
+    Every range is streamed concurrently, batches are scored in a process pool off the
+    event loop and written through a BulkWriter while the next ones are read and scored.
+    With the aggregation backend each range is instead scored by an aggregation pipeline
+    that merges the scores back into the collection, no song leaves the database.
+    """
+
+    # Job currently running or last run in this process, reported by the status endpoint
+    latest: Optional["TrendingRecomputeJob"] = None
+
+    def __init__(self, db_service, workers: int = None, batch_size: int = None, shards: int = None,
+                 backend: str = None):
+        self.db_service = db_service
+        self.backend = backend or settings.TRENDING_SCORE_BACKEND
+        self.workers = settings.TRENDING_JOB_WORKERS if workers is None else workers
+        self.batch_size = batch_size or settings.TRENDING_JOB_BATCH_SIZE
+        self.shards = shards or settings.TRENDING_JOB_SHARDS
+        self.progress: Dict[str, Any] = {"status": "pending", "processed": 0}
+
+    async def run(self, query: dict = None, current_time: datetime = None) -> int:
+        """
+        Rescore every active song matching query.
+
+        Args:
+            query (dict, optional): Filter of the songs to rescore. Defaults to all active songs.
+            current_time (datetime, optional): Reference time for the scores
+
+        Returns:
+            int: Number of songs rescored
+        """
+        # Delisted songs are never served, their scores are left as they are
+        query = {**ACTIVE_SONGS, **(query or {})}
+        current_time = current_time or datetime.utcnow()
+        collection = self.db_service.songs_collection
+        TrendingRecomputeJob.latest = self
+
+        total = await collection.count_documents(query)
+        ranges = await self._split_ranges(query, total)
+        self.progress = {
+            "status": "running",
+            "started_at": datetime.utcnow(),
+            "total": total,
+            "processed": 0,
+            "shards": len(ranges),
+            "shards_done": 0,
+        }
+        logger.info(f"Trending recompute started for {total} songs in {len(ranges)} shards ({self.backend})")
+
+        if self.backend == "aggregation":
+            try:
+                await asyncio.gather(*(self._merge_shard(query, lower, upper, current_time) for lower, upper in ranges))
+            except Exception:
+                self.progress["status"] = "failed"
+                raise
+
+            # $merge does not report counts, every matching song was rescored
+            self.progress.update(status="completed", processed=total, completed_at=datetime.utcnow())
+            logger.info(f"Trending recompute completed, {total} songs rescored")
+            return total
+
+        pool = None
+        if self.workers > 0:
+            # spawn rather than fork, the event loop and driver threads must not be copied
+            pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            # Writes of all shards are pipelined through one writer, which also bounds their concurrency
+            async with BulkWriter(collection, batch_size=self.batch_size, on_written=self._on_written) as writer:
+                await asyncio.gather(*(
+                    self._run_shard(pool, writer, query, lower, upper, current_time) for lower, upper in ranges
+                ))
+        except Exception:
+            self.progress["status"] = "failed"
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        self.progress.update(status="completed", completed_at=datetime.utcnow())
+        logger.info(f"Trending recompute completed, {self.progress['processed']} songs rescored")
+        return self.progress["processed"]
+
+    async def _split_ranges(self, query: dict, total: int) -> List[Tuple[Any, Any]]:
+        """
+        Split the songs matching query into _id ranges of roughly equal size.
+        """
+        shards = min(self.shards, max(total // self.batch_size, 1))
+        if shards <= 1:
+            return [(None, None)]
+
+        # Pick boundaries from a sample instead of sorting the whole collection
+        pipeline = [
+            {"$match": query},
+            {"$sample": {"size": shards * SAMPLES_PER_SHARD}},
+            {"$project": {"_id": 1}},
+            {"$bucketAuto": {"groupBy": "$_id", "buckets": shards}},
+        ]
+        buckets = await self.db_service.songs_collection.aggregate(pipeline).to_list(length=shards)
+        boundaries = sorted(bucket["_id"]["min"] for bucket in buckets)[1:]
+
+        return list(zip([None] + boundaries, boundaries + [None]))
+
+    @staticmethod
+    def _shard_query(query: dict, lower, upper) -> dict:
+        id_range = {}
+        if lower is not None:
+            id_range["$gte"] = lower
+        if upper is not None:
+            id_range["$lt"] = upper
+        return {**query, "_id": id_range} if id_range else query
+
+    async def _merge_shard(self, query: dict, lower, upper, current_time: datetime):
+        """
+        Score an _id range server-side and merge the score fields into the songs.
+        """
+        collection = self.db_service.songs_collection
+        score_stages = TrendingAlgorithm.score_pipeline(current_time)
+        score_fields = {field: 1 for stage in score_stages for field in stage["$set"]}
+
+        pipeline = [
+            {"$match": self._shard_query(query, lower, upper)},
+            {"$project": SCORING_PROJECTION},
+            *score_stages,
+            # Only the scores are merged, counters incremented meanwhile are left alone
+            {"$project": {"_id": 1, **score_fields}},
+            {"$merge": {"into": collection.name, "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+        ]
+        await collection.aggregate(pipeline).to_list(length=None)
+
+        self.progress["shards_done"] += 1
+
+    async def _run_shard(self, pool: Optional[Executor], writer: BulkWriter, query: dict, lower, upper,
+                         current_time: datetime):
+        cursor = self.db_service.songs_collection.find(
+            self._shard_query(query, lower, upper), SCORING_PROJECTION, batch_size=self.batch_size
+        )
+
+        batch = []
+        async for song in cursor:
+            batch.append(song)
+            if len(batch) >= self.batch_size:
+                await self._score_and_write(pool, writer, batch, current_time)
+                batch = []
+
+        if batch:
+            await self._score_and_write(pool, writer, batch, current_time)
+
+        self.progress["shards_done"] += 1
+
+    @staticmethod
+    async def _score_and_write(pool: Optional[Executor], writer: BulkWriter, songs: List[dict],
+                               current_time: datetime):
+        """
+        Score a batch and hand its updates to the writer, which writes them while
+        the next batch is read and scored.
+        """
+        if pool is not None:
+            score_fields = await asyncio.get_running_loop().run_in_executor(pool, score_batch, songs, current_time)
+        else:
+            score_fields = score_batch(songs, current_time)
+
+        await writer.add_many(
+            UpdateOne({"_id": song["_id"]}, {"$set": fields})
+            for song, fields in zip(songs, score_fields)
+        )
+
+    def _on_written(self, count: int):
+        self.progress["processed"] += count
+        logger.debug(f"Trending recompute progress: {self.progress['processed']}/{self.progress['total']}")
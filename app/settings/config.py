@@ -1,3 +1,5 @@
+from typing import List, Literal
+
 from pydantic_settings import BaseSettings
 
 
@@ -34,6 +36,103 @@ class Settings(BaseSettings):
     # Caching Settings
     CACHE_EXPIRATION: int = 300  # 5 minutes
 
+    # Seconds an expired trending page keeps being served while it is refreshed in the background
+    CACHE_STALE_TTL: int = 300
+
+    # Only one instance repopulates an expired key, the others wait for it
+    CACHE_LOCK_TIMEOUT_MS: int = 10000
+    CACHE_LOCK_WAIT_SECONDS: float = 2.0
+    CACHE_LOCK_POLL_INTERVAL: float = 0.05
+
+    # Cache entry codec and compression, see app.cache.codecs
+    # (msgpack, zstd and lz4 need their optional packages installed)
+    CACHE_CODEC: Literal["json", "msgpack"] = "json"
+    CACHE_COMPRESSION: Literal["none", "zlib", "zstd", "lz4"] = "zlib"
+    CACHE_COMPRESSION_MIN_BYTES: int = 1024
+
+    # Cached response bodies above this size are stored gzip compressed
+    RESPONSE_COMPRESSION_MIN_BYTES: int = 1024
+    RESPONSE_COMPRESSION_LEVEL: int = 6
+
+    # Process-local (L1) cache in front of Redis
+    LOCAL_CACHE_ENABLED: bool = False
+    LOCAL_CACHE_MAX_ENTRIES: int = 1024
+    LOCAL_CACHE_TTL: int = 30  # seconds, capped by the remaining Redis TTL
+    LOCAL_CACHE_INVALIDATION_CHANNEL: str = "cache:invalidate"
+
+    # Cache warming of the most requested trending pages, counted per (genre, limit, offset)
+    CACHE_WARM_PAGES: int = 100  # Most requested pages warmed after every trending update
+    CACHE_WARM_CONCURRENCY: int = 8  # Database queries in flight while warming
+    CACHE_DEMAND_FLUSH_SECONDS: int = 30  # Interval at which instances add their request counts in Redis
+    CACHE_DEMAND_DECAY: float = 0.5  # Weight of past request counts after every warming
+    CACHE_DEMAND_MAX_PAGES: int = 1000  # Pages whose request counts are kept
+
+    # Trending Score Update Settings
+    # "classic" stores trending_score as of the last update, "decay_invariant" also stores a
+    # time-independent trending_log_score that ranks songs correctly at any query time
+    TRENDING_SCORE_MODE: Literal["classic", "decay_invariant"] = "classic"
+    TRENDING_INCREMENTAL_UPDATES: bool = False  # Rescore only songs changed since the last run
+    TRENDING_FULL_RECOMPUTE_HOURS: int = 24  # Re-anchor all scores at least this often
+
+    # Trending recompute job: scoring processes (0 scores in the event loop), batch size and _id range shards
+    TRENDING_JOB_WORKERS: int = 4
+    TRENDING_JOB_BATCH_SIZE: int = 1000
+    TRENDING_JOB_SHARDS: int = 8
+    # "python" streams songs to the scoring processes, "aggregation" scores them inside MongoDB
+    # with an aggregation pipeline merged back into the songs collection
+    TRENDING_SCORE_BACKEND: Literal["python", "aggregation"] = "python"
+
+    # Bulk writer: concurrent batches, adaptive batch size bounds, latency target and retries
+    BULK_WRITE_MAX_IN_FLIGHT: int = 4
+    BULK_WRITE_BATCH_SIZE: int = 1000
+    BULK_WRITE_MIN_BATCH_SIZE: int = 100
+    BULK_WRITE_MAX_BATCH_SIZE: int = 10000
+    BULK_WRITE_TARGET_LATENCY: float = 0.5  # seconds per batch
+    BULK_WRITE_MAX_BATCH_BYTES: int = 8 * 1024 * 1024
+    BULK_WRITE_MAX_RETRIES: int = 3
+    BULK_WRITE_RETRY_BACKOFF: float = 0.1  # seconds, doubled on every retry
+
+    # Regions ranked on their own by /trending/songs?region=, from the geographic_popularity
+    # keys. Every region has its own indexes, adding one creates them at the next startup.
+    TRENDING_REGIONS: List[str] = ["US", "IN", "UK", "BR", "DE", "MX", "JP", "FR"]
+
+    # Read every page of a cursor pagination from one snapshot (needs a replica set)
+    TRENDING_SNAPSHOT_READS: bool = False
+
+    # In-process Trending Index Settings
+    TRENDING_INDEX_ENABLED: bool = True
+    TRENDING_INDEX_SIZE: int = 500  # Top K songs kept per genre
+    TRENDING_INDEX_MAX_BYTES: int = 50 * 1024 * 1024
+    TRENDING_INDEX_REFRESH_SECONDS: int = 60
+
+    # Redis Leaderboard Settings
+    # Sorted sets of the top songs per genre, serving any page within them from Redis
+    LEADERBOARD_ENABLED: bool = True
+    LEADERBOARD_SIZE: int = 1000  # Songs kept per genre
+    LEADERBOARD_TTL: int = 2 * 3600  # Seconds, outlives the hourly rebuild
+
+    # Change stream consumer on the songs collection (needs a replica set), run by the scheduler
+    # leader: moves rescored songs in the leaderboard and drops the cached pages of their genres
+    CHANGE_STREAM_ENABLED: bool = False
+    CHANGE_STREAM_DEBOUNCE_SECONDS: float = 2.0  # Changes within this window are applied together
+    CHANGE_STREAM_MAX_BATCH: int = 5000  # Changes applied together at most
+
+    # Song Event Ingestion Settings
+    # "memory" aggregates events per process and flushes them as bulk increments, "redis"
+    # buffers counters in Redis hashes that a scheduled job drains into MongoDB
+    INGESTION_BACKEND: Literal["memory", "redis"] = "memory"
+    INGESTION_FLUSH_INTERVAL: float = 1.0  # Seconds
+    INGESTION_MAX_PENDING_SONGS: int = 50000
+    INGESTION_MAX_BATCH_EVENTS: int = 10000  # Events accepted per request
+    INGESTION_RETRY_AFTER_SECONDS: int = 1
+    COUNTER_DRAIN_SECONDS: int = 10  # Interval of the Redis counter drain job
+    COUNTER_DRAIN_HISTORY: int = 16  # Drain ids remembered per song to skip replayed drains
+
+    # Scheduler Leader Election Settings
+    # Only the instance holding the Redis lease runs the trending update and counter drain jobs
+    LEADER_LEASE_TTL_MS: int = 30000  # Another instance takes over this long after the leader stopped
+    LEADER_HEARTBEAT_SECONDS: int = 10  # Keep well below the lease TTL
+
     # API Configuration
     API_V1_PREFIX: str = "/api/v1"
 
@@ -41,8 +140,24 @@ class Settings(BaseSettings):
     LOG_LEVEL: str = "INFO"
 
     # Performance Tuning
+    # MongoDB connection pool size per server, applied as maxPoolSize and minPoolSize
     MAX_CONNECTIONS_COUNT: int = 10
     MIN_CONNECTIONS_COUNT: int = 2
+    MONGODB_MAX_IDLE_TIME_MS: int = 60000
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS: int = 2000  # Fail a checkout instead of queueing forever
+    MONGODB_CONNECT_TIMEOUT_MS: int = 5000
+    MONGODB_SOCKET_TIMEOUT_MS: int = 10000
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+    # Read preference of the /trending/songs reads, secondaries serve them on a replica set
+    TRENDING_READ_PREFERENCE: Literal[
+        "primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"
+    ] = "secondaryPreferred"
+
+    # Redis connection pool, requests wait up to REDIS_POOL_TIMEOUT seconds for a free connection
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 2.0
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 2.0
 
     class Config:
         # Allows reading from .env file
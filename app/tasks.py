@@ -1,86 +1,227 @@
 import asyncio
 import logging
+from datetime import datetime, timedelta
+from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-import json
 
-from app.models.song import Genre
+from app.cache.cache_warmer import cache_warmer
+from app.cache.local_cache import TieredCache
 from app.services.database import DatabaseService
-from app.constants import EXPIRY_TIME
+from app.services.leader_election import scheduler_election
+from app.settings.config import settings
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+TRENDING_UPDATE_INTERVAL = timedelta(minutes=60)
+
 
 class TrendingScheduler:
+    """
+    Runs the periodic jobs of an instance.
+
+    Every instance schedules every job, but the trending update and the counter drain
+    only run on the instance elected leader through a Redis lease, see
+    app.services.leader_election. An instance taking over from a failed leader runs an
+    overdue trending update right away.
+    """
+
     def __init__(self):
         self.scheduler = AsyncIOScheduler()
+        self.election = scheduler_election
+        self._change_consumer: Optional[asyncio.Task] = None
 
     async def start(self):
         """
         Start the scheduler with a 60-minute interval job
         """
+        self.scheduler.add_job(
+            self._heartbeat,
+            trigger=IntervalTrigger(seconds=settings.LEADER_HEARTBEAT_SECONDS),
+            id='leader_heartbeat_job',
+            max_instances=1,
+            replace_existing=True,
+            next_run_time=datetime.now()  # Elect a leader right away
+        )
+
         self.scheduler.add_job(
             self._run_update,
-            trigger=IntervalTrigger(minutes=60),
+            trigger=IntervalTrigger(seconds=TRENDING_UPDATE_INTERVAL.total_seconds()),
             id='trending_update_job',
             max_instances=1,  # Prevent concurrent executions
             replace_existing=True
         )
 
+        if settings.TRENDING_INDEX_ENABLED:
+            # Every process keeps its own index, refresh it whichever process ran the update
+            self.scheduler.add_job(
+                self._refresh_index,
+                trigger=IntervalTrigger(seconds=settings.TRENDING_INDEX_REFRESH_SECONDS),
+                id='trending_index_refresh_job',
+                max_instances=1,
+                replace_existing=True
+            )
+
+        # Every instance counts its own requests of trending pages
+        self.scheduler.add_job(
+            self._flush_cache_demand,
+            trigger=IntervalTrigger(seconds=settings.CACHE_DEMAND_FLUSH_SECONDS),
+            id='cache_demand_flush_job',
+            max_instances=1,
+            replace_existing=True
+        )
+
+        if settings.INGESTION_BACKEND == "redis":
+            self.scheduler.add_job(
+                self._drain_counters,
+                trigger=IntervalTrigger(seconds=settings.COUNTER_DRAIN_SECONDS),
+                id='counter_drain_job',
+                max_instances=1,
+                replace_existing=True
+            )
+
         self.scheduler.start()
         logger.info("Trending data update scheduler started")
 
-    @staticmethod
-    async def _run_update():
+    async def stop(self):
+        """
+        Stop the scheduler and hand leadership over to another instance
         """
-        Wrapper method to run update_trending_data with error handling
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        if self._change_consumer is not None:
+            self._change_consumer.cancel()
+        await self.election.resign()
+
+    async def status(self) -> dict:
+        """
+        Leader election state and the next run of every job of this instance
+        """
+        return {
+            **await self.election.status(),
+            "jobs": {
+                job.id: job.next_run_time.isoformat() if job.next_run_time else None
+                for job in self.scheduler.get_jobs()
+            },
+        }
+
+    async def _heartbeat(self):
+        """
+        Renew or acquire the scheduler leadership, catching up on an overdue update after a takeover
         """
-        from app.api.endpoints import update_trending_data
+        was_leader = self.election.is_leader
+        is_leader = await self.election.heartbeat()
+        if is_leader and settings.CHANGE_STREAM_ENABLED:
+            self._ensure_change_consumer()
+        if not is_leader or was_leader:
+            return
+
+        from app.services.database import db_service
 
         try:
-            logger.info("Starting scheduled trending data update")
-            await update_trending_data()
-            logger.info("Trending data update completed successfully")
+            last_run = await db_service.get_trending_run()
+        except Exception as e:
+            logger.error(f"Error fetching the last trending data update: {e}")
+            return
+
+        if last_run is None or datetime.utcnow() - last_run["completed_at"] >= TRENDING_UPDATE_INTERVAL:
+            logger.info("Trending data update is overdue, running it now")
+            self.scheduler.modify_job('trending_update_job', next_run_time=datetime.now())
+
+    def _ensure_change_consumer(self):
+        """
+        Start the song change consumer on the leader, or restart it after it failed
+        """
+        from app.services.change_stream import song_change_consumer
+
+        task = self._change_consumer
+        if task is not None and not task.done():
+            return
+        if task is not None and not task.cancelled() and task.exception():
+            logger.error(f"Song change consumer failed, restarting it: {task.exception()}")
+
+        # Cancelled when this instance loses the leadership
+        self._change_consumer = asyncio.create_task(self.election.run_as_leader(song_change_consumer.run))
+
+    async def _run_update(self):
+        """
+        Wrapper method to run the trending update on the leader with error handling
+        """
+        await self.election.run_as_leader(self._update)
+
+    @staticmethod
+    async def _update(fencing_token: int):
+        from app.api.endpoints import run_trending_update
+        from app.services.database import db_service
+
+        try:
+            logger.info(f"Starting scheduled trending data update with fencing token {fencing_token}")
+            if await run_trending_update(db_service, fencing_token=fencing_token):
+                logger.info("Trending data update completed successfully")
         except Exception as e:
             logger.error(f"Error in scheduled trending data update: {e}")
 
+    @staticmethod
+    async def _refresh_index():
+        """
+        Rebuild the in-process trending index of this process
+        """
+        from app.services.database import db_service
+        from app.services.trending_index import trending_index
+
+        try:
+            await trending_index.build(db_service)
+        except Exception as e:
+            logger.error(f"Error refreshing trending index: {e}")
+
+    @staticmethod
+    async def _flush_cache_demand():
+        """
+        Add the trending page request counts of this process to the counts in Redis
+        """
+        try:
+            await cache_warmer.flush_demand()
+        except Exception as e:
+            logger.error(f"Error flushing trending page request counts: {e}")
+
+    async def _drain_counters(self):
+        """
+        Apply the song counters buffered in Redis to the database, on the leader
+        """
+        await self.election.run_as_leader(self._drain)
+
+    @staticmethod
+    async def _drain(fencing_token: int):
+        from app.services.ingestion import counter_buffer
+
+        try:
+            drained = await counter_buffer.drain()
+            if drained:
+                logger.info(f"Drained buffered counters of {drained} songs")
+        except Exception as e:
+            logger.error(f"Error draining buffered counters: {e}")
+
 
 async def refresh_trending_cache(db_service: DatabaseService, redis_cache):
     """
-    Background task to pre-compute and cache trending songs data.
+    Background task to pre-compute and cache the most requested trending pages.
     Runs independently after trending updates.
     """
 
     logger.info("Starting background refresh of trending songs cache")
-    genres = [None] + list(Genre)  # Include 'all' and each genre
-    limits = [100]  # Common limit values
-    offsets = [0]  # First page is most commonly accessed
-
-    for genre in genres:
-        for limit in limits:
-            for offset in offsets:
-                try:
-                    cache_key = f"trending_songs:{genre or 'all'}:{limit}:{offset}"
-
-                    # Fetch fresh data
-                    songs = await db_service.get_top_trending_songs(limit, offset, genre)
-
-                    if songs:
-                        serialized = json.dumps([song.model_dump() for song in songs], default=str)
-                        # Set with longer expiry for background-refreshed data
-                        await redis_cache.set(cache_key, serialized, expiration=EXPIRY_TIME)
-
-                    logger.debug(f"Refreshed cache for {cache_key}")
 
-                except Exception as e:
-                    logger.error(
-                        f"Failed to refresh cache for {genre or 'all'}, limit={limit}, offset={offset}: {str(e)}")
+    try:
+        warmed = await cache_warmer.warm(db_service, redis_cache)
+    except Exception as e:
+        logger.error(f"Failed to refresh trending songs cache: {str(e)}")
+        return
 
-                # Small delay to prevent overwhelming the database
-                await asyncio.sleep(0.1)
+    if isinstance(redis_cache, TieredCache):
+        # Drop the now outdated local copies on every instance
+        await redis_cache.invalidate_local()
 
-    logger.info("Completed background refresh of trending songs cache")
+    logger.info(f"Completed background refresh of trending songs cache, {warmed} pages cached")
 
 
 # Create scheduler instance
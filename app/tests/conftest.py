@@ -0,0 +1,572 @@
+"""
+In-memory doubles of MongoDB collections, Redis and the database service shared by the tests,
+and a scratch database for the tests that need the real server.
+
+They implement the subset of commands the application uses, with the semantics of the
+real servers where the tests depend on them (byte members of Redis, tie order of sorted
+sets, operator and pipeline updates of MongoDB).
+"""
+import asyncio
+import fnmatch
+import math
+from datetime import datetime
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+from app.models.song import Song
+from app.settings.config import settings
+
+
+@pytest.fixture
+async def scratch_database(request):
+    """Scratch database named after the test module, skips the test without a MongoDB server"""
+    client = AsyncIOMotorClient(settings.MONGODB_URL, serverSelectionTimeoutMS=1000)
+    try:
+        await client.admin.command("ping")
+    except ServerSelectionTimeoutError:
+        client.close()
+        pytest.skip("MongoDB is not available")
+
+    database = client[f"{settings.MONGODB_DB}_{request.module.__name__.rsplit('.', 1)[-1]}"]
+    yield database
+
+    await client.drop_database(database.name)
+    client.close()
+
+
+def _path(document, path):
+    for part in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def _assign(document, field, value):
+    *parents, leaf = field.split(".")
+    for parent in parents:
+        document = document.setdefault(parent, {})
+    document[leaf] = value
+
+
+def evaluate(expression, document, variables=None):
+    """Evaluates the aggregation expressions used by the scoring pipeline and the ingestion updates"""
+    variables = variables or {}
+    if isinstance(expression, str) and expression.startswith("$$"):
+        name, *path = expression[2:].split(".")
+        value = variables[name]
+        for part in path:
+            value = value[part]
+        return value
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _path(document, expression[1:])
+    if isinstance(expression, list):
+        return [evaluate(item, document, variables) for item in expression]
+    if not isinstance(expression, dict) or not expression:
+        return expression
+    if not next(iter(expression)).startswith("$"):
+        # Expression object, such as the {k, v} pairs of $arrayToObject
+        return {key: evaluate(value, document, variables) for key, value in expression.items()}
+
+    (operator, args), = expression.items()
+    if operator == "$let":
+        bound = {**variables, **{name: evaluate(value, document, variables) for name, value in args["vars"].items()}}
+        return evaluate(args["in"], document, bound)
+    if operator == "$map":
+        return [evaluate(args["in"], document, {**variables, "this": item})
+                for item in evaluate(args["input"], document, variables)]
+    if operator == "$filter":
+        return [item for item in evaluate(args["input"], document, variables)
+                if evaluate(args["cond"], document, {**variables, "this": item})]
+    if operator == "$cond":
+        condition, then, otherwise = args
+        return evaluate(then if evaluate(condition, document, variables) else otherwise, document, variables)
+
+    values = evaluate(args, document, variables)
+    if operator == "$add":
+        return sum(values)
+    if operator == "$subtract":
+        if isinstance(values[0], datetime):
+            # Date differences are in milliseconds
+            return (values[0] - values[1]).total_seconds() * 1000
+        return values[0] - values[1]
+    if operator == "$multiply":
+        return math.prod(values)
+    if operator == "$divide":
+        return values[0] / values[1]
+    if operator == "$pow":
+        return values[0] ** values[1]
+    if operator == "$ln":
+        return math.log(values)
+    if operator == "$log":
+        return math.log(values[0], values[1])
+    if operator in ("$max", "$sum"):
+        values = values[0] if operator == "$max" and len(values) == 1 and isinstance(values[0], list) else values
+        present = [value for value in values if value is not None]
+        if operator == "$sum":
+            return sum(present)
+        return max(present) if present else None
+    if operator == "$size":
+        return len(values)
+    if operator == "$gt":
+        # null sorts before numbers
+        return values[0] is not None and values[0] > values[1]
+    if operator == "$and":
+        return all(values)
+    if operator == "$ifNull":
+        return values[0] if values[0] is not None else values[1]
+    if operator == "$arrayToObject":
+        return {item["k"]: item["v"] for item in values}
+    if operator == "$objectToArray":
+        return [{"k": key, "v": value} for key, value in values.items()]
+    if operator == "$concatArrays":
+        return [item for value in values for item in value]
+    if operator == "$slice":
+        return values[0][values[1]:]
+    raise NotImplementedError(operator)
+
+
+def _matches_condition(value, condition) -> bool:
+    if not isinstance(condition, dict) or not all(key.startswith("$") for key in condition):
+        return value == condition
+    for operator, operand in condition.items():
+        if operator == "$ne":
+            # An array matches when no element equals the operand
+            if operand in (value if isinstance(value, list) else [value]):
+                return False
+        elif operator == "$exists":
+            if (value is not None) != operand:
+                return False
+        elif operator == "$gte" and not (value is not None and value >= operand):
+            return False
+        elif operator == "$gt" and not (value is not None and value > operand):
+            return False
+        elif operator == "$lt" and not (value is not None and value < operand):
+            return False
+        elif operator == "$lte" and not (value is not None and value <= operand):
+            return False
+        elif operator not in ("$ne", "$exists", "$gte", "$gt", "$lt", "$lte"):
+            raise NotImplementedError(operator)
+    return True
+
+
+def matches(document, query) -> bool:
+    """Match equality and comparison conditions on (dotted) fields"""
+    return all(_matches_condition(_path(document, field), condition) for field, condition in query.items())
+
+
+def make_song(index, genre, **fields) -> Song:
+    """Song ranked by its index"""
+    return Song(song_id=f"song-{index:02d}", title=f"Song {index}", artist="Artist", album="Album", genre=genre,
+                last_played_timestamp=datetime(2025, 3, 1), trending_score=float(index), **fields)
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+    async def to_list(self, length=None):
+        return self.documents[:length]
+
+
+class FakeChangeStream:
+    """Stand-in for a change stream, replaying queued change events"""
+
+    def __init__(self, changes, resume_after=None, error=None):
+        self.changes = list(changes)
+        self.resume_after = resume_after
+        self.resume_token = resume_after
+        self.error = error
+
+    async def __aenter__(self):
+        if self.error:
+            raise self.error
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def try_next(self):
+        if not self.changes:
+            await asyncio.sleep(0.01)
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = change["_id"]
+        return change
+
+
+class FakeSongsCollection:
+    """
+    Songs collection over in-memory documents keyed by _id (the song_id when missing).
+
+    Supports the reads of the recompute job, operator and pipeline updates in bulk writes,
+    the $merge of the aggregation backend and change streams replaying change_batches,
+    one batch per watch. Bulk writes raise once at the operation index crash_after.
+    """
+
+    name = "songs"
+
+    def __init__(self, documents=(), latency=0.0, crash_after=None, change_batches=(), watch_error=None):
+        self.documents = {}
+        for document in documents:
+            self.documents[document.setdefault("_id", document.get("song_id"))] = document
+        self.latency = latency
+        self.crash_after = crash_after
+        self.change_batches = list(change_batches)
+        self.watch_error = watch_error
+        self.streams = []
+        self.bulk_writes = 0
+        self.merges = 0
+
+    async def estimated_document_count(self):
+        return len(self.documents)
+
+    async def count_documents(self, query):
+        return sum(matches(document, query) for document in self.documents.values())
+
+    def find(self, query, projection=None, batch_size=None):
+        return FakeCursor([
+            dict(document) for _id, document in sorted(self.documents.items()) if matches(document, query)
+        ])
+
+    def aggregate(self, pipeline):
+        if "$merge" in pipeline[-1]:
+            return self._merge(pipeline)
+
+        ids = sorted(_id for _id, document in self.documents.items() if matches(document, pipeline[0]["$match"]))
+        buckets = pipeline[-1]["$bucketAuto"]["buckets"]
+        size = -(-len(ids) // buckets)
+        return FakeCursor([{"_id": {"min": ids[i], "max": ids[min(i + size, len(ids)) - 1]}}
+                           for i in range(0, len(ids), size)])
+
+    def _merge(self, pipeline):
+        match, project, *stages, output, merge = pipeline
+        assert merge["$merge"]["into"] == self.name and merge["$merge"]["whenNotMatched"] == "discard"
+        self.merges += 1
+
+        for document in self.documents.values():
+            if not matches(document, match["$match"]):
+                continue
+            scored = {field: document.get(field) for field in project["$project"]}
+            for stage in stages:
+                scored.update({field: evaluate(value, scored) for field, value in stage["$set"].items()})
+            document.update({field: scored[field] for field in output["$project"] if field != "_id"})
+
+        return FakeCursor([])
+
+    async def bulk_write(self, operations, ordered=True):
+        self.bulk_writes += 1
+        await asyncio.sleep(self.latency)
+        for index, operation in enumerate(operations):
+            if index == self.crash_after:
+                self.crash_after = None
+                raise RuntimeError("crashed")
+            for document in self.documents.values():
+                if matches(document, operation._filter):
+                    self._update(document, operation._doc)
+                    break
+
+    @staticmethod
+    def _update(document, update):
+        if isinstance(update, list):
+            for stage in update:
+                values = {field: evaluate(value, document) for field, value in stage["$set"].items()}
+                for field, value in values.items():
+                    _assign(document, field, value)
+            return
+
+        for field, value in update.get("$inc", {}).items():
+            _assign(document, field, (_path(document, field) or 0) + value)
+        for field, value in update.get("$max", {}).items():
+            _assign(document, field, max(_path(document, field) or value, value))
+        for field, value in update.get("$set", {}).items():
+            _assign(document, field, value)
+        for field, value in update.get("$push", {}).items():
+            document[field] = (document.get(field, []) + value["$each"])[value["$slice"]:]
+
+    def watch(self, pipeline, full_document=None, resume_after=None, max_await_time_ms=None):
+        error, self.watch_error = self.watch_error, None
+        changes = self.change_batches.pop(0) if self.change_batches and not error else []
+        stream = FakeChangeStream(changes, resume_after, error)
+        self.streams.append(stream)
+        return stream
+
+
+class FakeDatabaseService:
+    """
+    DatabaseService serving trending pages from songs ranked by trending_score, with a
+    songs collection, recorded trending runs, stored resume tokens and inserted chunks.
+    Page reads take latency seconds, running counts how many run at once.
+    """
+
+    def __init__(self, songs=(), songs_collection=None, resume_tokens=None, latency=0.0, trending_runs=()):
+        self.songs = sorted(songs, key=lambda song: song.trending_score, reverse=True)
+        self.songs_collection = songs_collection
+        self.trending_runs = list(trending_runs)
+        self.resume_tokens = dict(resume_tokens or {})
+        self.latency = latency
+        self.running = 0
+        self.max_running = 0
+        self.chunks = []
+
+    async def get_top_trending_songs(self, limit=100, offset=0, genre=None):
+        songs = [song for song in self.songs if genre is None or song.genre == genre]
+        return songs[offset:offset + limit]
+
+    async def get_top_trending_documents(self, limit=100, offset=0, genre=None, region=None, serving=False):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.latency)
+            songs = await self.get_top_trending_songs(limit, offset, genre)
+        finally:
+            self.running -= 1
+        return [song.model_dump(mode="json") for song in songs]
+
+    async def insert_song_documents(self, documents):
+        self.chunks.append(documents)
+        return len(documents)
+
+    async def get_trending_run(self):
+        return self.trending_runs[-1] if self.trending_runs else None
+
+    async def record_trending_run(self, started_at, anchor_time, incremental, fencing_token=None):
+        self.trending_runs.append({"started_at": started_at, "anchor_time": anchor_time, "incremental": incremental})
+        return True
+
+    async def get_resume_token(self, stream):
+        return self.resume_tokens.get(stream)
+
+    async def save_resume_token(self, stream, resume_token):
+        self.resume_tokens[stream] = resume_token
+
+
+class FakeRedis:
+    """Hashes, sets, sorted sets and strings as dicts, with byte members like the real client"""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.scans = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def scan_iter(self, match="*", count=None):
+        self.scans.append(match)
+        for key in list(self.data):
+            if fnmatch.fnmatchcase(key, match):
+                yield key.encode()
+
+    async def unlink(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.ttls.pop(key, None)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.ttls[key] = ex
+
+    async def setex(self, key, seconds, value):
+        await self.set(key, value, ex=seconds)
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+    async def exists(self, key):
+        return int(key in self.data)
+
+    async def rename(self, key, new_key):
+        if key not in self.data:
+            raise KeyError("no such key")
+        self.data[new_key] = self.data.pop(key)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def hincrby(self, key, field, amount):
+        fields = self.data.setdefault(key, {})
+        fields[field.encode()] = fields.get(field.encode(), 0) + amount
+
+    hincrbyfloat = hincrby
+
+    async def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update({
+            field.encode(): value.encode() if isinstance(value, str) else value for field, value in mapping.items()
+        })
+
+    async def hdel(self, key, *fields):
+        hash_fields = self.data.get(key, {})
+        removed = [field for field in fields if hash_fields.pop(_encode(field), None) is not None]
+        return len(removed)
+
+    async def hgetall(self, key):
+        return {
+            field: value if isinstance(value, bytes) else str(value).encode()
+            for field, value in self.data.get(key, {}).items()
+        }
+
+    async def hmget(self, key, fields):
+        return [self.data.get(key, {}).get(_encode(field)) for field in fields]
+
+    async def sadd(self, key, member):
+        self.data.setdefault(key, set()).add(member.encode())
+
+    async def srem(self, key, member):
+        self.data.get(key, set()).discard(member.encode())
+
+    async def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    async def zadd(self, key, mapping, gt=False):
+        scores = self.data.setdefault(key, {})
+        for member, score in mapping.items():
+            member = member.encode()
+            scores[member] = max(scores.get(member, score), score) if gt else score
+
+    async def zincrby(self, key, amount, member):
+        scores = self.data.setdefault(key, {})
+        scores[member.encode()] = scores.get(member.encode(), 0) + amount
+
+    async def zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    async def zmscore(self, key, members):
+        return [self.data.get(key, {}).get(_encode(member)) for member in members]
+
+    def _ranked(self, key, reverse=False):
+        # Ties are ordered by member, reversed along with the scores
+        return sorted(self.data.get(key, {}).items(), key=lambda item: (item[1], item[0]), reverse=reverse)
+
+    @staticmethod
+    def _slice(ranked, start, end):
+        return ranked[start:len(ranked) + end + 1 if end < 0 else end + 1]
+
+    async def zrange(self, key, start, end, withscores=False):
+        ranked = self._slice(self._ranked(key), start, end)
+        return ranked if withscores else [member for member, _ in ranked]
+
+    async def zrevrange(self, key, start, end, withscores=False):
+        ranked = self._slice(self._ranked(key, reverse=True), start, end)
+        return ranked if withscores else [member for member, _ in ranked]
+
+    async def zremrangebyrank(self, key, start, end):
+        removed = self._slice(self._ranked(key), start, end)
+        for member, _ in removed:
+            del self.data[key][member]
+        return len(removed)
+
+    async def zunionstore(self, key, weights):
+        self.data[key] = {
+            member: score * weight for source, weight in weights.items()
+            for member, score in self.data.get(source, {}).items()
+        }
+
+
+def _encode(value):
+    return value.encode() if isinstance(value, str) else value
+
+
+class FakePipeline:
+    """Buffers commands until execute, running them right away between watch and multi"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+        self.watching = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def watch(self, *keys):
+        self.watching = True
+
+    def multi(self):
+        self.watching = False
+
+    def __getattr__(self, name):
+        if self.watching:
+            return getattr(self.redis, name)
+        return lambda *args, **kwargs: self.commands.append((getattr(self.redis, name), args, kwargs))
+
+    async def execute(self, raise_on_error=True):
+        results = []
+        for command, args, kwargs in self.commands:
+            try:
+                results.append(await command(*args, **kwargs))
+            except KeyError as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+
+class FakeCache:
+    """RedisCache over a FakeRedis client, recording bulk page writes and pattern deletes"""
+
+    def __init__(self):
+        self.client = FakeRedis()
+        self.writes = []
+        self.deleted_patterns = []
+
+    async def set_many_raw(self, entries, expiration=None, soft_expiration=None):
+        self.writes.append(entries)
+
+    async def delete_matching(self, *patterns):
+        self.deleted_patterns.append(patterns)
+        return []
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeLease:
+    """In-memory lease with the semantics of the Redis scripts, expiring on a fake clock"""
+
+    def __init__(self, clock, ttl_ms=30000):
+        self.clock = clock
+        self.ttl_ms = ttl_ms
+        self.owner = None
+        self.token = 0
+        self.expires_at = 0.0
+        self.available = True
+
+    async def heartbeat(self, owner):
+        if not self.available:
+            raise ConnectionError("Redis is unreachable")
+        if self.owner is not None and self.clock() >= self.expires_at:
+            self.owner = None
+        if self.owner is None:
+            self.owner, self.token = owner, self.token + 1
+        elif self.owner != owner:
+            return None
+        self.expires_at = self.clock() + self.ttl_ms / 1000
+        return self.token
+
+    async def release(self, owner):
+        if self.owner == owner:
+            self.owner = None
+
+    async def holder(self):
+        return {"owner": self.owner, "token": self.token} if self.owner else None
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure
+from app.services.database import BulkWriter, BulkWriterError
+
+
+class FakeCollection:
+    """Records bulk writes, failing the operations listed in fail_once on their first attempt."""
+
+    def __init__(self, latency=0.0, fail_once=(), fatal=(), disconnect_once=False, error=None):
+        self.latency = latency
+        self.error = error
+        self.fail_once = set(fail_once)
+        self.fatal = set(fatal)
+        self.disconnect_once = disconnect_once
+        self.applied = []
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def bulk_write(self, operations, ordered=True):
+        assert not ordered, "Writes should be unordered"
+        self.batches.append(len(operations))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+        if self.error:
+            raise self.error
+        if self.disconnect_once:
+            self.disconnect_once = False
+            raise AutoReconnect("connection reset")
+
+        errors = []
+        for index, operation in enumerate(operations):
+            song_id = operation._filter["song_id"]
+            if song_id in self.fatal:
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+            elif song_id in self.fail_once:
+                self.fail_once.discard(song_id)
+                errors.append({"index": index, "code": 112, "errmsg": "write conflict"})
+            else:
+                self.applied.append(song_id)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+def operations(count):
+    return [UpdateOne({"song_id": str(i)}, {"$set": {"trending_score": float(i)}}) for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_writes_are_pipelined_and_retried():
+    """Test batches run concurrently and transient failures are retried"""
+    collection = FakeCollection(latency=0.01, fail_once={"3", "42"})
+    written = []
+
+    async with BulkWriter(collection, max_in_flight=3, batch_size=10, min_batch_size=10,
+                          on_written=written.append) as writer:
+        await writer.add_many(operations(100))
+
+    assert sorted(collection.applied, key=int) == [str(i) for i in range(100)]
+    assert collection.max_in_flight == 3
+    assert writer.retried == 2
+    assert sum(written) == writer.written == 100
+
+
+@pytest.mark.asyncio
+async def test_batch_size_adapts_to_latency():
+    """Test slow batches shrink the batch size and fast ones grow it"""
+    slow = BulkWriter(FakeCollection(latency=0.05), max_in_flight=1, batch_size=400, min_batch_size=50,
+                      target_latency=0.01)
+    await slow.add_many(operations(1000))
+    await slow.flush()
+    assert slow.batch_size < 400
+
+    fast = BulkWriter(FakeCollection(), max_in_flight=1, batch_size=100, max_batch_size=1000)
+    await fast.add_many(operations(1000))
+    await fast.flush()
+    assert fast.batch_size > 100
+
+    capped = BulkWriter(FakeCollection(), batch_size=100, min_batch_size=1, max_batch_bytes=10000)
+    await capped.add_many(operations(200))
+    await capped.flush()
+    assert capped.batch_size < 100, "Batch size should stay within max_batch_bytes"
+
+
+@pytest.mark.asyncio
+async def test_unrecoverable_failures_are_reported():
+    """Test non-retryable errors and non-idempotent network failures are raised on flush"""
+    writer = BulkWriter(FakeCollection(fatal={"7"}), batch_size=10)
+    await writer.add_many(operations(20))
+    with pytest.raises(BulkWriterError) as error:
+        await writer.flush()
+    assert [operation._filter["song_id"] for operation in error.value.failed_operations] == ["7"]
+
+    collection = FakeCollection(disconnect_once=True)
+    idempotent = BulkWriter(collection, batch_size=10)
+    await idempotent.add_many(operations(10))
+    await idempotent.flush()
+    assert len(collection.applied) == 10
+
+    not_idempotent = BulkWriter(FakeCollection(disconnect_once=True), batch_size=10, idempotent=False)
+    await not_idempotent.add_many(operations(10))
+    with pytest.raises(BulkWriterError):
+        await not_idempotent.flush()
+
+
+@pytest.mark.asyncio
+async def test_unexpected_errors_of_finished_batches_are_reported():
+    """Test errors outside the retried ones fail their batch on flush, even once the batch finished"""
+    writer = BulkWriter(FakeCollection(error=OperationFailure("invalid update", code=2)), batch_size=10)
+    await writer.add_many(operations(10))
+    # Let the batch fail before flushing
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(BulkWriterError) as error:
+        await writer.flush()
+    assert len(error.value.failed_operations) == 10
+    assert writer.written == 0
@@ -0,0 +1,114 @@
+import fnmatch
+import gzip
+import json
+
+import pytest
+from app.cache import codecs
+from app.cache import response_cache
+from app.cache.response_cache import (
+    build_response, dump_songs, encode_response_body, trending_cache_key, trending_cache_pattern
+)
+from app.services.data_generator import DataGenerator
+from app.services.database import DatabaseService
+
+
+def test_response_body_round_trip():
+    """Test cached response bodies match FastAPI serialization and honor Accept-Encoding"""
+    songs = DataGenerator.generate_songs(num_songs=50)
+    body = encode_response_body(songs)
+
+    assert codecs.read_entry(body)[2] == codecs.COMPRESSION_GZIP, "Large bodies should be stored compressed"
+    expected = [json.loads(song.model_dump_json()) for song in songs]
+
+    plain = build_response(body, accept_encoding="")
+    assert "content-encoding" not in plain.headers
+    assert json.loads(plain.body) == expected
+
+    compressed = build_response(body, accept_encoding="gzip, deflate")
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(compressed.body)) == expected
+    assert plain.headers["vary"] == compressed.headers["vary"] == "Accept-Encoding"
+
+    for accept_encoding in ["gzip;q=0", "br, gzip; q=0.0", "*;q=0", "identity", "gzip;q=x"]:
+        assert "content-encoding" not in build_response(body, accept_encoding).headers, accept_encoding
+    for accept_encoding in ["GZIP", "br;q=1.0, gzip;q=0.5", "*", "identity;q=1, *;q=0.1"]:
+        assert build_response(body, accept_encoding).headers["content-encoding"] == "gzip", accept_encoding
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_song_documents_serialize_like_models(monkeypatch, use_orjson):
+    """Test the validation-free document path produces the same JSON as the Song models"""
+    if not use_orjson:
+        monkeypatch.setattr(response_cache, "orjson", None)
+    songs = DataGenerator.generate_songs(num_songs=20)
+    documents = [song.model_dump() for song in songs]
+
+    assert json.loads(dump_songs(documents)) == json.loads(dump_songs(songs))
+    assert [DatabaseService._construct_song(document) for document in documents] == songs
+
+
+def test_small_response_body_is_not_compressed():
+    """Test bodies below the compression threshold are stored as plain JSON"""
+    assert codecs.read_entry(encode_response_body([])) == (b"[]", codecs.CODEC_RAW, codecs.COMPRESSION_NONE)
+
+
+def test_legacy_response_bodies_are_served():
+    """Test response bodies cached before entries carried a header"""
+    assert json.loads(build_response(b"[]").body) == []
+    assert json.loads(build_response(gzip.compress(b"[1]")).body) == [1]
+
+
+def test_double_encoded_pages_are_never_read():
+    """Test pages cached as JSON strings under the former keys are neither read nor matched"""
+    legacy_key = "trending_songs:all:100:0"
+    assert trending_cache_key(None, 100, 0) != legacy_key
+    assert not fnmatch.fnmatchcase(legacy_key, trending_cache_pattern(None))
+
+
+@pytest.mark.parametrize("codec", ["json", "msgpack"])
+@pytest.mark.parametrize("compression", ["none", "zlib", "zstd", "lz4"])
+def test_codec_round_trip(codec, compression):
+    """Test every codec and compression combination decodes to the original value"""
+    if codec == "msgpack":
+        pytest.importorskip("msgpack")
+    if compression in ("zstd", "lz4"):
+        pytest.importorskip({"zstd": "zstandard", "lz4": "lz4"}[compression])
+
+    value = [song.model_dump(mode="json") for song in DataGenerator.generate_songs(num_songs=20)]
+    entry = codecs.encode_entry(value, codec=codec, compression=compression, min_compress_bytes=0)
+
+    assert codecs.read_entry(entry)[1:] == (codecs.CODECS[codec], codecs.COMPRESSIONS[compression])
+    assert codecs.decode_entry(entry) == value
+
+
+def test_msgpack_codec_preserves_datetimes():
+    """Test msgpack entries keep datetimes instead of turning them into strings"""
+    pytest.importorskip("msgpack")
+    value = {"songs": [song.model_dump() for song in DataGenerator.generate_songs(num_songs=5)]}
+    for song in value["songs"]:
+        song["genre"] = song["genre"].value
+
+    entry = codecs.encode_entry(value, codec="msgpack", compression="none")
+    assert codecs.decode_entry(entry) == value
+
+
+def test_legacy_json_entries_are_decoded():
+    """Test values written before entries carried a header are read as JSON"""
+    assert codecs.decode_entry(b'{"plays": 1000}') == {"plays": 1000}
+
+
+def test_soft_expiration_marks_entries_stale():
+    """Test entries report staleness after their soft expiration only"""
+    fresh = codecs.encode_entry({"plays": 1}, soft_expiration=60)
+    expired = codecs.with_soft_expiration(fresh, -1)
+
+    assert not codecs.is_stale(fresh)
+    assert codecs.is_stale(expired)
+    assert codecs.decode_entry(expired) == {"plays": 1}
+    assert not codecs.is_stale(codecs.encode_entry({"plays": 1})), "Entries without soft expiry never go stale"
+    assert not codecs.is_stale(b'{"plays": 1}')
+
+    body = codecs.with_soft_expiration(encode_response_body(DataGenerator.generate_songs(num_songs=50)), -1)
+    response = build_response(body, cache_status="STALE")
+    assert response.headers["x-cache"] == "STALE"
+    assert len(json.loads(response.body)) == 50
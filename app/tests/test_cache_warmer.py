@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from app.cache.cache_warmer import DEMAND_KEY, CacheWarmer
+from app.cache.codecs import is_stale
+from app.cache.local_cache import LocalCache, TieredCache
+from app.cache.redis_cache import RedisCache
+from app.constants import EXPIRY_TIME
+from app.models.song import Genre
+from app.settings.config import settings
+from app.tests.conftest import FakeCache, FakeDatabaseService, FakeRedis, make_song
+
+
+def catalogue():
+    """100 songs of every genre"""
+    return [make_song(i, list(Genre)[i % len(Genre)]) for i in range(100 * len(Genre))]
+
+
+@pytest.mark.asyncio
+async def test_most_requested_pages_are_warmed_in_one_write():
+    """Test the most requested pages are queried concurrently and written together"""
+    cache = FakeCache()
+    db_service = FakeDatabaseService(catalogue(), latency=0.01)
+    warmer = CacheWarmer(cache, pages=3, concurrency=2)
+
+    for _ in range(5):
+        warmer.record(Genre.POP, 20, 40)
+    for _ in range(3):
+        warmer.record(None, 50, 500)
+    warmer.record(Genre.ROCK, 10, 0)
+    warmer.record(Genre.ROCK, 10, 0)
+    warmer.record(Genre.JAZZ, 10, 0)
+
+    assert await warmer.warm(db_service) == 3
+    assert db_service.max_running == 2
+
+    assert len(cache.writes) == 1
+    entries = cache.writes[0]
+    assert set(entries) == {"trending_pages:Pop:20:40", "trending_pages:all:50:500", "trending_pages:Rock:10:0"}
+
+    # Counts are decayed after warming, new demand takes over
+    assert cache.client.data[DEMAND_KEY][b"Pop|20|40"] == 2.5
+    for _ in range(3):
+        warmer.record(Genre.JAZZ, 10, 0)
+    await warmer.flush_demand()
+    assert (await warmer.hot_pages())[0] == (Genre.JAZZ, 10, 0)
+
+
+@pytest.mark.asyncio
+async def test_first_pages_are_warmed_without_demand():
+    """Test the first page of every genre is warmed before any request was counted"""
+    cache = FakeCache()
+    warmer = CacheWarmer(cache, concurrency=4)
+
+    assert await warmer.warm(FakeDatabaseService(catalogue())) == len(Genre) + 1
+    assert "trending_pages:all:100:0" in cache.writes[0]
+
+
+@pytest.mark.asyncio
+async def test_warmed_pages_go_stale_before_they_expire():
+    """Test warmed pages carry the soft expiry in Redis and in the local cache"""
+    backend = RedisCache()
+    backend._redis = FakeRedis()
+    page_cache = TieredCache(backend, LocalCache(max_entries=100, ttl=60), enabled=True)
+    warmer = CacheWarmer(FakeCache(), pages=1)
+    warmer.record(Genre.POP, 10, 0)
+
+    assert await warmer.warm(FakeDatabaseService(catalogue()), page_cache) == 1
+
+    key = "trending_pages:Pop:10:0"
+    body = backend.client.data[key]
+    assert backend.client.ttls[key] == EXPIRY_TIME + settings.CACHE_STALE_TTL
+    assert not is_stale(body)
+    assert is_stale(body, now=time.time() + EXPIRY_TIME + 1)
+    assert page_cache.local.get(key) == (True, body)
+
+
+@pytest.mark.asyncio
+async def test_demand_is_bounded_between_warmings():
+    """Test the local and shared counts keep the most requested pages only"""
+    cache = FakeCache()
+    warmer = CacheWarmer(cache, max_pages=3)
+
+    for _ in range(5):
+        warmer.record(Genre.POP, 10, 0)
+    for offset in range(100):
+        warmer.record(Genre.ROCK, 10, offset)
+        assert len(warmer._demand) <= 6
+    assert warmer._demand["Pop|10|0"] == 5
+
+    await warmer.flush_demand()
+    assert len(cache.client.data[DEMAND_KEY]) == 3
+    assert (await warmer.hot_pages())[0] == (Genre.POP, 10, 0)
@@ -0,0 +1,192 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from app.constants import SCORE_MODE_CLASSIC, SCORE_MODE_DECAY_INVARIANT
+from app.models.song import Genre
+from app.services import change_stream
+from app.services.change_stream import STREAM_NAME, SongChangeConsumer
+from app.services.leader_election import LeaderElection
+from app.settings.config import settings
+from app.tasks import TrendingScheduler
+from app.tests.conftest import FakeCache, FakeClock, FakeDatabaseService, FakeLease, FakeSongsCollection
+
+
+class FakeLeaderboard:
+    def __init__(self, size=1000):
+        self.size = size
+        self.updates = []
+        self.builds = 0
+        self.tokens_at_build = []
+
+    async def update_songs(self, songs):
+        self.updates.append(songs)
+        return True
+
+    async def build(self, db_service):
+        self.builds += 1
+        self.tokens_at_build.append(db_service.resume_tokens.get(STREAM_NAME))
+
+
+def song_change(token, song_id, genre, score, operation="update", **fields):
+    document = {
+        "song_id": song_id, "title": "Title", "artist": "Artist", "album": "Album", "genre": genre.value,
+        "last_played_timestamp": datetime(2025, 3, 1), "trending_score": score, "is_active": True, **fields
+    }
+    return {
+        "_id": {"_data": token},
+        "operationType": operation,
+        "documentKey": {"_id": song_id},
+        "updateDescription": {"updatedFields": {}},
+        "fullDocument": document,
+    }
+
+
+@pytest.mark.parametrize("score_mode", [SCORE_MODE_CLASSIC, SCORE_MODE_DECAY_INVARIANT])
+def test_rescores_of_the_trending_job_are_not_consumed(monkeypatch, score_mode):
+    """Test only updates of the fields that move songs between trending updates are selected"""
+    monkeypatch.setattr(settings, "TRENDING_SCORE_MODE", score_mode)
+    conditions = SongChangeConsumer.pipeline()[0]["$match"]["$or"]
+
+    updated_fields = {key.rsplit(".", 1)[-1] for condition in conditions for key in condition if "." in key}
+    assert updated_fields == {"genre", "is_active"}
+    assert {"operationType": {"$in": ["insert", "replace", "delete"]}} in conditions
+
+
+async def consume_until(consumer, condition):
+    task = asyncio.create_task(consumer.run())
+    try:
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if condition():
+                break
+        if task.done():
+            task.result()
+    finally:
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_burst_of_changes_is_applied_once_to_the_affected_genres():
+    """Test changes within the debounce window patch the leaderboard and drop only affected pages"""
+    changes = [
+        song_change("1", "a", Genre.POP, 1.0),
+        song_change("2", "b", Genre.ROCK, 2.0),
+        song_change("3", "a", Genre.POP, 3.0),
+    ]
+    db_service = FakeDatabaseService(songs_collection=FakeSongsCollection(change_batches=[changes]))
+    leaderboard, cache = FakeLeaderboard(), FakeCache()
+    consumer = SongChangeConsumer(db_service, leaderboard, cache, debounce_seconds=0.05)
+
+    await consume_until(consumer, lambda: db_service.resume_tokens.get(STREAM_NAME) == {"_data": "3"})
+
+    assert consumer.applied == 3
+    assert len(leaderboard.updates) == 1 and leaderboard.builds == 0
+    assert {song.song_id: song.trending_score for song in leaderboard.updates[0]} == {"a": 3.0, "b": 2.0}
+    assert len(cache.deleted_patterns) == 1
+    assert sorted(cache.deleted_patterns[0]) == ["trending_pages:Pop:*", "trending_pages:Rock:*",
+                                                 "trending_pages:all:*"]
+    assert db_service.resume_tokens.get(STREAM_NAME) == {"_data": "3"}
+
+
+@pytest.mark.asyncio
+async def test_songs_leaving_a_ranking_rebuild_the_leaderboard():
+    """Test delisted and deleted songs trigger a rebuild and drop the pages of every genre"""
+    changes = [song_change("1", "a", Genre.POP, 1.0, is_active=False)]
+    deleted = {"_id": {"_data": "2"}, "operationType": "delete", "documentKey": {"_id": "b"}}
+    db_service = FakeDatabaseService(songs_collection=FakeSongsCollection(change_batches=[changes + [deleted]]))
+    leaderboard, cache = FakeLeaderboard(), FakeCache()
+    consumer = SongChangeConsumer(db_service, leaderboard, cache, debounce_seconds=0.05)
+
+    await consume_until(consumer, lambda: consumer.applied == 2)
+
+    assert leaderboard.builds == 1 and leaderboard.updates == []
+    assert len(cache.deleted_patterns) == 1 and len(cache.deleted_patterns[0]) == len(Genre) + 1
+
+
+@pytest.mark.asyncio
+async def test_bulk_rescores_are_collapsed_into_one_rebuild():
+    """Test batches rescoring a leaderboard worth of songs rebuild it once the stream is idle"""
+    changes = [song_change(str(i), f"song-{i}", Genre.POP, float(i)) for i in range(1, 6)]
+    db_service = FakeDatabaseService(songs_collection=FakeSongsCollection(change_batches=[changes]))
+    leaderboard, cache = FakeLeaderboard(size=3), FakeCache()
+    consumer = SongChangeConsumer(db_service, leaderboard, cache, debounce_seconds=0.05, max_batch=3)
+
+    await consume_until(consumer, lambda: db_service.resume_tokens.get(STREAM_NAME) == {"_data": "5"})
+
+    # The second batch is smaller but folded into the pending rebuild
+    assert consumer.applied == 5 and not consumer.rebuild_pending
+    assert leaderboard.builds == 1 and leaderboard.updates == []
+    assert len(cache.deleted_patterns) == 1 and len(cache.deleted_patterns[0]) == len(Genre) + 1
+    # The token is only stored once the rebuild is done, a restart replays the bulk changes
+    assert leaderboard.tokens_at_build == [None]
+
+
+@pytest.mark.asyncio
+async def test_restart_resumes_from_the_stored_token():
+    """Test a new consumer resumes after the last applied change"""
+    collection = FakeSongsCollection(change_batches=[
+        [song_change("1", "a", Genre.POP, 1.0)], [song_change("2", "a", Genre.POP, 2.0)]
+    ])
+    db_service = FakeDatabaseService(songs_collection=collection)
+    leaderboard = FakeLeaderboard()
+
+    first = SongChangeConsumer(db_service, leaderboard, FakeCache(), debounce_seconds=0.05)
+    await consume_until(first, lambda: db_service.resume_tokens.get(STREAM_NAME) == {"_data": "1"})
+    second = SongChangeConsumer(db_service, leaderboard, FakeCache(), debounce_seconds=0.05)
+    await consume_until(second, lambda: second.applied == 1)
+
+    assert collection.streams[0].resume_after is None
+    assert collection.streams[1].resume_after == {"_data": "1"}
+    assert [songs[0].trending_score for songs in leaderboard.updates] == [1.0, 2.0]
+
+
+@pytest.mark.asyncio
+async def test_lost_history_rebuilds_and_starts_over():
+    """Test a token that fell out of the oplog rebuilds everything once and watches from now"""
+    history_lost = OperationFailure("Resume of change stream was not possible", code=286)
+    collection = FakeSongsCollection(change_batches=[[song_change("5", "a", Genre.POP, 1.0)]], watch_error=history_lost)
+    db_service = FakeDatabaseService(songs_collection=collection, resume_tokens={STREAM_NAME: {"_data": "0"}})
+    leaderboard = FakeLeaderboard()
+    consumer = SongChangeConsumer(db_service, leaderboard, FakeCache(), debounce_seconds=0.05)
+
+    await consume_until(consumer, lambda: db_service.resume_tokens.get(STREAM_NAME) == {"_data": "5"})
+
+    assert leaderboard.builds == 1 and consumer.applied == 1
+    assert [stream.resume_after for stream in collection.streams] == [{"_data": "0"}, None]
+    assert db_service.resume_tokens.get(STREAM_NAME) == {"_data": "5"}
+
+
+@pytest.mark.asyncio
+async def test_scheduler_runs_the_consumer_on_the_leader_only(monkeypatch):
+    """Test the scheduler leader starts the consumer with its fencing token and stops it on step-down"""
+    changes = [song_change("1", "a", Genre.POP, 1.0)]
+    db_service = FakeDatabaseService(songs_collection=FakeSongsCollection(change_batches=[changes]))
+    consumer = SongChangeConsumer(db_service, FakeLeaderboard(), FakeCache(), debounce_seconds=0.05)
+    monkeypatch.setattr(change_stream, "song_change_consumer", consumer)
+
+    clock = FakeClock()
+    lease = FakeLease(clock)
+    scheduler = TrendingScheduler()
+    scheduler.election = LeaderElection(lease, "leader", clock=clock)
+    assert await scheduler.election.heartbeat()
+
+    scheduler._ensure_change_consumer()
+    task = scheduler._change_consumer
+    for _ in range(200):
+        await asyncio.sleep(0.01)
+        if consumer.applied:
+            break
+    assert consumer.applied == 1 and not task.done()
+
+    # Still running, not restarted
+    scheduler._ensure_change_consumer()
+    assert scheduler._change_consumer is task
+
+    lease.available = False
+    clock.now = 31
+    await scheduler.election.heartbeat()
+    with pytest.raises(asyncio.CancelledError):
+        await task
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pytest
+
+from app.models.song import Song
+from app.services.data_generator import DataGenerator
+from app.tests.conftest import FakeDatabaseService
+
+NOW = datetime(2025, 3, 1)
+
+
+def test_song_documents_are_valid_and_reproducible():
+    """Test chunks are valid songs and identical for the same seed"""
+    chunks = list(DataGenerator.generate_song_documents(2500, seed=7, chunk_size=1000, current_time=NOW))
+
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+    for document in chunks[0][:50]:
+        Song.model_validate(document)
+
+    assert DataGenerator.generate_song_chunk(1, 1000, 2500, 7, NOW) == chunks[1]
+    assert DataGenerator.generate_song_chunk(1, 1000, 2500, 8, NOW) != chunks[1]
+
+
+def test_song_documents_are_skewed():
+    """Test play counts and artists are long tailed"""
+    songs = DataGenerator.generate_song_chunk(0, 20000, 20000, 1, NOW)
+
+    play_counts = sorted((song["play_count"] for song in songs), reverse=True)
+    top_share = sum(play_counts[:200]) / sum(play_counts)
+    assert top_share > 0.5, "The top 1% of songs should get most plays"
+
+    songs_per_artist = {}
+    for song in songs:
+        songs_per_artist[song["artist"]] = songs_per_artist.get(song["artist"], 0) + 1
+    counts = sorted(songs_per_artist.values())
+    assert counts[len(counts) // 2] <= 3 and counts[-1] > 100 * counts[len(counts) // 2]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("workers", [0, 2])
+async def test_generate_dataset_inserts_every_chunk(workers):
+    """Test the dataset is the same whether chunks are generated inline or in processes"""
+    db_service = FakeDatabaseService()
+
+    inserted = await DataGenerator.generate_dataset(db_service, 2500, seed=3, chunk_size=1000, workers=workers,
+                                                    current_time=NOW)
+
+    assert inserted == 2500
+    expected = list(DataGenerator.generate_song_documents(2500, seed=3, chunk_size=1000, current_time=NOW))
+    assert sorted(db_service.chunks, key=lambda chunk: chunk[0]["title"]) == expected
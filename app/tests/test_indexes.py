@@ -0,0 +1,139 @@
+from datetime import datetime
+
+import pytest
+from bson import SON
+
+from app.services.data_generator import DataGenerator
+from app.services.database import (
+    ACTIVE_SONGS, IndexSpec, ensure_indexes, index_drift, ranked_songs, song_indexes
+)
+from app.services.trending_algorithm import TrendingAlgorithm
+
+NOW = datetime(2025, 3, 1)
+
+
+class FakeIndexedCollection:
+    """Collection keeping index definitions the way list_indexes returns them"""
+
+    name = "songs"
+
+    def __init__(self, indexes=None):
+        self.indexes = {"_id_": {"name": "_id_", "key": SON([("_id", 1)])}}
+        for index in indexes or []:
+            self.indexes[index["name"]] = index
+
+    async def list_indexes(self):
+        for index in list(self.indexes.values()):
+            yield index
+
+    async def create_indexes(self, models):
+        for model in models:
+            document = model.document
+            self.indexes[document["name"]] = document
+
+    async def drop_index(self, name):
+        del self.indexes[name]
+
+
+@pytest.mark.asyncio
+async def test_ensure_indexes_creates_missing_and_reports_drift():
+    """Test missing indexes are created while changed and undeclared ones wait for prune"""
+    specs = [
+        IndexSpec("song_id_unique_index", (("song_id", 1),), unique=True),
+        IndexSpec("stats_updated_index", (("stats_updated_at", 1),)),
+    ]
+    collection = FakeIndexedCollection([
+        {"name": "stats_updated_index", "key": SON([("stats_updated_at", -1)])},
+        {"name": "genre_trending_index", "key": SON([("genre", 1), ("trending_score", -1)])},
+    ])
+
+    drift = await ensure_indexes(collection, specs)
+    assert drift.missing == [] and drift.changed == ["stats_updated_index"]
+    assert drift.unexpected == ["genre_trending_index"]
+    assert collection.indexes["song_id_unique_index"]["unique"] is True
+
+    drift = await ensure_indexes(collection, specs, prune=True)
+    assert drift.in_sync
+    assert collection.indexes["stats_updated_index"]["key"] == SON([("stats_updated_at", 1)])
+    assert await ensure_indexes(collection, specs) == drift
+
+
+@pytest.fixture
+async def songs_collection(scratch_database):
+    """Indexed songs collection of a scratch database, skips the test without a MongoDB server"""
+    collection = scratch_database.get_collection("songs")
+    documents = DataGenerator.generate_song_chunk(0, 500, 500, 1, NOW)
+    for index, document in enumerate(documents):
+        document[TrendingAlgorithm.ranking_field()] = float(document["play_count"])
+        document[TrendingAlgorithm.ranking_field("US").split(".")[0]] = {
+            region: float(plays) for region, plays in document["geographic_popularity"].items() if plays > 0
+        }
+        document["is_active"] = index % 4 != 0
+    await collection.insert_many(documents)
+    assert (await ensure_indexes(collection, song_indexes())).in_sync
+    return collection
+
+
+def plan_stages(plan: dict):
+    """Yield every stage of a query plan tree"""
+    yield plan
+    for child in [plan.get("inputStage"), plan.get("queryPlan"), *plan.get("inputStages", [])]:
+        if child:
+            yield from plan_stages(child)
+
+
+def assert_uses_index(explain: dict, index_name: str):
+    stages = list(plan_stages(explain["queryPlanner"]["winningPlan"]))
+    names = {stage.get("stage") for stage in stages}
+    assert "COLLSCAN" not in names, f"Collection scan: {stages}"
+    assert "SORT" not in names, f"In-memory sort: {stages}"
+    assert index_name in {stage.get("indexName") for stage in stages}, f"Not using {index_name}: {stages}"
+
+
+@pytest.mark.asyncio
+async def test_top_k_pages_use_the_ranking_indexes(songs_collection):
+    """Test top-K and keyset pages of active songs, overall and by genre, read an index in ranking order"""
+    field = TrendingAlgorithm.ranking_field()
+    by_genre = {"genre": "Pop"}
+    after = {field: {"$lte": 1000.0}, "$or": [{field: {"$lt": 1000.0}}, {"song_id": {"$lt": "m"}}]}
+
+    for query, index_name in [
+        ({}, f"active_{field}_keyset_index"),
+        (by_genre, f"active_genre_{field}_keyset_index"),
+        (after, f"active_{field}_keyset_index"),
+        ({**by_genre, **after}, f"active_genre_{field}_keyset_index"),
+    ]:
+        query = {**ACTIVE_SONGS, **query}
+        explain = await songs_collection.find(query).sort([(field, -1), ("song_id", -1)]).limit(100).explain()
+        assert_uses_index(explain, index_name)
+
+
+@pytest.mark.asyncio
+async def test_region_pages_use_the_region_indexes(songs_collection):
+    """Test region pages, overall and by genre, read the partial indexes of the region in ranking order"""
+    field = TrendingAlgorithm.ranking_field("IN")
+    name = field.replace(".", "_")
+
+    for query, index_name in [
+        ({}, f"active_{name}_keyset_index"),
+        ({"genre": "Pop"}, f"active_genre_{name}_keyset_index"),
+    ]:
+        query = {**ranked_songs("IN"), **query}
+        explain = await songs_collection.find(query).sort([(field, -1), ("song_id", -1)]).limit(100).explain()
+        assert_uses_index(explain, index_name)
+
+
+@pytest.mark.asyncio
+async def test_song_updates_use_the_song_id_index(songs_collection):
+    """Test updates by song_id, as sent by simulation and event ingestion, don't scan the collection"""
+    explain = await songs_collection.database.command(SON([
+        ("explain", SON([
+            ("update", songs_collection.name),
+            ("updates", [{"q": {"song_id": "song-1"}, "u": {"$inc": {"play_count": 1}}}]),
+        ])),
+        ("verbosity", "queryPlanner"),
+    ]))
+    assert_uses_index(explain, "song_id_unique_index")
+
+    explain = await songs_collection.find({**ACTIVE_SONGS, "stats_updated_at": {"$gte": NOW}}).explain()
+    assert_uses_index(explain, "active_stats_updated_index")
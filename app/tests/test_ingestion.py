@@ -0,0 +1,178 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from pydantic import ValidationError
+
+from app.models.event import EventType, SongEvent
+from app.services.database import BulkWriterError
+from app.services.ingestion import (
+    DRAINS_KEY, EventAggregator, IngestionOverloaded, RedisCounterBuffer, _draining_keys, parse_events
+)
+from app.tests.conftest import FakeCache, FakeDatabaseService, FakeSongsCollection
+
+
+def song(song_id, **fields):
+    return {
+        "song_id": song_id,
+        "play_count": 10,
+        "social_media_shares": 0,
+        "user_rating": 4.0,
+        "geographic_popularity": {"US": 10},
+        "last_played_timestamp": datetime(2025, 3, 1),
+        **fields
+    }
+
+
+def test_parse_events_accepts_json_array_and_ndjson():
+    """Test both body formats give the same events and invalid events are rejected"""
+    array = b'[{"song_id": "a", "country": "IN"}, {"song_id": "b", "type": "share", "count": 3}]'
+    ndjson = b'{"song_id": "a", "country": "IN"}\n\n{"song_id": "b", "type": "share", "count": 3}\n'
+
+    for events in (parse_events(array), parse_events(ndjson, ndjson=True)):
+        assert [(event.song_id, event.type, event.count) for event in events] == [
+            ("a", EventType.PLAY, 1), ("b", EventType.SHARE, 3)
+        ]
+
+    with pytest.raises(ValidationError):
+        parse_events(b'[{"song_id": "a", "count": 0}]')
+    with pytest.raises(ValidationError):
+        parse_events(b'{"song_id": "a", "country": "$where"}', ndjson=True)
+
+
+@pytest.mark.asyncio
+async def test_flush_applies_aggregated_counters():
+    """Test events are folded into one increment per song"""
+    collection = FakeSongsCollection([song("a"), song("b", user_rating=0.0)])
+    aggregator = EventAggregator(
+        FakeDatabaseService(songs_collection=collection), flush_interval=60, max_pending_songs=100
+    )
+
+    await aggregator.add([
+        SongEvent(song_id="a", country="US", timestamp=datetime(2025, 3, 2)),
+        SongEvent(song_id="a", count=4, country="IN", timestamp=datetime(2025, 2, 1)),
+        SongEvent(song_id="a", type=EventType.SHARE, count=2),
+        SongEvent(song_id="a", type=EventType.RATING, rating=2.0),
+        SongEvent(song_id="b", type=EventType.RATING, rating=3.0, count=2),
+    ])
+    assert await aggregator.flush() == 2
+    assert await aggregator.flush() == 0
+
+    a = collection.documents["a"]
+    assert a["play_count"] == 15
+    assert a["social_media_shares"] == 2
+    assert a["geographic_popularity"] == {"US": 11, "IN": 4}
+    assert a["last_played_timestamp"] == datetime(2025, 3, 2)
+    # The existing rating counts as one prior rating
+    assert a["user_rating"] == pytest.approx(3.0)
+
+    b = collection.documents["b"]
+    assert b["play_count"] == 10
+    assert b["user_rating"] == pytest.approx(3.0)
+    assert b["rating_count"] == 2
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_flushes_early_or_rejects_whole_batch():
+    """Test the pending songs stay bounded"""
+    collection = FakeSongsCollection([song(str(i)) for i in range(5)], latency=0.05)
+    aggregator = EventAggregator(
+        FakeDatabaseService(songs_collection=collection), flush_interval=60, max_pending_songs=2
+    )
+
+    await aggregator.add([SongEvent(song_id="0"), SongEvent(song_id="1")])
+    # Does not fit, the pending songs are flushed first
+    await aggregator.add([SongEvent(song_id="2")])
+    assert collection.documents["0"]["play_count"] == 11
+    assert aggregator.stats()["pending_songs"] == 1
+
+    await aggregator.add([SongEvent(song_id="3")])
+    flush = asyncio.create_task(aggregator.flush())
+    await asyncio.sleep(0)
+    await aggregator.add([SongEvent(song_id="4"), SongEvent(song_id="0")])
+    with pytest.raises(IngestionOverloaded):
+        await aggregator.add([SongEvent(song_id="1")])
+    await flush
+
+    assert aggregator.stats()["pending_songs"] == 2
+    await aggregator.stop()
+    assert collection.documents["1"]["play_count"] == 11
+    assert collection.documents["0"]["play_count"] == 12
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_its_counters_and_resends_them_once():
+    """Test counters of failed updates are neither lost nor counted twice when the writer fails"""
+    collection = FakeSongsCollection([song(str(i)) for i in range(4)], crash_after=1)
+    aggregator = EventAggregator(
+        FakeDatabaseService(songs_collection=collection), flush_interval=60, max_pending_songs=3
+    )
+
+    await aggregator.add([SongEvent(song_id=str(i)) for i in range(3)])
+    # The first update is written before the batch fails, the whole batch is reported failed
+    with pytest.raises(BulkWriterError):
+        await aggregator.flush()
+    assert collection.documents["0"]["play_count"] == 11
+    assert aggregator.stats()["failed_songs"] == 3
+
+    # No room is made while the database keeps failing
+    collection.crash_after = 0
+    with pytest.raises(IngestionOverloaded):
+        await aggregator.add([SongEvent(song_id="3")])
+    # Once it is back the next batch makes room by resending the failed updates
+    await aggregator.add([SongEvent(song_id="1")])
+    assert aggregator.stats()["failed_songs"] == 0
+
+    assert await aggregator.flush() == 1
+    assert [collection.documents[str(i)]["play_count"] for i in range(4)] == [11, 12, 11, 10]
+    assert aggregator.stats()["failed_songs"] == 0 and aggregator.stats()["songs_flushed"] == 4
+
+
+@pytest.mark.asyncio
+async def test_redis_counters_drain_exactly_once_after_a_crash():
+    """Test a drain that crashed midway is replayed without counting twice"""
+    collection = FakeSongsCollection([song(str(i)) for i in range(3)], crash_after=1)
+    cache = FakeCache()
+    buffer = RedisCounterBuffer(FakeDatabaseService(songs_collection=collection), cache=cache)
+
+    await buffer.add([
+        SongEvent(song_id=str(i), count=2, country="IN", timestamp=datetime(2025, 3, 2)) for i in range(3)
+    ])
+    await buffer.add([SongEvent(song_id="0", type=EventType.SHARE), SongEvent(song_id="1", type=EventType.RATING,
+                                                                               rating=5.0)])
+
+    with pytest.raises(BulkWriterError):
+        await buffer.drain()
+    # Increments arriving after the crash go to the next drain
+    await buffer.add([SongEvent(song_id="2")])
+
+    assert await buffer.drain() == 4
+    assert await buffer.drain() == 0
+    assert set(cache.client.data) == {"{counters}:drains"} and not cache.client.data["{counters}:drains"]
+
+    assert [collection.documents[str(i)]["play_count"] for i in range(3)] == [12, 12, 13]
+    assert collection.documents["0"]["social_media_shares"] == 1
+    assert collection.documents["0"]["geographic_popularity"] == {"US": 10, "IN": 2}
+    assert collection.documents["0"]["last_played_timestamp"] == datetime(2025, 3, 2)
+    assert collection.documents["1"]["user_rating"] == pytest.approx(4.5)
+
+
+@pytest.mark.asyncio
+async def test_failed_drain_keeps_its_counters_for_the_next_drain():
+    """Test counters of a drain whose writes failed are neither deleted nor forgotten"""
+    collection = FakeSongsCollection([song("0"), song("1")], crash_after=0)
+    cache = FakeCache()
+    buffer = RedisCounterBuffer(FakeDatabaseService(songs_collection=collection), cache=cache)
+    await buffer.add([SongEvent(song_id="0", count=3), SongEvent(song_id="1")])
+
+    with pytest.raises(BulkWriterError):
+        await buffer.drain()
+
+    drain_id, = [member.decode() for member in cache.client.data[DRAINS_KEY]]
+    counters_key, last_played_key = _draining_keys(drain_id)
+    assert counters_key in cache.client.data and last_played_key in cache.client.data
+    assert collection.documents["0"]["play_count"] == 10
+
+    assert await buffer.drain() == 2
+    assert not cache.client.data[DRAINS_KEY] and counters_key not in cache.client.data
+    assert [collection.documents[song_id]["play_count"] for song_id in ("0", "1")] == [13, 11]
@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from app.services.database import db_service
+from app.services.leader_election import LeaderElection
+from app.tests.conftest import FakeClock, FakeLease
+
+
+class FakeMetaCollection:
+    """trending_meta collection supporting the fenced upsert of a single document"""
+
+    def __init__(self):
+        self.documents = {}
+
+    async def update_one(self, query, update, upsert=False):
+        document = self.documents.get(query["_id"])
+        fence = query.get("fencing_token", {}).get("$not", {}).get("$gt")
+        if document is not None and fence is not None and document.get("fencing_token", 0) > fence:
+            document = None
+            if upsert:
+                raise DuplicateKeyError("E11000 duplicate key error")
+        if document is None:
+            document = self.documents.setdefault(query["_id"], {"_id": query["_id"]})
+        document.update(update["$set"])
+
+    async def find_one(self, query):
+        return self.documents.get(query["_id"])
+
+
+@pytest.fixture(params=["fake", "server"])
+def meta_collection(request, monkeypatch):
+    """trending_meta collection of the database service, in memory or on a MongoDB server"""
+    if request.param == "fake":
+        collection = FakeMetaCollection()
+    else:
+        collection = request.getfixturevalue("scratch_database").get_collection("trending_meta")
+    monkeypatch.setattr(db_service, "trending_meta_collection", collection)
+    return collection
+
+
+@pytest.mark.asyncio
+async def test_one_leader_and_takeover_after_the_lease_expires():
+    """Test only one instance leads and another takes over with a newer token once the leader stops"""
+    clock = FakeClock()
+    lease = FakeLease(clock)
+    first = LeaderElection(lease, "first", clock=clock)
+    second = LeaderElection(lease, "second", clock=clock)
+
+    assert await first.heartbeat() and not await second.heartbeat()
+    clock.now = 20
+    assert await first.heartbeat() and not await second.heartbeat()
+
+    # The first instance stops renewing, the lease expires 30s after its last heartbeat
+    clock.now = 45
+    assert not await second.heartbeat()
+    clock.now = 50
+    assert await second.heartbeat()
+    assert second.fencing_token == first.fencing_token + 1
+    assert not first.is_leader
+
+    assert not await first.heartbeat() and first.fencing_token is None
+    assert (await second.status())["leader"] == {"owner": "second", "token": 2}
+
+    await second.resign()
+    assert await first.heartbeat() and first.fencing_token == 3
+
+
+@pytest.mark.asyncio
+async def test_leader_without_redis_steps_down_and_cancels_its_work():
+    """Test a leader that can't renew stops leading once its lease may have expired"""
+    clock = FakeClock()
+    lease = FakeLease(clock)
+    election = LeaderElection(lease, "first", clock=clock)
+    await election.heartbeat()
+
+    started = asyncio.Event()
+
+    async def work(fencing_token):
+        started.set()
+        await asyncio.sleep(3600)
+
+    task = asyncio.create_task(election.run_as_leader(work))
+    await started.wait()
+
+    lease.available = False
+    clock.now = 20
+    assert await election.heartbeat(), "The lease is still valid"
+    clock.now = 31
+    assert not await election.heartbeat()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert await election.run_as_leader(work) is None
+
+
+@pytest.mark.asyncio
+async def test_stale_fencing_token_cannot_record_a_run(meta_collection):
+    """Test a former leader can neither claim nor record a run after a newer leader claimed one"""
+    now = datetime(2025, 3, 1)
+
+    # Runs recorded before leader election carry no token
+    assert await db_service.record_trending_run(now, now, False)
+    assert await db_service.claim_trending_run(1)
+    assert await db_service.claim_trending_run(2)
+
+    assert not await db_service.claim_trending_run(1)
+    assert not await db_service.record_trending_run(now, now, False, fencing_token=1)
+    assert await db_service.record_trending_run(now, now, False, fencing_token=2)
+    assert (await meta_collection.find_one({"_id": "trending_update"}))["fencing_token"] == 2
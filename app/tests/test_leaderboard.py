@@ -0,0 +1,101 @@
+import pytest
+
+from app.cache.leaderboard import SONGS_KEY, TrendingLeaderboard, leaderboard_key
+from app.models.song import Genre
+from app.settings.config import settings
+from app.tests.conftest import FakeCache, FakeDatabaseService, make_song
+
+
+@pytest.mark.asyncio
+async def test_any_page_is_served_from_the_sorted_sets():
+    """Test pages of any limit and offset match the database ranking"""
+    songs = [make_song(i, Genre.POP if i % 3 else Genre.ROCK) for i in range(30)]
+    db_service = FakeDatabaseService(songs)
+    leaderboard = TrendingLeaderboard(cache=FakeCache(), size=20)
+
+    assert await leaderboard.get_page(10) is None
+    await leaderboard.build(db_service)
+    assert await leaderboard.is_built()
+
+    for limit, offset, genre in [(10, 0, None), (7, 13, None), (5, 3, Genre.POP), (4, 8, Genre.ROCK)]:
+        page = await leaderboard.get_page(limit, offset, genre)
+        expected = await db_service.get_top_trending_songs(limit, offset, genre)
+        assert page == [song.model_dump(mode="json") for song in expected]
+
+    # Beyond the top 20 of a full set the database has to answer, a smaller set holds every song of its genre
+    assert await leaderboard.get_page(10, 15) is None
+    assert [song["song_id"] for song in await leaderboard.get_page(10, 5, Genre.ROCK)] == ["song-12", "song-09",
+                                                                                         "song-06", "song-03",
+                                                                                         "song-00"]
+    assert await leaderboard.get_page(10, 0, Genre.JAZZ) == []
+
+
+@pytest.mark.asyncio
+async def test_rebuild_replaces_the_live_keys():
+    """Test a rebuild swaps in the new ranking and leaves no build keys behind"""
+    cache = FakeCache()
+    leaderboard = TrendingLeaderboard(cache=cache, size=5)
+    await leaderboard.build(FakeDatabaseService([make_song(i, Genre.POP) for i in range(5)]))
+
+    rescored = [make_song(i, Genre.POP) for i in range(5)]
+    for song in rescored:
+        song.trending_score = -song.trending_score
+    await leaderboard.build(FakeDatabaseService(rescored))
+
+    assert [song["song_id"] for song in await leaderboard.get_page(3)] == ["song-00", "song-01", "song-02"]
+    assert not [key for key in cache.client.data if ":build:" in key]
+
+
+@pytest.mark.asyncio
+async def test_interrupted_build_leaves_only_expiring_keys(monkeypatch):
+    """Test the keys of a build that dies before the swap expire"""
+    cache = FakeCache()
+    leaderboard = TrendingLeaderboard(cache=cache, size=5)
+
+    async def rename(key, new_key):
+        raise ConnectionError("Connection closed by server")
+
+    monkeypatch.setattr(cache.client, "rename", rename)
+    with pytest.raises(ConnectionError):
+        await leaderboard.build(FakeDatabaseService([make_song(i, Genre.POP) for i in range(5)]))
+
+    build_keys = [key for key in cache.client.data if ":build:" in key]
+    assert len(build_keys) == len(Genre) + 2
+    assert all(cache.client.ttls.get(key) == settings.LEADERBOARD_TTL for key in build_keys)
+
+
+@pytest.mark.asyncio
+async def test_rescored_songs_move_without_a_rebuild():
+    """Test updated songs climb into the sets, which keep their size"""
+    songs = [make_song(i, Genre.POP if i % 2 else Genre.ROCK) for i in range(10)]
+    leaderboard = TrendingLeaderboard(cache=FakeCache(), size=4)
+    assert not await leaderboard.update_songs(songs[:1])
+    await leaderboard.build(FakeDatabaseService(songs))
+
+    risen, fallen = songs[2].model_copy(), songs[9].model_copy()
+    risen.trending_score, fallen.trending_score = 100.0, 0.5
+    assert await leaderboard.update_songs([risen, fallen])
+
+    assert [song["song_id"] for song in await leaderboard.get_page(4)] == ["song-02", "song-08", "song-07", "song-06"]
+    assert [song["song_id"] for song in await leaderboard.get_page(4, 0, Genre.ROCK)] == ["song-02", "song-08",
+                                                                                       "song-06", "song-04"]
+    # A song falling out of the top stays last until the next rebuild, song-01 never was in the set
+    assert [song["song_id"] for song in await leaderboard.get_page(4, 0, Genre.POP)] == ["song-07", "song-05",
+                                                                                      "song-03", "song-09"]
+
+
+@pytest.mark.asyncio
+async def test_trimmed_songs_lose_their_payload_once_no_set_holds_them():
+    """Test the payload hash is trimmed along with the sets"""
+    songs = [make_song(i, Genre.POP if i % 2 else Genre.ROCK) for i in range(10)]
+    cache = FakeCache()
+    leaderboard = TrendingLeaderboard(cache=cache, size=4)
+    await leaderboard.build(FakeDatabaseService(songs))
+
+    assert await leaderboard.update_songs([make_song(50, Genre.ROCK)])
+
+    # song-06 left the global set but is still ranked in rock, song-02 left the only set it was in
+    payloads = cache.client.data[SONGS_KEY]
+    assert b"song-06" in payloads and b"song-02" not in payloads
+    assert set(payloads) - {b""} == {member for key in [None, Genre.POP, Genre.ROCK]
+                                     for member in cache.client.data[leaderboard_key(key)]} - {b""}
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from app.cache.local_cache import LocalCache, TieredCache
+from app.cache.redis_cache import RedisCache
+from app.tests.conftest import FakeRedis
+
+
+class FakeRedisCache:
+    """In-memory stand-in for RedisCache recording published invalidations."""
+
+    def __init__(self):
+        self.values = {}
+        self.published = []
+        self.pubsubs = []
+        self.gets = 0
+
+    async def set(self, key, value, expiration=None, soft_expiration=None):
+        self.values[key] = value
+
+    async def get_with_ttl(self, key):
+        self.gets += 1
+        return self.values.get(key), 60
+
+    async def delete(self, key):
+        self.values.pop(key, None)
+
+    async def clear(self):
+        self.values.clear()
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+
+    def pubsub(self):
+        pubsub = FakePubSub(fail=not self.pubsubs)
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+
+class FakePubSub:
+    """Subscription whose listen fails on a lost connection or waits for messages"""
+
+    def __init__(self, fail):
+        self.fail = fail
+        self.subscribed = asyncio.Event()
+        self.resets = 0
+
+    async def subscribe(self, channel):
+        self.subscribed.set()
+
+    async def listen(self):
+        if self.fail:
+            raise ConnectionError("Connection closed by server")
+        await asyncio.sleep(3600)
+        yield
+
+    async def reset(self):
+        self.resets += 1
+
+
+def test_local_cache_lru_eviction():
+    """Test least recently used entries are evicted first"""
+    cache = LocalCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == (True, 1)
+    assert cache.get("b") == (False, None)
+    assert cache.get("c") == (True, 3)
+    assert cache.stats() == {"entries": 2, "hits": 3, "misses": 1}
+
+
+def test_local_cache_ttl():
+    """Test entries expire after the shorter of their TTL and the cache TTL"""
+    cache = LocalCache(max_entries=10, ttl=60)
+    cache.set("short", "value", ttl=0.05)
+    cache.set("expired", "value", ttl=0)
+
+    assert cache.get("short") == (True, "value")
+    assert cache.get("expired") == (False, None)
+
+    import time
+    time.sleep(0.1)
+    assert cache.get("short") == (False, None)
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_serves_from_local_and_broadcasts_invalidation():
+    """Test L1 hits skip Redis and invalidations are published to all instances"""
+    backend = FakeRedisCache()
+    cache = TieredCache(backend, LocalCache(max_entries=10, ttl=60), enabled=True)
+
+    backend.values["key"] = "value"
+    assert await cache.get("key") == "value"
+    assert await cache.get("key") == "value"
+    assert backend.gets == 1, "Second read should be served locally"
+
+    await cache.delete("key")
+    assert await cache.get("key") is None
+    assert backend.published == [(cache.channel, "key")]
+
+    await cache.set("other", "value")
+    await cache.invalidate_local()
+    assert cache.local.get("other") == (False, None)
+
+
+@pytest.mark.asyncio
+async def test_pages_of_several_patterns_are_deleted_in_one_scan():
+    """Test deleting the pages of several rankings scans the keyspace once"""
+    backend = RedisCache()
+    backend._redis = FakeRedis()
+    cache = TieredCache(backend, LocalCache(max_entries=10, ttl=60), enabled=False)
+    for key in ["trending_songs:Pop:10:0", "trending_songs:all:10:0", "trending_songs:Rock:10:0", "other"]:
+        await backend.client.set(key, b"page")
+        cache.local.set(key, b"page")
+
+    deleted = await cache.delete_matching("trending_songs:Pop:*", "trending_songs:all:*")
+
+    assert sorted(deleted) == ["trending_songs:Pop:10:0", "trending_songs:all:10:0"]
+    assert backend.client.scans == ["trending_songs:*"]
+    assert sorted(backend.client.data) == ["other", "trending_songs:Rock:10:0"]
+    assert cache.local.get("trending_songs:Pop:10:0") == (False, None)
+
+
+@pytest.mark.asyncio
+async def test_invalidation_listener_releases_failed_subscriptions():
+    """Test every subscription is reset when it fails or the listener stops, freeing its pool connection"""
+    backend = FakeRedisCache()
+    cache = TieredCache(backend, LocalCache(max_entries=10, ttl=60), enabled=True)
+    listener = asyncio.create_task(cache._listen())
+
+    # Resubscribes a second after the first subscription failed
+    for _ in range(40):
+        if len(backend.pubsubs) == 2:
+            break
+        await asyncio.sleep(0.05)
+    await asyncio.wait_for(backend.pubsubs[1].subscribed.wait(), timeout=1)
+    assert [pubsub.resets for pubsub in backend.pubsubs] == [1, 0]
+
+    listener.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await listener
+    assert [pubsub.resets for pubsub in backend.pubsubs] == [1, 1]
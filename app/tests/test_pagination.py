@@ -0,0 +1,72 @@
+import pytest
+from bson import Timestamp
+from app.api.pagination import InvalidCursor, TrendingCursor, decode_cursor, encode_cursor
+from app.constants import SCORE_MODE_CLASSIC
+from app.models.song import Genre
+from app.services.database import db_service
+from app.settings.config import settings
+from app.tests.conftest import make_song
+
+
+def test_cursor_round_trip():
+    """Test cursors survive encoding into opaque tokens"""
+    cursor = TrendingCursor(812.5, "3f1c2d", "Pop", Timestamp(1700000000, 7))
+    token = encode_cursor(cursor)
+
+    assert "=" not in token, "Tokens should be URL safe without padding"
+    assert decode_cursor(token) == cursor
+
+    cursor = TrendingCursor(-3.25, "abc")
+    assert decode_cursor(encode_cursor(cursor)) == cursor
+
+    cursor = TrendingCursor(41.0, "abc", "Rock", region="IN")
+    assert decode_cursor(encode_cursor(cursor)) == cursor
+
+
+@pytest.mark.parametrize("token", ["", "not-a-cursor", "e30", "eyJzIjogImEifQ"])
+def test_invalid_cursor_is_rejected(token):
+    """Test malformed tokens raise InvalidCursor"""
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("genre", [None, Genre.POP])
+@pytest.mark.parametrize("region", [None, "US"])
+async def test_keyset_pages_neither_overlap_nor_skip_tied_songs(monkeypatch, scratch_database, genre, region):
+    """Test paging after the last (score, song_id) position walks the ranking once, ties included"""
+    monkeypatch.setattr(settings, "TRENDING_SCORE_MODE", SCORE_MODE_CLASSIC)
+    monkeypatch.setattr(settings, "TRENDING_SNAPSHOT_READS", False)
+    collection = scratch_database.get_collection("songs")
+    monkeypatch.setattr(db_service, "db", scratch_database)
+    monkeypatch.setattr(db_service, "songs_collection", collection)
+
+    documents = []
+    for i in range(60):
+        document = make_song(i, Genre.POP if i % 3 else Genre.ROCK, is_active=i % 7 != 0).model_dump()
+        # Four distinct scores, most songs tie with others
+        document["trending_score"] = float(i % 4)
+        if i % 2:
+            document["region_scores"] = {"US": float(i % 3)}
+        documents.append(document)
+    await collection.insert_many(documents)
+
+    field = "region_scores" if region else "trending_score"
+    ranked = sorted(
+        (
+            ((document[field][region] if region else document[field]), document["song_id"])
+            for document in documents
+            if document["is_active"] and (genre is None or document["genre"] == genre.value)
+            and (region is None or field in document)
+        ),
+        reverse=True,
+    )
+
+    seen, after = [], None
+    while True:
+        songs, after, _ = await db_service.get_trending_songs_after(7, genre, after, region=region)
+        seen.extend(song["song_id"] for song in songs)
+        if len(songs) < 7:
+            break
+
+    assert seen == [song_id for _, song_id in ranked]
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from app.cache.redis_cache import MeteredConnectionPool
+from app.services.pool_metrics import MongoPoolListener, PoolStats
+
+
+class FakeConnection:
+    """Connection that never touches the network"""
+
+    def __init__(self, **kwargs):
+        self.pid = os.getpid()
+
+    async def connect(self):
+        pass
+
+    async def can_read_destructive(self):
+        return False
+
+    async def disconnect(self):
+        pass
+
+
+def test_mongo_listener_tracks_checkouts():
+    """Test pool events are turned into usage and wait statistics"""
+    stats = PoolStats(max_size=2)
+    listener = MongoPoolListener(stats)
+
+    for _ in range(2):
+        listener.connection_check_out_started(None)
+        listener.connection_checked_out(None)
+    listener.connection_check_out_started(None)
+    assert stats.snapshot()["waiting"] == 1
+    listener.connection_check_out_failed(None)
+    listener.connection_checked_in(None)
+
+    snapshot = stats.snapshot()
+    assert snapshot["in_use"] == 1 and snapshot["max_in_use"] == 2 and snapshot["saturation"] == 0.5
+    assert snapshot["waiting"] == 0 and snapshot["max_waiting"] == 1
+    assert snapshot["checkouts"] == 2 and snapshot["checkout_failures"] == 1
+
+
+@pytest.mark.asyncio
+async def test_redis_pool_waits_for_a_free_connection_and_records_saturation():
+    """Test a burst beyond max_connections waits for the pool timeout instead of failing right away"""
+    pool = MeteredConnectionPool(max_connections=1, timeout=0.05, connection_class=FakeConnection)
+
+    connection = await pool.get_connection("GET")
+    with pytest.raises(ConnectionError):
+        await pool.get_connection("GET")
+
+    snapshot = pool.stats.snapshot()
+    assert snapshot["in_use"] == 1 and snapshot["saturation"] == 1.0
+    assert snapshot["checkout_failures"] == 1
+
+    await pool.release(connection)
+    assert await pool.get_connection("GET") is connection
+    assert pool.stats.snapshot()["checkouts"] == 2
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from app.cache.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_are_coalesced():
+    """Test concurrent calls for one key share a single execution"""
+    single_flight = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    results = await asyncio.gather(*(single_flight.do("key", fetch) for _ in range(10)))
+
+    assert results == [1] * 10
+    assert calls == 1
+    assert single_flight.in_flight() == 0
+
+    assert await single_flight.do("key", fetch) == 2, "Later calls should run again"
+
+
+@pytest.mark.asyncio
+async def test_errors_are_shared_and_cancellation_is_isolated():
+    """Test waiters share errors and a cancelled waiter does not cancel the call"""
+    single_flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise ValueError("database down")
+
+    results = await asyncio.gather(
+        single_flight.do("key", failing), single_flight.do("key", failing), return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    cancelled = asyncio.ensure_future(single_flight.do("other", slow))
+    waiter = asyncio.ensure_future(single_flight.do("other", slow))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    assert await waiter == "value"
@@ -1,7 +1,10 @@
+import pytest
 from datetime import datetime, timedelta
 from app.services.trending_algorithm import TrendingAlgorithm
 from app.services.data_generator import DataGenerator
 from app.models.song import Song, Genre
+from app.constants import SCORE_MODE_CLASSIC, SCORE_MODE_DECAY_INVARIANT
+from app.settings.config import settings
 
 
 def test_trending_score_calculation():
@@ -81,3 +84,73 @@ def test_genre_filtering():
     assert len(pop_songs) <= 100, "Should return max 100 songs"
 
 
+def test_batch_scores_match_reference():
+    """Test vectorized batch scoring against the per-song reference"""
+    songs = [song.model_dump() for song in DataGenerator.generate_songs(num_songs=500)]
+    songs[0]["geographic_popularity"] = {"US": 5000}  # Sparse geography
+    current_time = datetime.utcnow()
+
+    batch_scores = TrendingAlgorithm.calculate_trending_scores_for_songs(songs, current_time)
+    reference_scores = [TrendingAlgorithm.calculate_trending_score(song, current_time) for song in songs]
+
+    assert batch_scores == pytest.approx(reference_scores, rel=1e-9)
+
+
+def test_decay_invariant_ordering_matches_classic_scores():
+    """Test the log score ranks songs like the classic trending score at a fixed query time"""
+    query_time = datetime(2025, 3, 1, 12)
+    songs = [song.model_dump() for song in DataGenerator.generate_songs(num_songs=200)]
+    for song in songs:
+        song["last_played_timestamp"] = query_time - timedelta(hours=6)
+
+    log_scores = [TrendingAlgorithm.calculate_decay_invariant_score(song) for song in songs]
+    assert TrendingAlgorithm.calculate_decay_invariant_scores_for_songs(songs) == pytest.approx(log_scores, rel=1e-9)
+
+    def ranking(scores):
+        return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+
+    # Played at the same time, songs are ranked by their engagement in both modes
+    classic_scores = [TrendingAlgorithm.calculate_trending_score(song, query_time) for song in songs]
+    assert ranking(log_scores) == ranking(classic_scores)
+
+    # With the same engagement, by how recently they were played
+    replays = [
+        {**songs[0], "last_played_timestamp": query_time - timedelta(hours=hours)} for hours in (30, 2, 75, 0, 12)
+    ]
+    assert ranking([TrendingAlgorithm.calculate_decay_invariant_score(song) for song in replays]) == ranking(
+        [TrendingAlgorithm.calculate_trending_score(song, query_time) for song in replays]
+    ) == [3, 1, 4, 0, 2]
+
+    # The decayed score is the engagement part of the classic score, halved every half-life since the last play
+    decay = 0.5 ** (6 / TrendingAlgorithm.HALF_LIFE_HOURS)
+    recency_score = decay * 100 * TrendingAlgorithm.WEIGHTS["recency"]
+    for log_score, classic_score in zip(log_scores, classic_scores):
+        expected = (classic_score - recency_score) * decay
+        assert TrendingAlgorithm.decayed_score(log_score, query_time) == pytest.approx(expected, rel=1e-9)
+
+
+@pytest.mark.parametrize("score_mode", [SCORE_MODE_CLASSIC, SCORE_MODE_DECAY_INVARIANT])
+def test_region_scores_match_reference(monkeypatch, score_mode):
+    """Test batch region scores against the per-song reference, regions without plays are left out"""
+    monkeypatch.setattr(settings, "TRENDING_SCORE_MODE", score_mode)
+    songs = [song.model_dump() for song in DataGenerator.generate_songs(num_songs=200)]
+    songs[0]["geographic_popularity"] = {"US": 100, "IN": 50, "UK": 0}
+    songs[1]["geographic_popularity"] = {}
+    current_time = datetime.utcnow()
+
+    ranking_field = TrendingAlgorithm.ranking_field()
+    region_field = TrendingAlgorithm.ranking_field("US").split(".")[0]
+    for song, fields in zip(songs, TrendingAlgorithm.score_fields_for_songs(songs, current_time)):
+        reference = TrendingAlgorithm.region_scores(song, fields[ranking_field])
+        assert fields[region_field] == pytest.approx(reference, rel=1e-9)
+
+    first = TrendingAlgorithm.score_fields_for_songs(songs[:1], current_time)[0]
+    assert set(first[region_field]) == {"US", "IN"}
+    # Half as popular in IN as in its top region, its regional score is half its trending score
+    decayed = {
+        region: TrendingAlgorithm.decayed_score(score, current_time) if score_mode == SCORE_MODE_DECAY_INVARIANT
+        else score
+        for region, score in first[region_field].items()
+    }
+    assert decayed["US"] == pytest.approx(first["trending_score"], rel=1e-9)
+    assert decayed["IN"] == pytest.approx(first["trending_score"] / 2, rel=1e-9)
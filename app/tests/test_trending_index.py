@@ -0,0 +1,60 @@
+import pytest
+from app.models.song import Genre
+from app.services.data_generator import DataGenerator
+from app.services.trending_index import TrendingIndex
+from app.tests.conftest import FakeDatabaseService
+
+
+def generate_scored_songs(num_songs):
+    songs = DataGenerator.generate_songs(num_songs=num_songs)
+    for i, song in enumerate(songs):
+        song.trending_score = float(i)
+    return songs
+
+
+@pytest.mark.asyncio
+async def test_index_serves_pages_within_k():
+    """Test pages within the top K are served from the index"""
+    db = FakeDatabaseService(generate_scored_songs(300))
+    index = TrendingIndex(size=50)
+    await index.build(db)
+
+    assert index.get(10, 0) == db.songs[:10]
+    assert index.get(20, 30) == db.songs[30:50]
+
+    pop_songs = index.get(5, 0, Genre.POP)
+    assert pop_songs == (await db.get_top_trending_songs(5, 0, Genre.POP))
+
+
+@pytest.mark.asyncio
+async def test_index_falls_back_beyond_k():
+    """Test pages beyond the top K are left to the database"""
+    db = FakeDatabaseService(generate_scored_songs(300))
+    index = TrendingIndex(size=50)
+
+    assert index.get(10, 0) is None, "Unbuilt index should not serve"
+
+    await index.build(db)
+    assert index.get(10, 45) is None
+
+
+@pytest.mark.asyncio
+async def test_index_serves_small_catalogue_completely():
+    """Test an index holding every song serves any offset"""
+    db = FakeDatabaseService(generate_scored_songs(20))
+    index = TrendingIndex(size=50)
+    await index.build(db)
+
+    assert index.get(10, 15) == db.songs[15:20]
+    assert index.get(10, 100) == []
+
+
+@pytest.mark.asyncio
+async def test_index_respects_memory_bound():
+    """Test lists are truncated to stay within max_bytes"""
+    db = FakeDatabaseService(generate_scored_songs(300))
+    index = TrendingIndex(size=200, max_bytes=7 * 50 * 1000)
+    await index.build(db)
+
+    assert index.get(10, 0) == db.songs[:10]
+    assert index.get(100, 100) is None
@@ -0,0 +1,98 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from app.constants import SCORE_MODE_CLASSIC, SCORE_MODE_DECAY_INVARIANT
+from app.services.data_generator import DataGenerator
+from app.services.trending_algorithm import TrendingAlgorithm
+from app.services.trending_job import TrendingRecomputeJob
+from app.settings.config import settings
+from app.tests.conftest import FakeDatabaseService, FakeSongsCollection
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("workers", [0, 2])
+async def test_recompute_job_scores_every_song_once(workers):
+    """Test the sharded job rescores every song with the reference scores"""
+    documents = [{"_id": ObjectId(), **song.model_dump()} for song in DataGenerator.generate_songs(num_songs=250)]
+    db = FakeDatabaseService(songs_collection=FakeSongsCollection(documents))
+    job = TrendingRecomputeJob(db, workers=workers, batch_size=20, shards=4)
+
+    current_time = datetime.utcnow()
+    processed = await job.run(current_time=current_time)
+
+    assert processed == 250
+    assert job.progress["status"] == "completed"
+    assert job.progress["shards"] == 4 and job.progress["shards_done"] == 4
+
+    expected = TrendingAlgorithm.score_fields_for_songs(documents, current_time)
+    for document, fields in zip(documents, expected):
+        stored = db.songs_collection.documents[document["_id"]]["trending_score"]
+        assert stored == pytest.approx(fields["trending_score"], rel=1e-9)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("score_mode", [SCORE_MODE_CLASSIC, SCORE_MODE_DECAY_INVARIANT])
+async def test_aggregation_backend_matches_python_scores(monkeypatch, score_mode):
+    """Test the scoring pipeline stores the same score fields as the Python implementation"""
+    monkeypatch.setattr(settings, "TRENDING_SCORE_MODE", score_mode)
+    songs = DataGenerator.generate_songs(num_songs=120)
+    songs[0].geographic_popularity = {}
+    songs[1].geographic_popularity = {"US": 0.0, "IN": 0.0}
+    documents = [{"_id": ObjectId(), **song.model_dump()} for song in songs]
+    db = FakeDatabaseService(songs_collection=FakeSongsCollection(documents))
+    job = TrendingRecomputeJob(db, batch_size=20, shards=3, backend="aggregation")
+
+    current_time = datetime.utcnow()
+    assert await job.run(current_time=current_time) == 120
+    assert db.songs_collection.merges == 3 and db.songs_collection.bulk_writes == 0
+
+    expected = TrendingAlgorithm.score_fields_for_songs(documents, current_time)
+    for document, fields in zip(documents, expected):
+        stored = db.songs_collection.documents[document["_id"]]
+        assert stored["play_count"] == document["play_count"]
+        for field, value in fields.items():
+            assert stored[field] == pytest.approx(value, rel=1e-9)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["python", "aggregation"])
+async def test_inactive_songs_are_not_rescored(backend):
+    """Test delisted songs are skipped by both scoring backends"""
+    songs = DataGenerator.generate_songs(num_songs=60)
+    for song in songs[::3]:
+        song.is_active = False
+        song.trending_score = -1.0
+    documents = [{"_id": ObjectId(), **song.model_dump()} for song in songs]
+    db = FakeDatabaseService(songs_collection=FakeSongsCollection(documents))
+    job = TrendingRecomputeJob(db, workers=0, batch_size=10, shards=2, backend=backend)
+
+    assert await job.run(current_time=datetime.utcnow()) == 40
+    for document in db.songs_collection.documents.values():
+        assert (document["trending_score"] == -1.0) != document["is_active"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("score_mode", [SCORE_MODE_CLASSIC, SCORE_MODE_DECAY_INVARIANT])
+async def test_server_side_scores_match_python_scores(monkeypatch, scratch_database, score_mode):
+    """Test MongoDB evaluates the scoring pipeline, region scores included, like the Python implementation"""
+    monkeypatch.setattr(settings, "TRENDING_SCORE_MODE", score_mode)
+    songs = DataGenerator.generate_songs(num_songs=120)
+    songs[0].geographic_popularity = {}
+    songs[1].geographic_popularity = {"US": 0.0, "IN": 0.0}
+    collection = scratch_database.get_collection("songs")
+    await collection.insert_many([song.model_dump() for song in songs])
+    # Scored as stored, with datetimes truncated to milliseconds
+    documents = await collection.find().sort("_id", 1).to_list(length=None)
+    now = datetime.utcnow()
+    current_time = now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+    job = TrendingRecomputeJob(FakeDatabaseService(songs_collection=collection), shards=3, backend="aggregation")
+    assert await job.run(current_time=current_time) == 120
+
+    expected = TrendingAlgorithm.score_fields_for_songs(documents, current_time)
+    stored = await collection.find().sort("_id", 1).to_list(length=None)
+    for document, fields in zip(stored, expected):
+        assert set(fields) <= set(document)
+        for field, value in fields.items():
+            assert document[field] == pytest.approx(value, rel=1e-9), f"{field} of {document['song_id']}"
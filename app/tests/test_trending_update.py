@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from app.api import endpoints
+from app.api.endpoints import run_trending_update
+from app.constants import SCORE_MODE_CLASSIC, SCORE_MODE_DECAY_INVARIANT
+from app.services.data_generator import DataGenerator
+from app.services.trending_algorithm import TrendingAlgorithm
+from app.settings.config import settings
+from app.tests.conftest import FakeDatabaseService, FakeSongsCollection
+
+
+@pytest.fixture(autouse=True)
+def scores_only(monkeypatch):
+    """Score in process and leave the index, leaderboard and cache refresh out of the update"""
+    async def refresh(db_service, cache):
+        pass
+
+    monkeypatch.setattr(settings, "TRENDING_JOB_WORKERS", 0)
+    monkeypatch.setattr(settings, "TRENDING_INDEX_ENABLED", False)
+    monkeypatch.setattr(settings, "LEADERBOARD_ENABLED", False)
+    monkeypatch.setattr(endpoints, "refresh_trending_cache", refresh)
+
+
+def catalogue(last_run_started_at):
+    """Songs holding a placeholder score, every third one changed since the last run"""
+    documents = []
+    for index, song in enumerate(DataGenerator.generate_songs(num_songs=30)):
+        document = {"_id": ObjectId(), **song.model_dump(), "trending_score": -1.0}
+        changed = index % 3 == 0
+        document["stats_updated_at"] = last_run_started_at + timedelta(minutes=5 if changed else -5)
+        documents.append(document)
+    return documents
+
+
+def rescored(db_service):
+    return {
+        document["song_id"]: document["trending_score"]
+        for document in db_service.songs_collection.documents.values() if document["trending_score"] != -1.0
+    }
+
+
+@pytest.mark.asyncio
+async def test_incremental_update_rescores_changed_songs_against_the_anchor(monkeypatch):
+    """Test only songs changed since the last run are rescored, at the anchor time of the last full run"""
+    monkeypatch.setattr(settings, "TRENDING_SCORE_MODE", SCORE_MODE_CLASSIC)
+    anchor_time = datetime.utcnow() - timedelta(hours=5)
+    last_run = {"started_at": anchor_time + timedelta(hours=4), "anchor_time": anchor_time, "incremental": True}
+    documents = catalogue(last_run["started_at"])
+    db_service = FakeDatabaseService(songs_collection=FakeSongsCollection(documents), trending_runs=[last_run])
+
+    assert await run_trending_update(db_service, incremental=True)
+
+    changed = [document for document in documents if document["stats_updated_at"] > last_run["started_at"]]
+    expected = TrendingAlgorithm.score_fields_for_songs(changed, anchor_time)
+    assert rescored(db_service) == pytest.approx({
+        document["song_id"]: fields["trending_score"] for document, fields in zip(changed, expected)
+    }, rel=1e-9)
+
+    recorded = db_service.trending_runs[-1]
+    assert recorded["anchor_time"] == anchor_time and recorded["incremental"]
+    assert recorded["started_at"] > last_run["started_at"]
+
+
+@pytest.mark.asyncio
+async def test_stale_anchor_falls_back_to_a_full_update(monkeypatch):
+    """Test every song is rescored and re-anchored once the anchor is TRENDING_FULL_RECOMPUTE_HOURS old"""
+    monkeypatch.setattr(settings, "TRENDING_SCORE_MODE", SCORE_MODE_CLASSIC)
+    anchor_time = datetime.utcnow() - timedelta(hours=settings.TRENDING_FULL_RECOMPUTE_HOURS, minutes=1)
+    last_run = {"started_at": anchor_time + timedelta(hours=1), "anchor_time": anchor_time, "incremental": True}
+    db_service = FakeDatabaseService(
+        songs_collection=FakeSongsCollection(catalogue(last_run["started_at"])), trending_runs=[last_run]
+    )
+
+    assert await run_trending_update(db_service, incremental=True)
+
+    assert len(rescored(db_service)) == 30
+    recorded = db_service.trending_runs[-1]
+    assert recorded["anchor_time"] == recorded["started_at"] and not recorded["incremental"]
+
+
+@pytest.mark.asyncio
+async def test_first_incremental_update_is_a_full_update(monkeypatch):
+    """Test an incremental update without a recorded run rescores every song"""
+    monkeypatch.setattr(settings, "TRENDING_SCORE_MODE", SCORE_MODE_CLASSIC)
+    db_service = FakeDatabaseService(songs_collection=FakeSongsCollection(catalogue(datetime.utcnow())))
+
+    assert await run_trending_update(db_service, incremental=True)
+
+    assert len(rescored(db_service)) == 30
+    assert not db_service.trending_runs[-1]["incremental"]
+
+
+@pytest.mark.asyncio
+async def test_decay_invariant_updates_never_fall_back(monkeypatch):
+    """Test log scores of changed songs are updated at the current time however old the anchor is"""
+    monkeypatch.setattr(settings, "TRENDING_SCORE_MODE", SCORE_MODE_DECAY_INVARIANT)
+    anchor_time = datetime.utcnow() - timedelta(hours=settings.TRENDING_FULL_RECOMPUTE_HOURS * 3)
+    last_run = {"started_at": datetime.utcnow() - timedelta(hours=1), "anchor_time": anchor_time, "incremental": True}
+    documents = catalogue(last_run["started_at"])
+    db_service = FakeDatabaseService(songs_collection=FakeSongsCollection(documents), trending_runs=[last_run])
+
+    assert await run_trending_update(db_service, incremental=True)
+
+    changed = {document["song_id"] for document in documents if document["stats_updated_at"] > last_run["started_at"]}
+    assert set(rescored(db_service)) == changed
+    recorded = db_service.trending_runs[-1]
+    assert recorded["incremental"] and recorded["anchor_time"] == recorded["started_at"]